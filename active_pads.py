@@ -0,0 +1,212 @@
+"""
+The pads currently held on Push, in the order they were pressed.
+
+The app asks which chord is playing, with which velocity and which modifiers on every press and
+release. ActivePadStack keeps indexes up to date as pads are pressed and released so those are
+lookups instead of scans of the whole stack:
+    - the pads holding a chord, in press order (the last one is the playing chord)
+    - the latest pad of each pad type
+    - the modifiers of the held pads, aggregated on demand and cached until the stack changes
+
+Each held pad has a slot (_Held) and the indexes are keyed on the slots, such that replace (eg. a
+held chord pad on a key change) swaps the pad in its slot without moving anything.
+
+Bank pads can change what they hold while held (recording, delete), call refresh after that.
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+from fun_chord import FunChord
+from fun_pad import FunPad, BankPad
+
+
+class _Held(object):
+    """
+    Place of a held pad in the stack.
+    """
+    __slots__ = ('pad', 'velocity', 'order')
+
+    def __init__(self, pad: FunPad, velocity: int, order: int):
+        self.pad = pad
+        self.velocity = velocity
+        self.order = order  # press number, to compare pads across indexes
+
+
+class ActivePadStack(object):
+    def __init__(self):
+        self._held: Dict[FunPad, _Held] = dict()
+        self._stack: Dict[_Held, None] = OrderedDict()  # held pads, in press order
+        self._presses = 0
+
+        self._chord_pads: Dict[_Held, None] = OrderedDict()  # held pads with a chord, in press order
+        self._by_type: Dict[type, Dict[_Held, None]] = dict()  # pad type -> held pads, in press order
+
+        # Aggregated modifiers, None when they need to be recomputed.
+        self._modifiers: Optional[List] = None
+        self._modifier_pads: Optional[List[FunPad]] = None
+
+    def __len__(self):
+        return len(self._stack)
+
+    def __iter__(self):
+        return (held.pad for held in self._stack)
+
+    def __contains__(self, pad):
+        return pad in self._held
+
+    def __repr__(self):
+        return "ActivePadStack({})".format([(held.pad, held.velocity) for held in self._stack])
+
+    def append(self, pad: FunPad, velocity: int):
+        """
+        Add pad on top of the stack. A pad that's already held is moved to the top.
+        """
+        if pad in self._held:
+            self.remove(pad)
+
+        self._presses += 1
+        held = self._held[pad] = _Held(pad, velocity, self._presses)
+        self._stack[held] = None
+        self._by_type.setdefault(type(pad), OrderedDict())[held] = None
+        if pad.get_chord() is not None:
+            self._chord_pads[held] = None
+        self._modifiers = self._modifier_pads = None
+
+    def remove(self, pad: FunPad) -> bool:
+        """
+        Removes pad from the stack.
+        Returns True if that's the playing chord (top chord pad of the stack), false otherwise.
+        """
+        if len(self._stack) == 0:
+            print("Warning: tried to remove chord from empty stack. This is likely because the pad was pressed before push was ready.")
+            return False
+
+        held = self._held.pop(pad, None)
+        if held is None:
+            return False
+
+        was_active = pad is self.get_active_pad()
+
+        del self._stack[held]
+        self._chord_pads.pop(held, None)
+        same_type = self._by_type[type(pad)]
+        del same_type[held]
+        if not same_type:
+            del self._by_type[type(pad)]
+        self._modifiers = self._modifier_pads = None
+
+        return was_active
+
+    def refresh(self, pad: FunPad):
+        """
+        Update the indexes after pad changed what it holds (eg. a bank pad storing a chord).
+        """
+        held = self._held.get(pad)
+        if held is None:
+            return
+
+        has_chord = pad.get_chord() is not None
+        if has_chord != (held in self._chord_pads):
+            # Rare, so rebuild such that the chord pads stay in press order.
+            self._reindex()
+        self._modifiers = self._modifier_pads = None
+
+    def replace(self, pad: FunPad, new_pad: FunPad):
+        """
+        Put new_pad in place of pad, with the same velocity and place in the stack (eg. the same
+        chord pad in another key).
+        """
+        held = self._held.pop(pad, None)
+        if held is None:
+            return
+
+        held.pad = new_pad
+        self._held[new_pad] = held
+        if type(new_pad) is not type(pad) or (new_pad.get_chord() is None) != (pad.get_chord() is None):
+            self._reindex()  # rare: the pad changes type or gains or loses its chord
+        self._modifiers = self._modifier_pads = None
+
+    def _reindex(self):
+        """
+        Rebuild the chord pad and pad type indexes from the stack.
+        """
+        self._chord_pads = OrderedDict()
+        self._by_type = dict()
+        for held in self._stack:
+            self._by_type.setdefault(type(held.pad), OrderedDict())[held] = None
+            if held.pad.get_chord() is not None:
+                self._chord_pads[held] = None
+        self._modifiers = self._modifier_pads = None
+
+    def get_active_pad(self) -> Optional[FunPad]:
+        """
+        Last pressed pad that has a chord, None if there's none.
+        """
+        if not self._chord_pads:
+            return None
+        return next(reversed(self._chord_pads)).pad
+
+    def get_active_chord(self) -> Optional[FunChord]:
+        active_pad = self.get_active_pad()
+        if active_pad is not None:
+            return active_pad.get_chord()
+
+    def get_active_chord_velocity(self) -> Optional[int]:
+        if not self._chord_pads:
+            return None
+        return next(reversed(self._chord_pads)).velocity
+
+    def has_chords(self) -> bool:
+        return len(self._chord_pads) > 0
+
+    def get_latest_by_type(self, pad_type) -> Union[FunPad, type(None)]:
+        """
+        Get the last pad by type (subclasses included). Returns None if not found.
+        """
+        latest = None
+        for held_type, same_type in self._by_type.items():
+            if issubclass(held_type, pad_type):
+                held = next(reversed(same_type))
+                if latest is None or held.order > latest.order:
+                    latest = held
+        return latest.pad if latest is not None else None
+
+    def get_all_by_type(self, pad_type) -> List[FunPad]:
+        """
+        Every held pad of a type (subclasses included).
+        """
+        pads = []
+        for held_type, same_type in self._by_type.items():
+            if issubclass(held_type, pad_type):
+                pads.extend(held.pad for held in same_type)
+        return pads
+
+    def _aggregate_modifiers(self):
+        mods = []
+        mod_pads = []
+        for pad in self:
+            if type(pad) is BankPad:
+                mods += pad.get_modifier()
+                mod_pads += pad.modifier_pads
+            else:
+                mod = pad.get_modifier()
+                if mod is not None:
+                    mods.append(mod)
+                    mod_pads.append(pad)
+        self._modifiers = mods
+        self._modifier_pads = mod_pads
+
+    def get_modifiers(self) -> List:
+        """
+        Modifier functions of the held pads in press order, including the ones stored in bank pads.
+        """
+        if self._modifiers is None:
+            self._aggregate_modifiers()
+        return list(self._modifiers)
+
+    def get_modifier_pads(self) -> List[FunPad]:
+        if self._modifier_pads is None:
+            self._aggregate_modifiers()
+        return list(self._modifier_pads)
+
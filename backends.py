@@ -0,0 +1,122 @@
+"""
+Simulated Push 2 and midi output, to drive FunChordApp without hardware.
+
+FakePush2 implements the parts of push2_python.Push2 the app uses (pads, buttons, display, f_stop)
+and keeps the state of the LEDs and the last display frame in memory. Button names and the frame
+format are the ones in push_constants, so push2_python doesn't need to be installed. FakeMidiOut
+implements the parts of a mido output port the app uses and records every message it receives with
+a timestamp.
+
+    app = FunChordApp(push=FakePush2(), midi_out_port=FakeMidiOut())
+    app.on_pad_pressed((4, 0), 100)
+    app.midi_out_port.messages  # [(timestamp, Message('note_on', ...)), ...]
+"""
+
+import threading
+import time
+from typing import TYPE_CHECKING, List, Tuple
+
+from led_frame import PUSH_PAD_ROWS, PUSH_PAD_COLS
+
+if TYPE_CHECKING:
+    import mido
+
+
+class FakePads(object):
+    def __init__(self):
+        self.colors = [['black'] * PUSH_PAD_COLS for _ in range(PUSH_PAD_ROWS)]
+        self.writes = 0  # number of pad colors sent, like midi messages to the hardware
+
+    def set_pad_color(self, pad_ij: Tuple[int, int], color: str = 'white', animation=None):
+        self.colors[pad_ij[0]][pad_ij[1]] = color
+        self.writes += 1
+
+    def set_pads_color(self, color_matrix, animation=None):
+        for i, row in enumerate(color_matrix):
+            for j, color in enumerate(row):
+                self.set_pad_color((i, j), color)
+
+    def set_all_pads_to_color(self, color: str = 'white', animation=None):
+        self.set_pads_color([[color] * PUSH_PAD_COLS for _ in range(PUSH_PAD_ROWS)])
+
+    def set_all_pads_to_black(self, animation=None):
+        self.set_all_pads_to_color('black')
+
+
+class FakeButtons(object):
+    def __init__(self):
+        self.colors = dict()  # button name -> color
+        self.writes = 0
+
+    def set_button_color(self, button_name: str, color: str = 'white', animation=None):
+        self.colors[button_name] = color
+        self.writes += 1
+
+    def set_all_buttons_color(self, color: str = 'white', animation=None):
+        for button_name in list(self.colors):
+            self.set_button_color(button_name, color)
+
+
+class FakeDisplay(object):
+    def __init__(self):
+        self.frame = None  # last frame sent
+        self.frames = 0  # number of frames sent
+
+    def display_frame(self, frame, input_format=None):
+        self.frame = frame
+        self.frames += 1
+
+
+class FakePush2(object):
+    """
+    In memory Push 2. Input is simulated by calling the app's on_pad_*/on_button_* methods.
+    """
+    def __init__(self):
+        self.pads = FakePads()
+        self.buttons = FakeButtons()
+        self.display = FakeDisplay()
+        self.f_stop = threading.Event()
+
+
+class FakeMidiOut(object):
+    """
+    Midi output port that records (time.perf_counter() timestamp, message) pairs.
+    """
+    def __init__(self, name: str = 'Fake Funchord Port'):
+        self.name = name
+        self.closed = False
+        self.messages: List[Tuple[float, 'mido.Message']] = []
+        self._lock = threading.Lock()
+
+    def send(self, msg):
+        assert not self.closed, "Sent {} to closed port {}".format(msg, self.name)
+        with self._lock:
+            self.messages.append((time.perf_counter(), msg))
+
+    def send_many(self, msgs):
+        """
+        Write several messages at once (see voice_allocator).
+        """
+        assert not self.closed, "Sent {} to closed port {}".format(msgs, self.name)
+        now = time.perf_counter()
+        with self._lock:
+            self.messages.extend((now, msg) for msg in msgs)
+
+    def close(self):
+        self.closed = True
+
+    def clear(self):
+        with self._lock:
+            self.messages = []
+
+    def sounding_notes(self) -> set:
+        """
+        Notes that received a note on without a matching note off.
+        """
+        notes = set()
+        for _, msg in self.messages:
+            if msg.type == 'note_on' and msg.velocity > 0:
+                notes.add(msg.note)
+            elif msg.type in ('note_off', 'note_on'):
+                notes.discard(msg.note)
+        return notes
@@ -0,0 +1,254 @@
+"""
+Microbenchmarks for the harmony code. These run without a Push 2 or midi port.
+
+Results can be saved as a JSON baseline, and later runs checked against it such that performance
+work can be accepted (or rejected) safely. Baselines are only comparable on the same machine.
+
+Usage:
+    python benchmark.py                                   # print results
+    python benchmark.py --save baseline.json              # record a baseline
+    python benchmark.py --check baseline.json             # fail if anything is >20% slower
+    python benchmark.py --check baseline.json --gate FunChord.tones --threshold 0.1
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import timeit
+from typing import Callable, Dict
+
+import note_util
+from fun_chord import FunChord, ScaleNote
+from fun_pad import rids_from_chord, PadRegistry, PianoNotePad
+from led_frame import LedFrame
+from chord_mod import all_mods
+from voicing import voice, voicing_function, spread_offsets
+from voice_allocator import VoiceAllocator
+from backends import FakeMidiOut
+from voice_leading import VoiceLeader, lead_progression
+from chord_index import ScaleChordIndex
+import fretboard
+
+Benchmarks = Dict[str, Callable[[], object]]
+
+
+def time_per_call(func, repeat=5, min_time=0.2) -> float:
+    """
+    Best time per call of func in microseconds, over a few repeats.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def scale_note_benchmarks() -> Benchmarks:
+    degree = ScaleNote(2)
+    seventh = ScaleNote('b7')
+
+    return {
+        'ScaleNote(str)': lambda: ScaleNote('#11'),
+        'ScaleNote + ScaleNote': lambda: degree + seventh,
+        'ScaleNote + int': lambda: degree + 4,
+        'ScaleNote == ScaleNote': lambda: degree == seventh,
+    }
+
+
+def fun_chord_benchmarks() -> Benchmarks:
+    chord = FunChord('Cmaj', 2, additions=['7', '9'])
+
+    return {
+        'FunChord(...)': lambda: FunChord('Cmaj', 2, additions=['7', '9']),
+        'FunChord.scale_notes': chord.scale_notes,
+        # tones are cached per chord, so also time computing them
+        'FunChord.tones': chord.tones,
+        'FunChord.tones uncached': lambda: [chord.tonify_note(note) for note in chord.scale_notes()],
+    }
+
+
+def chord_mod_benchmarks() -> Benchmarks:
+    chord = FunChord('Cmaj', 2)
+
+    benchmarks = {}
+    for mod in all_mods:
+        func = mod.get_func()
+        benchmarks['chord_mod.{}'.format(mod)] = lambda func=func: func(chord)
+        # modifiers are memoized, so also time the modifier itself
+        unmemoized = getattr(func, '__wrapped__', func)
+        benchmarks['chord_mod.{} uncached'.format(mod)] = lambda func=unmemoized: func(chord)
+    return benchmarks
+
+
+def voicing_benchmarks() -> Benchmarks:
+    chord = FunChord('Cmaj', 2, additions=['7', '9'])
+    voicing_center = note_util.name_to_midi('C3')
+
+    benchmarks = {}
+    for voicing_type in voicing_function:
+        try:
+            voice(chord, voicing_center, 2, True, voicing_type)
+        except NotImplementedError:
+            continue
+        benchmarks['voice {}'.format(voicing_type.name)] = \
+            lambda voicing_type=voicing_type: voice(chord, voicing_center, 2, True, voicing_type)
+
+    # Search of a spread for a 7 note chord, which has the most candidates.
+    thirteenth = note_util.tones_to_mask([0, 2, 4, 5, 7, 9, 11])
+    benchmarks['spread_offsets uncached 7 notes'] = lambda: spread_offsets.__wrapped__(thirteenth)
+    return benchmarks
+
+
+def note_util_benchmarks() -> Benchmarks:
+    return {
+        'note_util.name_to_midi': lambda: note_util.name_to_midi('Db3'),
+        'note_util.midi_to_name': lambda: note_util.midi_to_name(61, include_octave=True, accidental_preference='b'),
+    }
+
+
+def registry_benchmarks() -> Benchmarks:
+    chord = FunChord('Cmaj', 5, additions=['7'])
+    # Three octaves of piano, such that each note has three pads.
+    registry = PadRegistry([[PianoNotePad(divmod(idx, 8), idx % 12) for idx in range(36)]])
+    leds = LedFrame()
+
+    def highlight_chord():
+        rids = rids_from_chord(chord)
+        registry.highlight(leds, rids)
+        registry.release_highlight(leds, rids)
+    return {
+        'rids_from_chord': lambda: rids_from_chord(chord),
+        'PadRegistry.highlight 3 octaves': highlight_chord,
+    }
+
+
+def voice_allocator_benchmarks() -> Benchmarks:
+    # C - Am, two common tones. The port is cleared such that it doesn't grow during the run.
+    port = FakeMidiOut()
+    voices = VoiceAllocator(port)
+    chords = [(48, 60, 64, 67), (57, 60, 64, 69)]
+
+    def change_chord():
+        for notes in chords:
+            voices.play(notes, 100)
+        port.clear()
+    return {
+        'VoiceAllocator.play chord change': change_chord,
+    }
+
+
+def voice_leading_benchmarks() -> Benchmarks:
+    center = note_util.name_to_midi('C3')
+    progression = [FunChord('Cmaj', degree, additions=['7']) for degree in (1, 6, 2, 5, 3, 6, 4, 5)]
+    leader = VoiceLeader(center)
+    live_chords = itertools.cycle(progression)
+    return {
+        'VoiceLeader.voice': lambda: leader.voice(next(live_chords)),
+        'lead_progression 32 chords': lambda: lead_progression(progression * 4, center),
+    }
+
+
+def chord_index_benchmarks() -> Benchmarks:
+    index = ScaleChordIndex('Dmaj')
+    note_mask = note_util.tones_to_mask([2, 6, 11])  # D F# B
+    return {
+        'ScaleChordIndex.matching_pads': lambda: index.matching_pads(note_mask),
+    }
+
+
+def fretboard_benchmarks() -> Benchmarks:
+    # Slowest search out of the chords the pads can play, found by running fretboard.py.
+    worst_mask = note_util.tones_to_mask([0, 2, 4, 5, 9, 11])
+    chord = FunChord('Cmaj', 5, additions=['7'])
+    fretboard.chord_voicings(chord)
+    return {
+        'fretboard.search worst case': lambda: fretboard.search(worst_mask, 0),
+        'fretboard.chord_voicings cached': lambda: fretboard.chord_voicings(chord),
+    }
+
+
+def all_benchmarks() -> Benchmarks:
+    benchmarks = {}
+    for group in (scale_note_benchmarks, fun_chord_benchmarks, chord_mod_benchmarks,
+                  voicing_benchmarks, note_util_benchmarks, registry_benchmarks,
+                  voice_allocator_benchmarks, voice_leading_benchmarks, chord_index_benchmarks,
+                  fretboard_benchmarks):
+        benchmarks.update(group())
+    return benchmarks
+
+
+def run(benchmarks: Benchmarks, min_time=0.2) -> Dict[str, float]:
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = time_per_call(func, min_time=min_time)
+        print("{:<36}{:>10.3f} us".format(name, results[name]))
+    return results
+
+
+def save_baseline(path: str, results: Dict[str, float]):
+    baseline = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print("Saved baseline to {}".format(path))
+
+
+def check_baseline(path: str, results: Dict[str, float], threshold: float, gates=None) -> bool:
+    """
+    Compare results to a baseline. Returns False if a gated benchmark (all of them by default) is
+    slower than the baseline by more than threshold (eg. 0.2 for 20%).
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+
+    passed = True
+    print()
+    print("{:<36}{:>12}{:>12}{:>9}".format('vs ' + path, 'baseline', 'now', 'change'))
+    for name, now in results.items():
+        if name not in baseline:
+            print("{:<36}{:>12}{:>12.3f}".format(name, 'new', now))
+            continue
+
+        change = now / baseline[name] - 1.
+        gated = gates is None or name in gates
+        regressed = gated and change > threshold
+        passed = passed and not regressed
+        print("{:<36}{:>12.3f}{:>12.3f}{:>+8.0%}{}".format(
+            name, baseline[name], now, change, '  REGRESSED' if regressed else ''))
+
+    for name in (gates or []):
+        if name not in results:
+            print("Warning: gated benchmark '{}' does not exist.".format(name))
+
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', metavar='BASELINE', help="Save the results as a JSON baseline.")
+    parser.add_argument('--check', metavar='BASELINE', help="Compare the results to a JSON baseline.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Allowed slowdown before failing the check, eg. 0.2 for 20%%.")
+    parser.add_argument('--gate', action='append', metavar='NAME',
+                        help="Only fail the check for these benchmarks. Defaults to all of them.")
+    parser.add_argument('--filter', help="Only run benchmarks whose name contains this.")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="Minimum time in seconds spent on each repeat of a benchmark.")
+    args = parser.parse_args()
+
+    benchmarks = all_benchmarks()
+    if args.filter:
+        benchmarks = {name: func for name, func in benchmarks.items() if args.filter in name}
+
+    results = run(benchmarks, min_time=args.min_time)
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.check and not check_baseline(args.check, results, args.threshold, args.gate):
+        print("\nBenchmarks regressed more than {:.0%}.".format(args.threshold))
+        sys.exit(1)
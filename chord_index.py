@@ -0,0 +1,169 @@
+"""
+Inverted index from notes to the chords that contain them, to discover chords by playing notes.
+
+Every chord reachable from the chord pads of a scale, ie. each degree with each set of modifiers, is
+given an id. For each pitch class, the index keeps a bitset (an int) of the chords that contain it,
+so the chords containing every held note are the AND of one bitset per note. Which chord and
+modifier pads can play them is one more AND per pad.
+
+The chords of a scale only depend on its quality once transposed, so an index is built once per
+quality in C and queries are rotated by the scale's root. Switching between scales of the same
+quality costs nothing, and other qualities are built the first time they're used (see
+ChordIndex.for_scale_quality).
+"""
+
+from itertools import combinations
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import note_util
+import scales
+from fun_chord import FunChord
+from chord_mod import FunMod, all_mods
+
+
+class ChordIndex(object):
+    _built: Dict[str, 'ChordIndex'] = dict()  # scale quality -> index
+    _build_lock = threading.Lock()
+
+    def __init__(self, scale_quality: str, mods: Sequence[FunMod] = all_mods):
+        """
+        Index the chords of the scale quality (eg. 'maj', see scales) in C, for every degree and
+        set of mods.
+        """
+        self.scale_quality = scale_quality
+        self.degrees = scales.SCALES[scale_quality].degrees()
+        self.mods = list(mods)
+
+        # Chord id -> (degree, mods), with the fewest mods giving each distinct chord, such that
+        # a modifier that doesn't change a chord isn't suggested for it.
+        self.chords: List[Tuple[int, Tuple[FunMod, ...]]] = []
+        self.masks: List[int] = []  # chord id -> pitch class mask
+        seen = set()
+        for degree in self.degrees:
+            base_chord = FunChord('C' + scale_quality, degree)
+            for mod_count in range(len(self.mods) + 1):
+                for chord_mods in combinations(self.mods, mod_count):
+                    chord = base_chord
+                    for mod in chord_mods:
+                        chord = mod.get_func()(chord)
+                    if chord in seen:
+                        continue
+                    seen.add(chord)
+                    self.chords.append((degree, chord_mods))
+                    self.masks.append(chord.pitch_class_mask)
+
+        # Pitch class -> bitset of the chords containing it.
+        self.containing = [0] * 12
+        # Pad -> bitset of the chords it's part of.
+        self.degree_chords = {degree: 0 for degree in self.degrees}
+        self.mod_chords = {mod: 0 for mod in self.mods}
+        # Number of mods -> bitset of the chords needing that many.
+        self.mod_count_chords = [0] * (len(self.mods) + 1)
+        for chord_id, ((degree, chord_mods), mask) in enumerate(zip(self.chords, self.masks)):
+            bit = 1 << chord_id
+            for tone in note_util.mask_to_tones(mask):
+                self.containing[tone] |= bit
+            self.degree_chords[degree] |= bit
+            for mod in chord_mods:
+                self.mod_chords[mod] |= bit
+            self.mod_count_chords[len(chord_mods)] |= bit
+
+        self.all_chords = (1 << len(self.chords)) - 1
+
+    @classmethod
+    def for_scale_quality(cls, scale_quality: str) -> 'ChordIndex':
+        index = cls._built.get(scale_quality)
+        if index is None:
+            with cls._build_lock:
+                index = cls._built.get(scale_quality)
+                if index is None:
+                    index = cls._built[scale_quality] = cls(scale_quality)
+        return index
+
+    def __len__(self):
+        return len(self.chords)
+
+    def matching_chords(self, note_mask: int, scale_root_tone: int = 0) -> int:
+        """
+        Bitset of the ids of the chords containing every note in note_mask (absolute pitch
+        classes, bit 0 is C), in the scale with the given root.
+        """
+        matches = self.all_chords
+        for tone in note_util.mask_to_tones(note_util.rotate_mask(note_mask, -scale_root_tone)):
+            matches &= self.containing[tone]
+            if not matches:
+                break
+        return matches
+
+    def simplest(self, matches: int) -> int:
+        """
+        Keep the chords with the fewest modifiers out of matches. Almost every note is in some
+        chord of every degree once enough modifiers are added, so suggesting all of them is noise.
+        """
+        for chords in self.mod_count_chords:
+            if matches & chords:
+                return matches & chords
+        return 0
+
+    def matching_pads(self, note_mask: int, scale_root_tone: int = 0) -> Tuple[List[int], List[FunMod]]:
+        """
+        Degrees and modifiers of the simplest chords containing every note in note_mask.
+        """
+        matches = self.simplest(self.matching_chords(note_mask, scale_root_tone))
+        if not matches:
+            return [], []
+        degrees = [degree for degree, chords in self.degree_chords.items() if chords & matches]
+        mods = [mod for mod, chords in self.mod_chords.items() if chords & matches]
+        return degrees, mods
+
+    def chords_from_bitset(self, matches: int) -> List[Tuple[int, Tuple[FunMod, ...]]]:
+        chords = []
+        while matches:
+            lowest = matches & -matches
+            chords.append(self.chords[lowest.bit_length() - 1])
+            matches ^= lowest
+        return chords
+
+
+class ScaleChordIndex(object):
+    """
+    ChordIndex of a scale: rotates queries by the scale's root. The index is built on first use.
+    """
+    def __init__(self, scale_name: str):
+        _, self.scale_root_tone, scale = scales.parse_scale_name(scale_name)
+        self.scale_name = scale_name
+        self.scale_quality = scale.name
+        self._index = None
+
+    @property
+    def index(self) -> ChordIndex:
+        if self._index is None:
+            self._index = ChordIndex.for_scale_quality(self.scale_quality)
+        return self._index
+
+    def matching_chords(self, note_mask: int) -> List[Tuple[int, Tuple[FunMod, ...]]]:
+        """
+        (degree, mods) of the chords containing every note in note_mask.
+        """
+        return self.index.chords_from_bitset(self.index.matching_chords(note_mask, self.scale_root_tone))
+
+    def matching_pads(self, note_mask: int) -> Tuple[List[int], List[FunMod]]:
+        return self.index.matching_pads(note_mask, self.scale_root_tone)
+
+
+if __name__ == "__main__":
+    import timeit
+
+    index = ScaleChordIndex('Dmaj')
+    print("{} distinct chords in {}".format(len(index.index), index.scale_name))
+    for notes in (['D'], ['F#', 'C#'], ['D', 'G', 'C#'], ['C']):
+        note_mask = note_util.tones_to_mask([note_util.name_to_number[note] for note in notes])
+        degrees, mods = index.matching_pads(note_mask)
+        print("{}: degrees {}, mods {}, {} chords".format(
+            notes, degrees, mods, len(index.matching_chords(note_mask))))
+
+    note_mask = note_util.tones_to_mask([2, 6])
+    number = 100000
+    seconds = timeit.timeit(lambda: index.matching_pads(note_mask), number=number)
+    print("matching_pads: {:.2f} us".format(seconds / number * 1e6))
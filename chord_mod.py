@@ -1,8 +1,12 @@
 """
 This file contains all of the chord modifier functions. Each modifier takes a FunChord, and returns
 a new FunChord. There's also colors for modifiers/groups of modifiers in here.
+
+FunChords are interned and immutable, so modifiers are memoized: applying a modifier to a chord it
+has seen before is a dictionary lookup.
 """
 
+from functools import lru_cache
 from typing import Callable, List
 from fun_chord import FunChord, ScaleNote
 
@@ -28,6 +32,7 @@ class FunMod(object):
 
 # Sus
 sus_color = 'blue'
+@lru_cache(maxsize=None)
 def sus2(chord: FunChord) -> FunChord:
     if ScaleNote(3) not in chord.triad_notes():
         # Only sus if there's a 3 to substitute
@@ -45,6 +50,7 @@ def sus2(chord: FunChord) -> FunChord:
         additions=new_additions,
         omissions=new_omissions)
 
+@lru_cache(maxsize=None)
 def sus4(chord: FunChord) -> FunChord:
     if ScaleNote(3) not in chord.triad_notes():
         # Only sus if there's a 3 to substitute
@@ -88,6 +94,7 @@ def augmented(chord: FunChord) -> FunChord:
     raise NotImplementedError
 
 # TODO: implement augmented <-> diminished
+@lru_cache(maxsize=None)
 def parallel(chord: FunChord) -> FunChord:
     new_additions = chord.copy_additions()
     new_omissions = chord.copy_omissions()
@@ -126,15 +133,19 @@ def extend(chord: FunChord, extended_note: List[int], omissions=[]) -> FunChord:
         additions=new_additions,
         omissions=new_omissions)
 
+@lru_cache(maxsize=None)
 def add7(chord: FunChord) -> FunChord:
     return extend(chord, [7])
 
+@lru_cache(maxsize=None)
 def add6(chord: FunChord) -> FunChord:
     return extend(chord, [6], omissions=[7])
 
+@lru_cache(maxsize=None)
 def add9(chord: FunChord) -> FunChord:
     return extend(chord, [7, 9])
 
+@lru_cache(maxsize=None)
 def add11(chord: FunChord) -> FunChord:
     return extend(chord, [7, 9, 11])
 
@@ -147,6 +158,12 @@ extension_color = 'blue'
 for extension_mod in [Add6, Add7, Add9, Add11]:
     mod_color_map[extension_mod] = extension_color
 
+# Every modifier a pad can apply. Keep in sync when adding modifiers.
+all_mods = [Sus2, Sus4, Parallel, Add6, Add7, Add9, Add11]
+# Modifiers that rewrite the third, so applying them in another order gives another chord. The
+# others only add notes and give the same chord in any order (see chord_table.canonical_modifiers).
+order_dependent_mods = [Sus2, Sus4, Parallel]
+
 # Borrowed scale
 def seconday_fifth(chord: FunChord) -> FunChord:
     new_additions = chord.copy_additions()
@@ -0,0 +1,240 @@
+"""
+Precompiled table of voiced chords.
+
+Every chord a pad can play (each key, each degree, each combination of modifiers) is computed once
+at startup for the app's voicing settings, such that pressing a pad is a single dictionary lookup.
+Modifiers are looked up in the order of chord_mod.all_mods when that gives the same chord (see
+canonical_modifiers). Anything missing from the table (eg. Parallel pressed before Sus2, or a key
+that isn't built yet) is computed the slow way through FunChord, and kept in the bounded voicing_cache (see
+voicing) instead of growing the table.
+
+Building every key takes a few hundred milliseconds, so the app only builds its active key before
+the pads are playable and the rest with build_in_background. When the voicing center moves, the
+table of the old center is dropped with invalidate and the new one is built the same way.
+"""
+
+from itertools import combinations
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import note_util
+import scales
+from fun_chord import FunChord
+from chord_mod import all_mods, order_dependent_mods
+from voicing import voice, voicing_cache, VoicingType
+
+if TYPE_CHECKING:
+    from chord_mod import FunMod
+
+ModFunc = Callable[[FunChord], FunChord]
+
+# (voicing center, voicing range, bass note, voicing type)
+VoicingSettings = Tuple[int, int, bool, VoicingType]
+# (scale name, degree, modifier functions in application order)
+ChordKey = Tuple[str, int, Tuple[ModFunc, ...]]
+
+
+# Place of each modifier function in all_mods, the order the table is built in.
+_MOD_RANKS: Dict[ModFunc, int] = {mod.get_func(): rank for rank, mod in enumerate(all_mods)}
+_ORDER_DEPENDENT = frozenset(mod.get_func() for mod in order_dependent_mods)
+
+
+def canonical_modifiers(modifiers: Tuple[ModFunc, ...]) -> Optional[Tuple[ModFunc, ...]]:
+    """
+    The modifiers in all_mods order if that gives the same chord, None otherwise: when they contain
+    a duplicate or a modifier that isn't in all_mods, or when order dependent modifiers (see
+    chord_mod.order_dependent_mods) are in another order than all_mods.
+    """
+    ranks = [_MOD_RANKS.get(mod) for mod in modifiers]
+    if None in ranks or len(set(ranks)) != len(ranks):
+        return None
+    if all(lower < upper for lower, upper in zip(ranks, ranks[1:])):
+        return modifiers
+
+    dependent_ranks = [rank for rank, mod in zip(ranks, modifiers) if mod in _ORDER_DEPENDENT]
+    if any(lower > upper for lower, upper in zip(dependent_ranks, dependent_ranks[1:])):
+        return None
+    return tuple(mod for _, mod in sorted(zip(ranks, modifiers), key=lambda ranked: ranked[0]))
+
+
+def modded_chord(scale_name: str, degree: int, modifiers: Tuple[ModFunc, ...]) -> FunChord:
+    chord = FunChord(scale_name, degree)
+    for mod in modifiers:
+        chord = mod(chord)
+    return chord
+
+
+def compute_midi_notes(
+        scale_name: str,
+        degree: int,
+        modifiers: Tuple[ModFunc, ...],
+        voicing_center: int,
+        voicing_range: int = 1,
+        bass_note: bool = True,
+        voicing_type: VoicingType = VoicingType.WRAP) -> Tuple[int, ...]:
+    """
+    Build, modify and voice a chord from scratch. This is the path the table is filled with.
+    """
+    chord = modded_chord(scale_name, degree, modifiers)
+    return tuple(voice(chord, voicing_center, voicing_range, bass_note, voicing_type))
+
+
+class ChordTable(object):
+    """
+    Maps (scale, degree, modifiers, voicing settings) to a ready-made tuple of midi notes.
+
+    Modifiers are keyed in the order they're applied since some don't commute (eg. Sus2 then
+    Parallel is not Parallel then Sus2). The table is built with each combination of modifiers in
+    the order of chord_mod.all_mods, and lookups are put in that order when it gives the same chord
+    (see canonical_modifiers). Other orders and duplicates are voiced through voicing_cache.
+    """
+    def __init__(self):
+        self._tables: Dict[VoicingSettings, Dict[ChordKey, Tuple[int, ...]]] = dict()
+        self._generation = 0  # incremented by invalidate, stops the background builds
+        self.misses = 0
+
+    def __len__(self):
+        return sum(len(table) for table in list(self._tables.values()))
+
+    def build(
+            self,
+            voicing_center: int,
+            voicing_range: int = 1,
+            bass_note: bool = True,
+            voicing_type: VoicingType = VoicingType.WRAP,
+            scale_names: List[str] = note_util.SCALE_NAMES,
+            mods: List['FunMod'] = all_mods):
+        """
+        Precompute every scale, degree and modifier combination for the given voicing settings.
+        """
+        settings = (voicing_center, voicing_range, bass_note, voicing_type)
+        self._build_into(self._tables.setdefault(settings, dict()), settings, scale_names, mods)
+
+    @staticmethod
+    def _build_into(table: Dict[ChordKey, Tuple[int, ...]], settings: VoicingSettings,
+                    scale_names: List[str], mods: List['FunMod']):
+        mod_funcs = [mod.get_func() for mod in mods]
+        mod_combinations = []
+        for count in range(len(mod_funcs) + 1):
+            mod_combinations += combinations(mod_funcs, count)
+
+        for scale_name in scale_names:
+            for degree in scales.parse_scale_name(scale_name)[2].degrees():
+                for modifiers in mod_combinations:
+                    table[(scale_name, degree, modifiers)] = compute_midi_notes(
+                        scale_name, degree, modifiers, *settings)
+
+    def build_in_background(
+            self,
+            voicing_center: int,
+            voicing_range: int = 1,
+            bass_note: bool = True,
+            voicing_type: VoicingType = VoicingType.WRAP,
+            scale_names: List[str] = note_util.SCALE_NAMES,
+            mods: List['FunMod'] = all_mods) -> threading.Thread:
+        """
+        Same as build, one scale at a time in a daemon thread. Lookups work in the meantime, chords
+        that aren't built yet are computed on a miss. Stops early when invalidate is called.
+        """
+        settings = (voicing_center, voicing_range, bass_note, voicing_type)
+        # Filled in place, such that a table dropped by invalidate isn't put back.
+        table = self._tables.setdefault(settings, dict())
+        generation = self._generation
+
+        def build_scales():
+            for scale_name in scale_names:
+                if self._generation != generation:
+                    return
+                self._build_into(table, settings, [scale_name], mods)
+                time.sleep(0)  # let the app's threads run between scales
+
+        thread = threading.Thread(target=build_scales, name='ChordTable.build', daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate(self, voicing_center: int):
+        """
+        Drop the chords voiced around voicing_center, and stop the builds in progress.
+        """
+        self._generation += 1
+        for settings in list(self._tables):
+            if settings[0] == voicing_center:
+                self._tables.pop(settings, None)
+        voicing_cache.invalidate(voicing_center=voicing_center)
+
+    def midi_notes(
+            self,
+            scale_name: str,
+            degree: int,
+            modifiers: Tuple[ModFunc, ...],
+            voicing_center: int,
+            voicing_range: int = 1,
+            bass_note: bool = True,
+            voicing_type: VoicingType = VoicingType.WRAP) -> Tuple[int, ...]:
+        """
+        Look up the midi notes for a chord, computing them through voicing_cache on a miss.
+
+        Args:
+            scale_name: Name of the scale eg. Cmin, G#maj, etc.
+            degree: Scale degree of the chord's root note (root at 1).
+            modifiers: Modifier functions, in the order they should be applied.
+            voicing_center: Midi note center of mass for voicing.
+            voicing_range: Number of octaves spanned by the result, centered on voicing_center.
+            bass_note: Whether to add a bass note.
+            voicing_type: Algorithm to voice the chord.
+
+        Returns:
+            A tuple of midi notes.
+        """
+        try:
+            canonical = canonical_modifiers(modifiers)
+            if canonical is None:
+                raise KeyError(modifiers)
+            return self._tables[(voicing_center, voicing_range, bass_note, voicing_type)][
+                (scale_name, degree, canonical)]
+        except KeyError:
+            self.misses += 1
+            return voicing_cache.voice(modded_chord(scale_name, degree, modifiers), voicing_center,
+                                       voicing_range, bass_note, voicing_type)
+
+    def chord_midi_notes(self, chord: FunChord, modifiers: List[ModFunc], voicing_center: int,
+                         **voicing_kwargs) -> Tuple[int, ...]:
+        """
+        Same as midi_notes, for an unmodified chord such as the ones stored in chord pads.
+        """
+        degree = chord.root_degree().get_tone() + 1
+        return self.midi_notes(chord.get_scale_name(), degree, tuple(modifiers), voicing_center,
+                               **voicing_kwargs)
+
+
+if __name__ == "__main__":
+    from chord_mod import Sus2, Parallel
+
+    start = time.perf_counter()
+    table = ChordTable()
+    table.build(note_util.name_to_midi('C3'))
+    print("Built {} chords in {:.2f}s".format(len(table), time.perf_counter() - start))
+
+    # Dsus2 in C major: D A E wrapped around C3
+    mods = (Sus2.get_func(),)
+    print("Cmaj II sus2", table.midi_notes('Cmaj', 2, mods, note_util.name_to_midi('C3')))
+
+    # Sus4 and Add7 give the same chord in either order, both are table hits
+    from itertools import permutations
+    from chord_mod import Sus4, Add7
+    misses = table.misses
+    for mods in permutations((Sus4.get_func(), Add7.get_func())):
+        print("Cmaj II", [mod.__name__ for mod in mods], table.midi_notes('Cmaj', 2, mods, note_util.name_to_midi('C3')))
+    assert table.misses == misses, "Sus4 and Add7 should be table hits in any order"
+
+    # Lookups in all_mods order are the chord of the pressed order
+    for mods in permutations([mod.get_func() for mod in all_mods[1:5]]):
+        canonical = canonical_modifiers(mods)
+        if canonical is not None:
+            assert modded_chord('Dmin', 3, canonical) == modded_chord('Dmin', 3, mods), mods
+
+    # Not in the table: Parallel is applied before Sus2
+    mods = (Parallel.get_func(), Sus2.get_func())
+    print("Cmaj II parallel sus2", table.midi_notes('Cmaj', 2, mods, note_util.name_to_midi('C3')))
+    print("Misses", table.misses, voicing_cache.stats())
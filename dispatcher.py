@@ -0,0 +1,116 @@
+"""
+Ordered event queue for the app.
+
+push2_python calls the pad and button callbacks on its own threads. Instead of changing the app's
+state from there, callbacks post events to the dispatcher, and a single consumer (the app's main
+loop) applies them one at a time in the order they came in. The consumer blocks on the queue, so it
+wakes up as soon as an event is posted.
+
+The dispatcher keeps track of the queue depth, how long events wait in the queue and how long they
+take to handle (see latency for the histograms).
+"""
+
+import queue
+import time
+import traceback
+from typing import Callable
+
+from latency import LatencyHistogram
+
+_STOP = object()  # sentinel to wake up and stop the consumer
+
+
+class EventDispatcher(object):
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.wait_time = LatencyHistogram()  # ns from post to handling
+        self.service_time = LatencyHistogram()  # ns spent in the handler
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def post(self, handler: Callable, *args):
+        """
+        Queue handler(*args) to run on the consumer thread. Safe to call from any thread.
+        """
+        self._queue.put((time.perf_counter_ns(), handler, args))
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def stop(self):
+        """
+        Wake up the consumer and make it return once the events posted before are handled.
+        """
+        self._queue.put(_STOP)
+
+    def _handle(self, event) -> bool:
+        """
+        Run one event. Returns False for the stop sentinel.
+        """
+        try:
+            if event is _STOP:
+                return False
+
+            posted, handler, args = event
+            start = time.perf_counter_ns()
+            self.wait_time.record(start - posted)
+            try:
+                handler(*args)
+            except Exception:
+                # A bad event shouldn't take the app down with it.
+                self.errors += 1
+                print("Warning: error while handling {}{}".format(getattr(handler, '__name__', handler), args))
+                traceback.print_exc()
+            self.service_time.record(time.perf_counter_ns() - start)
+            self.processed += 1
+            return True
+        finally:
+            self._queue.task_done()
+
+    def run(self, is_running: Callable[[], bool] = lambda: True, timeout: float = 0.5):
+        """
+        Handle events on the calling thread until stop is called or is_running returns False.
+        is_running is checked at least every timeout seconds.
+        """
+        while is_running():
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if not self._handle(event):
+                return
+
+    def run_pending(self):
+        """
+        Handle the events that are already queued, then return.
+        """
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if not self._handle(event):
+                return
+
+    def join(self):
+        """
+        Block until every posted event was handled. Needs a consumer running on another thread.
+        """
+        self._queue.join()
+
+    def report(self) -> str:
+        return '\n'.join([
+            "Events: {} handled, {} errors, queue depth {} (max {})".format(
+                self.processed, self.errors, self.depth(), self.max_depth),
+            "{:<12}{:>10}{:>10}{:>10}".format('', 'p50 us', 'p99 us', 'max us'),
+            "{:<12}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                'queued', self.wait_time.percentile(50) / 1e3, self.wait_time.percentile(99) / 1e3,
+                self.wait_time.max / 1e3),
+            "{:<12}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                'service', self.service_time.percentile(50) / 1e3,
+                self.service_time.percentile(99) / 1e3, self.service_time.max / 1e3),
+        ])
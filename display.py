@@ -0,0 +1,362 @@
+"""
+Push 2 display: shows the key, the playing chord, its modifiers and its voicing.
+
+Drawing a 960x160 frame takes about a millisecond, and sending it to the Push over USB takes a few
+more, so neither is done on the event path. The app calls show with what's playing, which only
+stores it (latest wins) and wakes the display thread. The display thread then:
+    - looks up the chord and modifier lines in a small LRU cache keyed on (chord, modifiers), and
+      only draws them on a miss. The key and voicing lines are short and drawn on every frame, such
+      that voice leading or moving the voicing center doesn't defeat the cache
+    - sends it to the display, at most max_fps times per second. States shown in between are
+      skipped, only the latest one is drawn
+    - sends the current frame again every KEEPALIVE seconds, as the Push blanks its display when it
+      stops receiving frames
+
+Frames are put together in one preallocated frame buffer: the cached lines are copied in with
+np.copyto and the others drawn in place. Entries evicted from the cache are reused for the next
+miss, so once the cache is full no frame allocates. Errors sending a frame (eg. no
+display) are counted and the thread keeps going, the event path never sees them.
+
+Text is drawn with a built-in 5x7 font, to avoid depending on a font library.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import time
+from typing import Iterable, Sequence, Tuple
+
+from lazy_import import lazy_module
+import note_util
+import push_constants
+
+np = lazy_module('numpy')
+
+DISPLAY_WIDTH = push_constants.DISPLAY_LINE_PIXELS
+DISPLAY_HEIGHT = push_constants.DISPLAY_N_LINES
+
+DEFAULT_FPS = 30.
+KEEPALIVE = 1.  # seconds between frames when nothing changes
+FRAME_CACHE_SIZE = 32  # chord and modifier lines, 170 KB each
+
+# (r, g, b)
+BACKGROUND = (0, 0, 0)
+KEY_COLOR = (150, 150, 150)
+CHORD_COLOR = (255, 255, 255)
+MODIFIER_COLOR = (255, 200, 0)
+VOICING_COLOR = (100, 180, 255)
+
+MARGIN = 16  # pixels left of the text
+# (top, text scale) of each line, a scale of n draws each font pixel as n x n pixels.
+KEY_LINE = (10, 2)
+CHORD_LINE = (36, 6)
+MODIFIER_LINE = (92, 3)
+VOICING_LINE = (126, 3)
+
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+GLYPH_SPACING = 1  # font pixels between characters
+
+# Rows of each glyph, top to bottom. Lowercase letters are drawn with the uppercase glyphs except b,
+# which is kept for flats (eg. Bb, b9).
+FONT = {
+    'A': '.###. #...# #...# ##### #...# #...# #...#',
+    'B': '####. #...# #...# ####. #...# #...# ####.',
+    'C': '.###. #...# #.... #.... #.... #...# .###.',
+    'D': '####. #...# #...# #...# #...# #...# ####.',
+    'E': '##### #.... #.... ####. #.... #.... #####',
+    'F': '##### #.... #.... ####. #.... #.... #....',
+    'G': '.###. #...# #.... #.### #...# #...# .####',
+    'H': '#...# #...# #...# ##### #...# #...# #...#',
+    'I': '.###. ..#.. ..#.. ..#.. ..#.. ..#.. .###.',
+    'J': '..### ...#. ...#. ...#. ...#. #..#. .##..',
+    'K': '#...# #..#. #.#.. ##... #.#.. #..#. #...#',
+    'L': '#.... #.... #.... #.... #.... #.... #####',
+    'M': '#...# ##.## #.#.# #.#.# #...# #...# #...#',
+    'N': '#...# #...# ##..# #.#.# #..## #...# #...#',
+    'O': '.###. #...# #...# #...# #...# #...# .###.',
+    'P': '####. #...# #...# ####. #.... #.... #....',
+    'Q': '.###. #...# #...# #...# #.#.# #..#. .##.#',
+    'R': '####. #...# #...# ####. #.#.. #..#. #...#',
+    'S': '.#### #.... #.... .###. ....# ....# ####.',
+    'T': '##### ..#.. ..#.. ..#.. ..#.. ..#.. ..#..',
+    'U': '#...# #...# #...# #...# #...# #...# .###.',
+    'V': '#...# #...# #...# #...# #...# .#.#. ..#..',
+    'W': '#...# #...# #...# #.#.# #.#.# #.#.# .#.#.',
+    'X': '#...# #...# .#.#. ..#.. .#.#. #...# #...#',
+    'Y': '#...# #...# .#.#. ..#.. ..#.. ..#.. ..#..',
+    'Z': '##### ....# ...#. ..#.. .#... #.... #####',
+    'b': '#.... #.... #.##. ##..# #...# #...# ####.',
+    '0': '.###. #...# #..## #.#.# ##..# #...# .###.',
+    '1': '..#.. .##.. ..#.. ..#.. ..#.. ..#.. .###.',
+    '2': '.###. #...# ....# ...#. ..#.. .#... #####',
+    '3': '####. ....# ....# .###. ....# ....# ####.',
+    '4': '...#. ..##. .#.#. #..#. ##### ...#. ...#.',
+    '5': '##### #.... ####. ....# ....# #...# .###.',
+    '6': '..##. .#... #.... ####. #...# #...# .###.',
+    '7': '##### ....# ...#. ..#.. .#... .#... .#...',
+    '8': '.###. #...# #...# .###. #...# #...# .###.',
+    '9': '.###. #...# #...# .#### ....# ...#. .##..',
+    '#': '.#.#. .#.#. ##### .#.#. ##### .#.#. .#.#.',
+    '-': '..... ..... ..... ##### ..... ..... .....',
+    '+': '..... ..#.. ..#.. ##### ..#.. ..#.. .....',
+    '?': '.###. #...# ....# ...#. ..#.. ..... ..#..',
+}
+
+# (scale name, chord, modifiers, midi notes), see ChordDisplay.show
+DisplayState = Tuple[str, 'FunChord', Tuple, Tuple[int, ...]]
+
+
+def bgr565(color: Tuple[int, int, int]) -> int:
+    """
+    Pixel value of an (r, g, b) color in push2_python's default frame format.
+    """
+    r, g, b = color
+    return (b >> 3) << 11 | (g >> 2) << 5 | r >> 3
+
+
+@lru_cache(maxsize=None)
+def glyph(char: str, scale: int) -> 'np.ndarray':
+    """
+    Boolean mask of a character, scale times the font size. Unknown characters are drawn as '?'.
+    """
+    if char not in FONT:
+        char = char.upper() if char.upper() in FONT else '?'
+    rows = [[pixel == '#' for pixel in row] for row in FONT[char].split()]
+    mask = np.kron(np.array(rows, dtype=bool), np.ones((scale, scale), dtype=bool))
+    mask.flags.writeable = False
+    return mask
+
+
+def draw_text(canvas: 'np.ndarray', text: str, left: int, top: int, scale: int, color: int):
+    """
+    Draw text on a (height, width) canvas. Characters past the right edge are dropped.
+    """
+    advance = (GLYPH_WIDTH + GLYPH_SPACING) * scale
+    height, width = canvas.shape
+    x = left
+    for char in text:
+        if x + GLYPH_WIDTH * scale > width:
+            break
+        if char != ' ':
+            mask = glyph(char, scale)
+            canvas[top:top + mask.shape[0], x:x + mask.shape[1]][mask] = color
+        x += advance
+
+
+def modifier_name(modifier) -> str:
+    # Active modifiers are the modifier functions, eg. sus4.
+    return getattr(modifier, '__name__', str(modifier))
+
+
+def state_lines(state: DisplayState) -> Tuple[str, str, str, str]:
+    """
+    Text of the key, chord, modifier and voicing lines.
+    """
+    scale_name, chord, modifiers, midi_notes = state
+    return (scale_name,
+            '' if chord is None else str(chord),
+            ' '.join(modifier_name(modifier) for modifier in modifiers),
+            ' '.join(note_util.midi_to_name(note, include_octave=True) for note in midi_notes))
+
+
+class FrameRenderer(object):
+    """
+    Draws display states into a frame buffer, with an LRU cache of the chord and modifier lines.
+    """
+    def __init__(self, cache_size: int = FRAME_CACHE_SIZE):
+        assert cache_size > 0, "Frame cache size {} <= 0".format(cache_size)
+        self.cache_size = cache_size
+        # (chord, modifiers) -> chord and modifier lines in the frame's layout, least recently used first
+        self._chord_lines = OrderedDict()
+        # Rows of the chord and modifier lines, up to the voicing line.
+        self._chord_rows = slice(CHORD_LINE[0], VOICING_LINE[0])
+        # Chord lines are drawn row by row here, then copied transposed into their cache entry.
+        self._canvas = np.zeros((VOICING_LINE[0] - CHORD_LINE[0], DISPLAY_WIDTH), dtype=np.uint16)
+        # Sent to the display, in its (width, height) layout. Drawn on through its transpose.
+        self._frame = np.zeros((DISPLAY_WIDTH, DISPLAY_HEIGHT), dtype=np.uint16)
+        self._background = bgr565(BACKGROUND)
+        self._key_color, self._chord_color, self._modifier_color, self._voicing_color = \
+            [bgr565(color) for color in (KEY_COLOR, CHORD_COLOR, MODIFIER_COLOR, VOICING_COLOR)]
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._chord_lines)
+
+    def frame(self, state: DisplayState) -> 'np.ndarray':
+        """
+        (DISPLAY_WIDTH, DISPLAY_HEIGHT) BGR565 frame of the state, the layout
+        push2_python.display.display_frame expects. The same buffer is drawn on by the next call.
+        """
+        key_text, chord_text, modifier_text, voicing_text = state_lines(state)
+        frame = self._frame
+        canvas = frame.T  # (height, width) view
+
+        canvas[:self._chord_rows.start].fill(self._background)
+        draw_text(canvas, key_text, MARGIN, KEY_LINE[0], KEY_LINE[1], self._key_color)
+
+        np.copyto(frame[:, self._chord_rows], self.chord_lines(state[1], state[2], chord_text, modifier_text))
+
+        canvas[self._chord_rows.stop:].fill(self._background)
+        draw_text(canvas, voicing_text, MARGIN, VOICING_LINE[0], VOICING_LINE[1], self._voicing_color)
+        return frame
+
+    def chord_lines(self, chord: 'FunChord', modifiers: Tuple, chord_text: str, modifier_text: str) -> 'np.ndarray':
+        """
+        Chord and modifier lines, from the cache or drawn into the least recently used entry.
+        """
+        cache_key = (chord, modifiers)
+        lines = self._chord_lines.get(cache_key)
+        if lines is not None:
+            self._chord_lines.move_to_end(cache_key)
+            self.hits += 1
+            return lines
+        self.misses += 1
+
+        if len(self._chord_lines) >= self.cache_size:
+            _, lines = self._chord_lines.popitem(last=False)
+        else:
+            lines = np.empty(self._canvas.T.shape, dtype=np.uint16)
+
+        canvas = self._canvas
+        canvas.fill(self._background)
+        top = self._chord_rows.start
+        draw_text(canvas, chord_text, MARGIN, CHORD_LINE[0] - top, CHORD_LINE[1], self._chord_color)
+        draw_text(canvas, modifier_text, MARGIN, MODIFIER_LINE[0] - top, MODIFIER_LINE[1], self._modifier_color)
+        np.copyto(lines, canvas.T)
+        self._chord_lines[cache_key] = lines
+        return lines
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.
+        return "{} chords cached, {} hits, {} misses ({:.1%} hit rate)".format(
+            len(self._chord_lines), self.hits, self.misses, hit_rate)
+
+
+class ChordDisplay(object):
+    """
+    Shows the app's state on the Push's display from a dedicated thread, see the module docstring.
+    """
+    def __init__(self, push_display, max_fps: float = DEFAULT_FPS, cache_size: int = FRAME_CACHE_SIZE):
+        """
+        push_display: push2_python display to send frames to (push.display).
+        max_fps: Maximum frames sent per second.
+        """
+        assert max_fps > 0, "Display max_fps {} <= 0".format(max_fps)
+        self.push_display = push_display
+        self.frame_interval = 1. / max_fps
+        self.renderer: FrameRenderer = None  # created on the display thread, where numpy is imported
+
+        self._cache_size = cache_size
+        self._state: DisplayState = None  # latest state passed to show
+        self._changed = threading.Event()
+        self._running = False
+        self._thread: threading.Thread = None
+
+        self.shown = 0  # calls to show
+        self.frames_sent = 0
+        self.errors = 0
+
+    def show(self,
+             scale_name: str,
+             chord: 'FunChord' = None,
+             modifiers: Iterable = (),
+             midi_notes: Sequence[int] = ()):
+        """
+        Display the key, and the chord playing with its modifiers and midi notes. Doesn't wait for
+        the display: the state is only stored for the display thread.
+        """
+        self._state = (scale_name, chord, tuple(modifiers), tuple(midi_notes))
+        self.shown += 1
+        self._changed.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ChordDisplay', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.):
+        """
+        Stop the display thread, after the frame it's sending.
+        """
+        if self._thread is None:
+            return
+        self._running = False
+        self._changed.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        self.renderer = self.renderer or FrameRenderer(self._cache_size)
+        sent_state = None
+        frame = None
+        while self._running:
+            changed = self._changed.wait(KEEPALIVE)
+            if not self._running:
+                break
+            # Cleared before reading the state, such that a state shown from now on wakes us again.
+            self._changed.clear()
+            state = self._state
+
+            if state is not None and state != sent_state:
+                frame = self.renderer.frame(state)
+                sent_state = state
+            elif changed or frame is None:
+                continue  # same state shown again, or nothing to show yet
+
+            sent_at = time.perf_counter()
+            self._send(frame)
+
+            # Cap the frame rate: states shown while waiting are coalesced into the latest one.
+            delay = sent_at + self.frame_interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _send(self, frame: 'np.ndarray'):
+        try:
+            self.push_display.display_frame(frame, input_format=push_constants.FRAME_FORMAT_BGR565)
+            self.frames_sent += 1
+        except Exception as e:
+            if self.errors == 0:
+                print("Warning: Couldn't send frame to the Push 2 display: {}".format(e))
+            self.errors += 1
+
+    def stats(self) -> str:
+        renderer = self.renderer.stats() if self.renderer is not None else "no frames"
+        return "{} states shown, {} frames sent, {} errors, {}".format(
+            self.shown, self.frames_sent, self.errors, renderer)
+
+
+if __name__ == "__main__":
+    from fun_chord import FunChord
+    from chord_mod import sus4, add9
+
+    renderer = FrameRenderer()
+    states = [('Cmaj', FunChord('Cmaj', degree), modifiers, (48, 52, 55))
+              for degree in range(1, 8) for modifiers in ((), (sus4,), (sus4, add9))]
+    # Same chords voiced another way (eg. voice leading) only redraw the voicing line.
+    states += [(scale_name, chord, modifiers, (43, 47, 50)) for scale_name, chord, modifiers, _ in states]
+
+    start = time.perf_counter()
+    for state in states[:len(states) // 2]:
+        renderer.frame(state)
+    drawn = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100):
+        for state in states[-renderer.cache_size:]:
+            renderer.frame(state)
+    cached = time.perf_counter() - start
+    print("Draw: {:.2f} ms per frame, cached: {:.2f} us per frame".format(
+        drawn / (len(states) // 2) * 1e3, cached / (100 * min(len(states), renderer.cache_size)) * 1e6))
+    print(renderer.stats())
+
+    # Text preview of the last frame, one character per 4 by 8 pixels.
+    frame = renderer.frame(states[-1]).T
+    for row in frame[::8]:
+        print(''.join('#' if pixel else ' ' for pixel in row[::4]).rstrip())
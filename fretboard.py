@@ -0,0 +1,313 @@
+"""
+Playable guitar voicings, found by searching the fretboard.
+
+For a set of pitch classes, every fingering in standard tuning is enumerated string by string:
+each string is muted or plays a fret whose note is in the set. Fingerings are pruned as they're
+built such that only ones a hand can play are kept:
+    - the sounding strings are adjacent, muted strings are only on either side
+    - fretted notes fit in HAND_SPAN frets
+    - at most MAX_FINGERS fingers, where the lowest fret can be barred
+
+Playable fingerings are scored (lower is better) on how well they voice the chord: missing chord
+tones, inversions (root not in the bass), muddy or dissonant intervals between adjacent strings,
+hand stretch and position up the neck. The best few are kept as candidates.
+
+The search only depends on the pitch classes and the root, so guitar_voicings is memoized on those
+and the app never searches the same chord twice. Picking a candidate (see choose) is an argmin over
+the candidates, towards the voicing center and optionally the previous voicing for voice leading.
+
+A search takes up to ~20 ms, so the app searches every chord of its pads ahead of time with
+warm_in_background. The searches run in a separate process, such that pad presses don't wait behind
+them for the interpreter, and the results are added to the memo as each key is done.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import note_util
+
+# Open strings, low to high.
+STANDARD_TUNING = tuple([note_util.name_to_midi(name) for name in ('E2', 'A2', 'D3', 'G3', 'B3', 'E4')])
+
+MAX_FRET = 12  # higher frets repeat the same notes an octave up
+HAND_SPAN = 4  # frets covered by the hand, eg. frets 5 to 8
+MAX_FINGERS = 4
+MIN_STRINGS = 3
+CANDIDATES = 16  # best voicings kept per pitch class set
+
+MUTED = -1
+
+# Scoring weights.
+MISSING_TONE_COST = 8.
+INVERSION_COST = 4.
+MUTED_STRING_COST = 1.
+STRETCH_COST = 1.  # per fret between the lowest and highest fretted notes
+POSITION_COST = .2  # per fret up the neck
+MUDDY_COST = 1.  # per interval under a fourth in the low register
+MUDDY_BELOW = note_util.name_to_midi('C3')
+UNISON_COST = 1.  # per pair of strings playing the same note
+HARSH_COST = 1.  # per second or seventh between adjacent strings
+HARSH_CONSONANCE = 7  # intervals ranked above this in note_util.interval_consonance are harsh
+CENTER_COST = .2  # per semitone between the voicing's mean and the voicing center (see choose)
+MOVEMENT_COST = .5  # per semitone of voice leading movement (see choose)
+
+
+class GuitarVoicing(object):
+    """
+    A fingering and its notes. frets has one entry per string (MUTED when not played).
+    """
+    __slots__ = ('frets', 'midi_notes', 'score', 'mean')
+
+    def __init__(self, frets: Tuple[int, ...], midi_notes: Tuple[int, ...], score: float):
+        self.frets = frets
+        self.midi_notes = midi_notes
+        self.score = score
+        self.mean = sum(midi_notes) / len(midi_notes)
+
+    def __repr__(self):
+        frets = ''.join('x' if fret == MUTED else str(fret) if fret < 10 else '({})'.format(fret)
+                        for fret in self.frets)
+        return "GuitarVoicing({}, {:.1f})".format(frets, self.score)
+
+
+def fingers_needed(frets: Sequence[int]) -> int:
+    """
+    Fingers to hold the fretted notes, barring the lowest fret when it's on several strings and no
+    open string is under the barre.
+    """
+    fretted = [(string, fret) for string, fret in enumerate(frets) if fret > 0]
+    if not fretted:
+        return 0
+
+    lowest = min(fret for _, fret in fretted)
+    barred = [string for string, fret in fretted if fret == lowest]
+    if len(barred) > 1 and not any(frets[string] == 0 for string in range(barred[0], len(frets))):
+        return len(fretted) - len(barred) + 1
+    return len(fretted)
+
+
+def interval_cost(lower: int, upper: int) -> float:
+    """
+    Cost of two adjacent sounding strings: close intervals are muddy in the low register, and
+    harsh ones (seconds and sevenths) stand out.
+    """
+    interval = upper - lower
+    cost = 0.
+    if interval == 0:
+        cost += UNISON_COST
+    elif interval < 5 and lower < MUDDY_BELOW:
+        cost += MUDDY_COST
+    if interval < 12 and note_util.interval_consonance[interval] > HARSH_CONSONANCE:
+        cost += HARSH_COST
+    return cost
+
+
+def search(pitch_class_mask: int, root_pitch_class: int,
+           tuning: Sequence[int] = STANDARD_TUNING) -> List[GuitarVoicing]:
+    """
+    Search every playable fingering of the pitch classes. Not cached, see guitar_voicings.
+
+    Args:
+        pitch_class_mask: Pitch classes of the chord, see note_util.tones_to_mask.
+        root_pitch_class: Pitch class of the chord's root (0 is C), preferred in the bass.
+        tuning: Midi note of each open string, low to high.
+
+    Returns:
+        The best CANDIDATES voicings, best first. Fingerings giving the same notes are only kept
+        once.
+    """
+    string_count = len(tuning)
+    # Frets of each string playing one of the pitch classes.
+    fret_options = [[fret for fret in range(MAX_FRET + 1)
+                     if note_util.mask_contains(pitch_class_mask, (open_note + fret) % 12)]
+                    for open_note in tuning]
+    min_strings = min(MIN_STRINGS, bin(pitch_class_mask).count('1'), string_count)
+
+    best = dict()  # midi notes -> voicing
+
+    def visit(frets, notes, played_mask, low_fret, high_fret, fretted, cost):
+        if len(notes) < min_strings:
+            return
+        # Without a barre each fretted note takes a finger.
+        if fretted > MAX_FINGERS and fingers_needed(frets) > MAX_FINGERS:
+            return
+
+        score = cost + MISSING_TONE_COST * bin(pitch_class_mask & ~played_mask).count('1') \
+            + MUTED_STRING_COST * (string_count - len(notes))
+        if notes[0] % 12 != root_pitch_class:
+            score += INVERSION_COST
+        if fretted:
+            score += STRETCH_COST * (high_fret - low_fret) + POSITION_COST * low_fret
+
+        previous = best.get(notes)
+        if previous is None or score < previous.score:
+            best[notes] = GuitarVoicing(frets, notes, score)
+
+    def extend(frets, notes, played_mask, low_fret, high_fret, fretted, cost):
+        """
+        Add the next string to a partial fingering. notes are the midi notes of its sounding
+        strings, low_fret and high_fret the range of its fretted notes, cost the cost of its
+        intervals so far.
+        """
+        string = len(frets)
+        if string == string_count:
+            visit(frets, notes, played_mask, low_fret, high_fret, fretted, cost)
+            return
+
+        # Mute this string, and the following ones once a string sounded.
+        if notes:
+            muted = frets + (MUTED,) * (string_count - string)
+            visit(muted, notes, played_mask, low_fret, high_fret, fretted, cost)
+        else:
+            extend(frets + (MUTED,), notes, played_mask, low_fret, high_fret, fretted, cost)
+
+        open_note = tuning[string]
+        for fret in fret_options[string]:
+            low, high = low_fret, high_fret
+            if fret > 0:
+                low, high = min(low_fret, fret), max(high_fret, fret)
+                if high - low >= HAND_SPAN:
+                    continue
+            note = open_note + fret
+            extend(frets + (fret,), notes + (note,), played_mask | 1 << note % 12, low, high,
+                   fretted + (fret > 0), cost + interval_cost(notes[-1], note) if notes else cost)
+
+    extend((), (), 0, MAX_FRET + 1, 0, 0, 0.)
+
+    return sorted(best.values(), key=lambda voicing: voicing.score)[:CANDIDATES]
+
+
+# (pitch class mask, root pitch class) -> candidates. There's at most one entry per chord the pads
+# can play in some key, about a thousand.
+_candidates: Dict[Tuple[int, int], Tuple[GuitarVoicing, ...]] = dict()
+
+
+def guitar_voicings(pitch_class_mask: int, root_pitch_class: int) -> Tuple[GuitarVoicing, ...]:
+    """
+    Memoized search, in standard tuning.
+    """
+    key = (pitch_class_mask, root_pitch_class)
+    voicings = _candidates.get(key)
+    if voicings is None:
+        voicings = _candidates[key] = tuple(search(pitch_class_mask, root_pitch_class))
+    return voicings
+
+
+def chord_voicings(chord: 'FunChord') -> Tuple[GuitarVoicing, ...]:
+    root_pitch_class = (chord.get_scale_root_tone() + chord.get_root_tone()) % 12
+    return guitar_voicings(chord.pitch_class_mask, root_pitch_class)
+
+
+def _lower_priority():
+    """
+    Run warm_in_background's process at the lowest priority, such that it doesn't slow down the app
+    when they share a core.
+    """
+    if hasattr(os, 'nice'):
+        os.nice(19)
+
+
+def _search_keys(keys: Sequence[Tuple[int, int]]) -> List[Tuple[Tuple[int, int], list]]:
+    """
+    Search each (pitch class mask, root pitch class), in warm_in_background's process. The voicings
+    are returned as (frets, midi notes, score) tuples.
+    """
+    return [(key, [(voicing.frets, voicing.midi_notes, voicing.score) for voicing in search(*key)])
+            for key in keys]
+
+
+def pad_chord_keys(scale_name: str) -> List[Tuple[int, int]]:
+    """
+    (pitch class mask, root pitch class) of every chord the pads can play in the key, from its
+    ChordIndex.
+    """
+    # Deferred: fun_chord imports voicing, which imports this module.
+    import scales
+    from fun_chord import FunChord
+    from chord_index import ChordIndex
+
+    _, scale_root_tone, scale = scales.parse_scale_name(scale_name)
+    index = ChordIndex.for_scale_quality(scale.name)
+    root_tones = {degree: FunChord('C' + scale.name, degree).get_root_tone() for degree in index.degrees}
+    keys = dict()  # ordered set
+    for (degree, _), mask in zip(index.chords, index.masks):
+        keys[(note_util.rotate_mask(mask, scale_root_tone), (scale_root_tone + root_tones[degree]) % 12)] = None
+    return list(keys)
+
+
+def warm_in_background(scale_names: Sequence[str]) -> threading.Thread:
+    """
+    Search the fingerings of every chord the pads can play in the keys, one key after the other, in
+    a separate process at low priority. A daemon thread waits for each key and adds its candidates to the memo, chords
+    pressed before that are searched on the spot. Keys are sent one at a time, such that exiting
+    only waits for the key being searched.
+    """
+    def warm():
+        context = multiprocessing.get_context('spawn')  # forking a process with threads isn't safe
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_lower_priority) as pool:
+            for scale_name in scale_names:
+                keys = [key for key in pad_chord_keys(scale_name) if key not in _candidates]
+                if not keys:
+                    continue
+                for key, voicings in pool.submit(_search_keys, keys).result():
+                    _candidates.setdefault(key, tuple(GuitarVoicing(*voicing) for voicing in voicings))
+
+    thread = threading.Thread(target=warm, name='fretboard.warm', daemon=True)
+    thread.start()
+    return thread
+
+
+def choose(candidates: Sequence[GuitarVoicing],
+           voicing_center: int,
+           previous: Optional[Sequence[int]] = None) -> Optional[GuitarVoicing]:
+    """
+    Pick the candidate with the best score, pulled towards the voicing center and, when the
+    previous voicing is given, towards the least movement from it.
+    """
+    best = None
+    best_cost = None
+    for candidate in candidates:
+        cost = candidate.score + CENTER_COST * abs(candidate.mean - voicing_center)
+        if previous:
+            cost += MOVEMENT_COST * movement(candidate.midi_notes, previous)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = candidate, cost
+    return best
+
+
+def movement(voicing_a: Sequence[int], voicing_b: Sequence[int]) -> int:
+    """
+    Same as voice_leading.movement for two voicings, without numpy since voicings have a few notes.
+    """
+    return sum(min(abs(a - b) for b in voicing_b) for a in voicing_a) \
+        + sum(min(abs(a - b) for a in voicing_a) for b in voicing_b)
+
+
+if __name__ == "__main__":
+    from fun_chord import FunChord
+    from chord_index import ChordIndex
+
+    center = note_util.name_to_midi('C3')
+    previous = None
+    for degree in (1, 6, 2, 5):
+        chord = FunChord('Gmaj', degree)
+        candidates = chord_voicings(chord)
+        alone = choose(candidates, center)
+        led = choose(candidates, center, previous)
+        previous = led.midi_notes
+        print("{:<8} {} led {}".format(str(chord), alone, led))
+
+    # Worst case over every chord the pads can play, uncached.
+    worst = (0., None)
+    for scale_quality in ('maj', 'min'):
+        index = ChordIndex.for_scale_quality(scale_quality)
+        for mask, (degree, _) in zip(index.masks, index.chords):
+            root_pitch_class = FunChord('C' + scale_quality, degree).get_root_tone() % 12
+            start = time.perf_counter()
+            search(mask, root_pitch_class)
+            worst = max(worst, (time.perf_counter() - start, note_util.mask_to_tones(mask)))
+    print("Worst search: {:.1f} ms for pitch classes {}".format(worst[0] * 1e3, worst[1]))
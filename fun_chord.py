@@ -1,50 +1,110 @@
-import numpy as np
+import threading
+
 import note_util
-from voicing import voice, VoicingType
+import scales
+from voicing import voicing_cache, VoicingType
 
 class ScaleNote(object):
     """
+    Note relative to a scale, stored as a 0-indexed scale degree and an accidental (-1 for flat,
+    0 for natural, 1 for sharp).
+
+    ScaleNotes are immutable and interned: every degree/accidental pair has a single instance, so
+    building one is a table lookup and arithmetic is done on plain integers.
+
+    Equality is on the spelling, so #3 != 4 like in chord symbols. Use enharmonic_eq (or
+    semitones) to compare the notes' pitch in the major scale instead, where #3 == 4 like E# == F.
     """
+    __slots__ = ('_note', '_accidental', '_code', '_semitones', '_name')
+
     MAX_SCALE_NOTE = 7
-    def __init__(self, note):
+    MAJOR_SEMITONES = (0, 2, 4, 5, 7, 9, 11)
+    PRECOMPUTED_NOTES = 4 * MAX_SCALE_NOTE  # four octaves of degrees cover every extension
+
+    _interned = {}  # spelling code -> ScaleNote
+    _parsed = {}  # input (int or str) -> ScaleNote
+
+    def __new__(cls, note):
         # NOTE: self._note is 0 indexed
         # TODO: support multisharp/flat
+        if note.__class__ is ScaleNote:
+            return note
+
+        try:
+            return cls._parsed[note]
+        except KeyError:
+            pass
 
-        if type(note) is ScaleNote:
-            self._note = note._note
-            self._accidental = note._accidental
-            return
+        scale_note = cls._parse(note)
+        cls._parsed[note] = scale_note
+        return scale_note
 
+    @classmethod
+    def _parse(cls, note):
         if type(note) is int:
             assert note > 0, "ScaleNote input is 1-indexed; {} out of range".format(note)
-            self._note = note - 1
-            self._accidental = 0
-            return
+            return cls.from_index(note - 1, 0)
 
         # TODO: hey this is probably a better job for a regex
         if type(note) is str:
             if '#' not in note and 'b' not in note:
                 assert int(note) > 0, "ScaleNote input is 1-indexed; {} out of range".format(note)
-                self._note = int(note) - 1
-                self._accidental = 0
-                return
+                return cls.from_index(int(note) - 1, 0)
 
             assert note[0] in ("#", "b"), "ScaleNote accidental '{}' should be # or b".format(note[0])
 
             note_number = int(note[1:])
             assert note_number > 0, "ScaleNote input is 1-indexed; {} out of range".format(note_number)
 
-            self._note = int(note_number) - 1
-            self._accidental = 1 if note[0] == "#" else -1
-            return
+            return cls.from_index(note_number - 1, 1 if note[0] == "#" else -1)
 
         print("Note type is {} instead of int or str".format(type(note)))
         raise TypeError
 
+    @classmethod
+    def from_index(cls, note: int, accidental: int) -> 'ScaleNote':
+        """
+        Get the ScaleNote for a 0-indexed degree and an accidental.
+        """
+        code = cls.encode(note, accidental)
+        try:
+            return cls._interned[code]
+        except KeyError:
+            pass
+
+        scale_note = object.__new__(cls)
+        init = object.__setattr__
+        init(scale_note, '_note', note)
+        init(scale_note, '_accidental', accidental)
+        init(scale_note, '_code', code)
+        init(scale_note, '_semitones',
+             cls.MAJOR_SEMITONES[note % cls.MAX_SCALE_NOTE] + 12 * (note // cls.MAX_SCALE_NOTE) + accidental)
+        init(scale_note, '_name', cls.accidental_to_str(accidental) + str(note + 1))
+
+        return cls._interned.setdefault(code, scale_note)
+
+    @staticmethod
+    def encode(note: int, accidental: int) -> int:
+        """
+        Spelling code: unique integer per degree/accidental pair, ordered like the notes.
+        """
+        return note * 3 + accidental + 1
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ScaleNote is immutable.")
+
+    def __reduce__(self):
+        return (ScaleNote.from_index, (self._note, self._accidental))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def __add__(self, other):
         if type(other) is int:
-            new_note = (self._note + other)
-            return ScaleNote(str(new_note) + self.accidental_str())
+            return ScaleNote.from_index(self._note + other, self._accidental)
         elif type(other) is ScaleNote:
             new_note = self._note + other._note
             new_accidental = self._accidental + other._accidental
@@ -56,67 +116,68 @@ class ScaleNote(object):
                 new_accidental = 0
                 new_note -= 1
 
-            return ScaleNote(self.accidental_to_str(new_accidental) + str(new_note + 1))
+            return ScaleNote.from_index(new_note, new_accidental)
         else:
             raise TypeError("unsupported operand type(s) for +: '{}' and '{}'".format(type(self), type(other)))
 
     def __repr__(self):
         # NOTE: root degree is 1, so notes are 1-indexed for reading (but 0-indexed internally)
-        return "Scale Note({})".format(self.get_name())
+        return "Scale Note({})".format(self._name)
 
     def __eq__(self, other) -> bool:
-        if type(other) in (int, str):
-            other = ScaleNote(other)
-        elif type(other) != ScaleNote:
-            raise TypeError
-        # TODO: Handle sharps and flats note equality, including E#==F
-        # # Handle C# == Db
-        # if abs(self._note - other._note) == 1:
-        #     smaller_note = self
-        #     bigger_note = other
-
-        #     if self._note > other._note:
-        #         smaller_note = other
-        #         bigger_note = self
-
-        #     if smaller_note.accidental_str == '#' and bigger_note.accidental_str == 'b':
-        #         return True
-        return self._note == other._note and self._accidental == other._accidental
+        if other.__class__ is not ScaleNote:
+            if type(other) in (int, str):
+                other = ScaleNote(other)
+            else:
+                raise TypeError
+        return self._code == other._code
+
+    def enharmonic_eq(self, other) -> bool:
+        """
+        Whether both notes are the same pitch in the major scale, eg. #1 and b2.
+        """
+        return self._semitones == ScaleNote(other)._semitones
 
     def __lt__(self, other) -> bool:
-        if type(other) in (int, str):
-            other = ScaleNote(other)
-        elif type(other) != ScaleNote:
-            raise TypeError
-
-        if self._note == other._note:
-            return self._accidental < other._accidental
+        if other.__class__ is not ScaleNote:
+            if type(other) in (int, str):
+                other = ScaleNote(other)
+            else:
+                raise TypeError
 
         # NOTE: this handles simple sharps and flats since a lower note can't be made greater than
         # the next note with a single sharp. This should be modified if multisharps are supported.
-        return self._note < other._note
+        return self._code < other._code
 
     def __hash__(self) -> int:
-        # shitty hash but should work
-        return self._accidental * 100 + self._note
+        return self._code
+
+    def get_code(self) -> int:
+        return self._code
+
+    def semitones(self) -> int:
+        """
+        Semitones above the root in the major scale, eg. 4 for 3 and 5 for #3.
+        """
+        return self._semitones
 
     def get_tone(self) -> int:
         return self._note
 
     def get_name(self) -> str:
-        return self.accidental_str() + str(self._note + 1)
+        return self._name
 
     def is_root(self) -> bool:
         return self._note == 0
 
     def in_octave(self):
         """
-        Return note within an octave ie. inverted to 0-7.
+        Return note within an octave ie. inverted to 0-6.
         """
-        return self._note % (self.MAX_SCALE_NOTE + 1)
+        return self._note % self.MAX_SCALE_NOTE
 
     def in_octave_scale_note(self):
-        return ScaleNote(self.accidental_str() + str(1 + self.in_octave()))
+        return ScaleNote.from_index(self.in_octave(), self._accidental)
 
     def accidental_str(self):
         return self.accidental_to_str(self._accidental)
@@ -130,56 +191,129 @@ class ScaleNote(object):
         elif accidental == 1:
             return '#'
 
+# Intern every degree/accidental pair up front.
+for _note in range(ScaleNote.PRECOMPUTED_NOTES):
+    for _accidental in (-1, 0, 1):
+        ScaleNote.from_index(_note, _accidental)
+
+# NOTE: note inputs are 1-indexed
+TRIAD = (ScaleNote(1), ScaleNote(3), ScaleNote(5))
+
 # TODO: clean up nomenclature of root, tone, scale name vs midi etc.
 class FunChord(object):
     """
     Chord function in a scale
+
+    FunChords are immutable and interned: building a chord that already exists returns the same
+    instance, so equal chords are the same object and can be used as cheap dictionary keys.
     """
-    def __init__(self, scale_name, degree, additions=[], omissions=[]):
+    __slots__ = ('_scale_root', '_scale_root_tone', '_scale', '_scale_tones', 'scale_quality', '_degree',
+                 '_additions', '_omissions', '_omitted_codes', '_key', '_hash', '_tones', '_pitch_class_mask')
+
+    _interned = {}  # canonical key -> FunChord
+    _intern_lock = threading.Lock()
+
+    def __new__(cls, scale_name, degree, additions=(), omissions=()):
         """
-        scale_name (str): Name of the scale eg. Cmin, G#maj, etc.
+        scale_name (str): Name of the scale eg. Cmin, G#maj, Ebdor, etc. (see scales)
         degree (int): scale degree of the chord's root note (root at 1)
-        octave (int): Octave to play at
         omissions ([str|int]): Note to remove from the chord, relative to the chord eg. [1, '5']
         additions ([str|int]): Notes to add to the chord (such as extensions) relative to the chord eg. [2, 7, 'b13']
         """
-        assert len(scale_name) >= 4, "Scale name '{}' should be formatted as (note letter)(accidental)(min|maj)".format(scale_name)
-
-        # Take scale appart
-        quality = scale_name[-3:]  # "min"|"maj"
-        note = scale_name[:-3]  # note with accidental
-        
-        self._scale_root = note  # scale root note name
-        self._scale = note_util.RELATIVE_KEY_DICT[quality]  # 7-note scale
-        self.scale_quality = quality
-        self._degree = ScaleNote(degree)  # scale degree of the chord's root note
-        self._additions = set([ScaleNote(note) for note in additions])
+        scale_root, scale_root_tone, scale = scales.parse_scale_name(scale_name)
+        scale_name = scale_root + scale.name  # eg. Bbmin is A#min
 
+        degree = ScaleNote(degree)
+        additions = cls._spelled_notes(additions)
         # NOTE: omissions can exclude additions.
-        self._omissions = set([ScaleNote(note) for note in omissions])
+        omissions = cls._spelled_notes(omissions)
+
+        # NOTE: degrees are relative to the chord's scale, so chords are keyed on exact spelling
+        # rather than on (major scale) enharmonic equality.
+        key = (scale_name, degree.get_code(),
+               tuple([note.get_code() for note in additions]),
+               tuple([note.get_code() for note in omissions]))
+        chord = cls._interned.get(key)
+        if chord is not None:
+            return chord
+
+        chord = object.__new__(cls)
+        init = object.__setattr__
+        init(chord, '_scale_root', scale_root)  # scale root note name
+        init(chord, '_scale_root_tone', scale_root_tone)
+        init(chord, '_scale', scale)
+        init(chord, '_scale_tones', scale.tones)  # scale step -> semitones from the scale root
+        init(chord, 'scale_quality', scale.name)  # eg. "maj"|"min"|"dor"
+        init(chord, '_degree', degree)  # scale degree of the chord's root note
+        init(chord, '_additions', additions)
+        init(chord, '_omissions', omissions)
+        init(chord, '_omitted_codes', frozenset(key[3]))
+        init(chord, '_key', key)
+        init(chord, '_hash', hash(key))
+        init(chord, '_tones', None)  # cached by tones()
+        init(chord, '_pitch_class_mask', None)  # cached by pitch_class_mask
+
+        with cls._intern_lock:
+            # Another thread may have interned the same chord in the meantime.
+            return cls._interned.setdefault(key, chord)
+
+    @staticmethod
+    def _spelled_notes(notes):
+        """
+        Convert notes to ScaleNotes, without duplicate spellings, sorted.
+        """
+        by_code = {}
+        for note in notes:
+            note = ScaleNote(note)
+            by_code[note.get_code()] = note
+        return tuple([by_code[code] for code in sorted(by_code)])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FunChord is immutable, build a new chord instead.")
+
+    def __reduce__(self):
+        # Rebuild through the constructor such that unpickled chords are interned too.
+        return (FunChord, (self.get_scale_name(), self._degree, self._additions, self._omissions))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __repr__(self):
         # eg. Ab Maj 7 b9 -3 (removed 3rd)
-        scale_root_tone = note_util.name_to_number[self._scale_root]
-        degree_interval = self._scale[self._degree._note]
-        root_name = note_util.number_to_name[(scale_root_tone + degree_interval) % 12]
+        root_name = note_util.number_to_name[(self._scale_root_tone + self.get_root_tone()) % 12]
 
-        extensions = [note.get_name for note in self._additions]
-        omissions = ['-' + note.get_name for note in self._additions]
+        extensions = [note.get_name() for note in self._additions]
+        omissions = ['-' + note.get_name() for note in self._omissions]
         return ' '.join([root_name, self.scale_quality] + extensions + omissions)
 
     def __eq__(self, other):
-        # TODO: invert additions into octave, compare notes in 12 tones.
-        raise NotImplementedError
+        # Chords are interned, so equal chords are the same instance.
+        return self is other
+
+    def __hash__(self):
+        return self._hash
+
+    def get_key(self):
+        """
+        Canonical key identifying the chord: (scale name, degree, additions, omissions) where notes
+        are ScaleNote spelling codes.
+        """
+        return self._key
 
     def get_scale_root_tone(self):
-        return note_util.name_to_number[self._scale_root]
+        return self._scale_root_tone
+
+    def get_scale(self) -> 'scales.Scale':
+        return self._scale
 
     def copy_additions(self):
-        return self._additions.copy()
+        return set(self._additions)
 
     def copy_omissions(self):
-        return self._omissions.copy()
+        return set(self._omissions)
 
     def get_scale_note_name(self):
         return self._scale_root
@@ -200,48 +334,50 @@ class FunChord(object):
         """
         Returns first three notes of the chord.
         """
-        # NOTE: note inputs are 1-indexed
-        triad = [ScaleNote(1 + (2 * n)) for n in range(0,3)]
-        for omission in self._omissions:
-            if omission in triad:
-                triad.remove(omission)
-
-        return triad
+        return [note for note in TRIAD if note._code not in self._omitted_codes]
 
     def tonify_note(self, scale_note):
         """ Convert a ScaleNote into a tone. """
         note_index = scale_note._note
-
-        scale_len = len(self._scale)
-        tone = self._scale[note_index % scale_len] + 12 * (note_index // scale_len)
-        tone += scale_note._accidental
-        return tone
+        if 0 <= note_index < scales.TABLE_SIZE:
+            return self._scale_tones[note_index] + scale_note._accidental
+        return self._scale.tone(note_index) + scale_note._accidental
 
     def scale_notes(self):
         """
         Returns the notes in scale used.
         """
-        chord_notes = self.triad_notes() + list(self._additions)
-
-        for omission in self._omissions:
-            omitted_note = omission
-            if omitted_note in chord_notes:
-                chord_notes.remove(omitted_note)
+        chord_notes = self.triad_notes()
+        chord_notes += [note for note in self._additions if note._code not in self._omitted_codes]
 
-        scale_notes = [(self._degree + scale_note) for scale_note in chord_notes]
-        return scale_notes
+        degree = self._degree
+        return [degree + scale_note for scale_note in chord_notes]
 
     def tones(self):  # TODO: find better name for 0-11
         """
-        Returns notes in twelve tone value.
+        Returns notes in twelve tone value, relative to the scale root. Computed once per chord.
+        """
+        if self._tones is None:
+            tones = tuple([self.tonify_note(scale_note) for scale_note in self.scale_notes()])
+            object.__setattr__(self, '_tones', tones)
+        return self._tones
+
+    @property
+    def pitch_class_mask(self) -> int:
+        """
+        12-bit mask of the pitch classes in the chord, where bit 0 is C (see note_util).
+        Computed once per chord.
         """
-        return [self.tonify_note(scale_note) for scale_note in self.scale_notes()]
+        if self._pitch_class_mask is None:
+            mask = note_util.rotate_mask(note_util.tones_to_mask(self.tones()), self.get_scale_root_tone())
+            object.__setattr__(self, '_pitch_class_mask', mask)
+        return self._pitch_class_mask
 
     def midi_notes(self, voicing_center):
         """
-        Return list of midi notes.
+        Return tuple of midi notes.
         """
-        return voice(
+        return voicing_cache.voice(
             self,
             voicing_center,
             voicing_range=1,
@@ -1,172 +1,256 @@
-import time
-import numpy as np
-from typing import List, Tuple, Union
-from copy import deepcopy
+import argparse
+import signal
+import sys
+from typing import List, Optional, Set, Tuple, Union
 
-import push2_python
-import mido
-import push2_python.constants
+import startup
+if __name__ == "__main__" and '--profile-startup' in sys.argv:
+    # Before the other imports, such that they're timed.
+    startup.enable()
 
+import mido  # not deferred: the first note needs it, see VoiceAllocator
+
+from lazy_import import lazy_module
 from fun_chord import FunChord
-from fun_pad import PadRegistry, ChordPad, ModPad, BankPad, PianoNotePad, FunPad
+from chord_table import ChordTable
+from led_frame import LedFrame
+from latency import tracker_from_env
+from profiling import CallProfiler, profiler_from_env
+from dispatcher import EventDispatcher
+from display import ChordDisplay
+from active_pads import ActivePadStack
+from voice_leading import voice_leader_from_env
+from voice_allocator import VoiceAllocator
+from scheduler import Scheduler, DEFAULT_BPM, make_scheduler, scheduler_from_env
+from fun_pad import ModPad, BankPad, PianoNotePad, FunPad, rids_from_mask, MOD_RIDS
+from key_tables import KeyTable, KeyTables
 from chord_mod import FunMod, Sus2, Sus4, Parallel, Add6, Add7, Add9, Add11
+from voicing import VoicingType, guitar_voicing, voicing_cache, voicing_type_from_env
+import fretboard
 import note_util
+import push_constants
+
+# Only imported when talking to the hardware, see init_push and register_push2_callbacks.
+push2_python = lazy_module('push2_python')
+
+CHORD_ROW = 4  # row of the chord pads, one per scale degree
+# Range of the voicing center, see set_voicing_center.
+MIN_VOICING_CENTER = note_util.name_to_midi('C1')
+MAX_VOICING_CENTER = note_util.name_to_midi('C5')
 
-def rids_from_chord(chord: FunChord):
-    rids = []
-    root = chord.get_scale_root_tone()
-    for tone in chord.tones():
-        name = note_util.number_to_name[(tone + root) % 12]
-        rids.append('Note: ' + name)
 
-    return rids
+def key_buttons() -> Tuple[str, ...]:
+    """
+    Change key: Left and Right transpose by a semitone, Scale switches between major and minor.
+    """
+    return (push_constants.BUTTON_LEFT,
+            push_constants.BUTTON_RIGHT,
+            push_constants.BUTTON_SCALE)
+
+
+def voicing_buttons() -> Tuple[str, ...]:
+    """
+    Move the voicing center: Octave Up and Octave Down move it by an octave.
+    """
+    return (push_constants.BUTTON_OCTAVE_UP,
+            push_constants.BUTTON_OCTAVE_DOWN)
 
 # TODO: Revisit voicing stuff
 class FunChordApp(object):
     """
     App handles midi connection, interface with midi and push2.
     """
-    def __init__(self):
+    def __init__(self, push=None, midi_out_port=None, quantize: Optional[int] = None, bpm: float = DEFAULT_BPM,
+                 midi_clock: bool = False, voicing_type: Optional[VoicingType] = None):
+        """
+        push: Push 2 to use, defaults to the real one (see backends for a simulated one).
+        midi_out_port: Midi port to send notes to, defaults to a virtual port for the DAW.
+        quantize: Play chords on a grid of 1/quantize notes at bpm, or on the midi clock with
+            midi_clock (see scheduler). Defaults to FUNCHORDS_QUANTIZE and the related variables.
+        voicing_type: Voicing algorithm, defaults to FUNCHORDS_VOICING or WRAP.
+        """
         # Init Push2 in User Mode to work smoothly with Ableton
-        self.push = self.init_push()
+        with startup.stage('push'):
+            self.push = push if push is not None else self.init_push()
+
+        # Pad press to midi latency per stage, off unless FUNCHORDS_LATENCY is set.
+        self.latency = tracker_from_env()
+
+        # Pads write their colors here, and it's sent to push once per event with flush_leds.
+        self.leds = LedFrame()
 
         # Init Virtual Port for DAW
-        self.midi_out_port = mido.open_output('Funchord Port', virtual=True)
+        with startup.stage('midi out'):
+            self.midi_out_port = midi_out_port if midi_out_port is not None else self.init_midi_out()
+        # Only sends the note ons and offs that change between chords.
+        self.voices = VoiceAllocator(self.midi_out_port)
+        # Notes are sent through it, right away or on a tempo grid with quantize or FUNCHORDS_QUANTIZE.
+        if quantize is not None:
+            self.scheduler: Scheduler = make_scheduler(self.voices, quantize, bpm, midi_clock)
+        else:
+            self.scheduler = scheduler_from_env(self.voices)
+        self.clock_in_port = None  # midi clock input, when quantizing to the midi clock
 
-        # Main loop
+        # Key and playing chord on the Push's display, drawn and sent from its own thread (see run_loop).
+        self.display = ChordDisplay(self.push.display)
+
+        # Main loop: push callbacks post events here, and run_loop handles them in order.
         self.running = False
+        self.dispatcher = EventDispatcher()
 
         # Harmony
         # self.active_scale_name = 'Dmin'
         # self.active_scale_name = 'Emin'
         self.active_scale_name = 'Cmaj'
-        self.modifiers = []  # TODO: merge functionality with _active_pad_stack?
+        self.modifiers = []  # TODO: merge functionality with active_pads?
 
         # Recording chords
         self.is_recording = False
         self.delete_held = False  # TODO: really should be a button handler thing
         
-        # TODO: next time I change this, I'm refactoring it into its own class.
-        # List of (pad, velocity_when_played). Use related methods.
-        self._active_pad_stack: List[Tuple[FunPad, int]] = []
+        # Held pads and their velocity when played. Use related methods.
+        self.active_pads = ActivePadStack()
 
-        self.highlighted_rids: List[str] = []  # TODO: move to highlight handler?
+        self.highlighted_rids: Set[int] = set()  # chord and mod pads highlighted. TODO: move to highlight handler?
+        self.highlighted_note_mask = 0  # pitch class mask of the highlighted note pads
 
         # midi note that the chord voicing will move towards
         self.voicing_center = note_util.name_to_midi('C3')
+        # Voicing algorithm, WRAP unless FUNCHORDS_VOICING is set (eg. GUITAR).
+        self.voicing_type = voicing_type if voicing_type is not None else voicing_type_from_env()
+        self.previous_midi_notes: Tuple[int, ...] = ()  # last chord voiced, for guitar voice leading
+
+        # Every playable chord voiced ahead of time, so pressing a pad is a lookup. It's built in the
+        # background starting with the active key, such that the pads are playable right away
+        # (chords that aren't built yet are computed on the first press).
+        with startup.stage('chord table'):
+            self.chord_table = ChordTable()
+            self.build_voicings_in_background()
 
-        self.note_ons = set()  # set of note-ons sent.
+        # Voice each chord close to the previous one instead, off unless FUNCHORDS_VOICE_LEADING is set.
+        self.voice_leader = voice_leader_from_env(self.voicing_center)
 
         # Model
         maj_scale = note_util.RELATIVE_KEY_DICT['maj']
-        self.pads = np.array([
-            np.array([None, PianoNotePad((0, 1), 1), PianoNotePad((0, 2), 3), None, PianoNotePad((0, 4), 6), PianoNotePad((0, 5), 8), PianoNotePad((0, 6), 10), None, None]),  # black notes
-            np.array([PianoNotePad((1, idx), tone) for idx, tone in enumerate(maj_scale)] + [None]),# [PianoNotePad((1, 7), 0)]),  TODO: make the registry support duplicates
-            np.array([None] * 8),
-            np.array([BankPad((3, col)) for col in range(8)]),
-            np.array([ChordPad((4, degree), self.active_scale_name, degree + 1) for degree in range(7)] + [None]),
-            np.array([ModPad((5, 0), Parallel)] + [None] * 7),
-            np.array([ModPad((6, 0), Sus4), ModPad((6, 1), Add11), ModPad((6, 2), Add9)] + [None] * 5),
-            np.array([ModPad((7, 0), Sus2), ModPad((7, 1), Add7), ModPad((7, 2), Add6)] + [None] * 5),
-        ], dtype=object)
+        self.pads: List[List[FunPad]] = [
+            [None, PianoNotePad((0, 1), 1), PianoNotePad((0, 2), 3), None, PianoNotePad((0, 4), 6), PianoNotePad((0, 5), 8), PianoNotePad((0, 6), 10), None],  # black notes
+            [PianoNotePad((1, idx), tone) for idx, tone in enumerate(maj_scale)] + [PianoNotePad((1, 7), 0)],
+            [None] * 8,
+            [BankPad((3, col)) for col in range(8)],
+            [None] * 8,  # chord pads of the active key, see set_key
+            [ModPad((5, 0), Parallel)] + [None] * 7,
+            [ModPad((6, 0), Sus4), ModPad((6, 1), Add11), ModPad((6, 2), Add9)] + [None] * 5,
+            [ModPad((7, 0), Sus2), ModPad((7, 1), Add7), ModPad((7, 2), Add6)] + [None] * 5,
+        ]
+
+        # Chord pads, registry and chord discovery index for every key, such that changing key at
+        # runtime is a swap (see set_key). Keys other than the active one are built in the background.
+        with startup.stage('key tables'):
+            self.key_tables = KeyTables(self.pads, CHORD_ROW)
+            self.key: KeyTable = None
+            self._use_key_table(self.key_tables[self.active_scale_name])
+            self.key_tables.build_in_background()
+
+        with startup.stage('init colors'):
+            self.init_colors()
+
+        # Timing and cProfile of the pad and button callbacks, off unless FUNCHORDS_PROFILE is set.
+        self.profiler: CallProfiler = None
+        profiler = profiler_from_env()
+        if profiler is not None:
+            self.enable_profiling(profiler)
+
+    def enable_profiling(self, profiler: CallProfiler):
+        """
+        Profile the pad and button callbacks (see profiling). The report is written when the app
+        stops. When profiling is off the callbacks aren't wrapped at all. Replaces the profiler
+        enabled before, if any.
+        """
+        self.profiler = profiler
+        profiler.wrap_methods(self)
+
+    def _use_key_table(self, key: KeyTable):
+        self.key = key
+        self.active_scale_name = key.scale_name
+        self.pads[CHORD_ROW] = key.chord_row_pads
+        self.registry = key.registry
+
+        # Chord discovery: holding note pads highlights the chord and mod pads that can play them.
+        self.chord_index = key.chord_index
+        self.degree_rids = key.degree_rids
+
+    def set_key(self, scale_name: str):
+        """
+        Change key, eg. 'Dmin'. Held chord pads keep playing the same degree in the new key.
+        """
+        key = self.key_tables[scale_name]
+        if key is self.key:
+            return
 
-        self.registry = PadRegistry(self.pads)
+        # The new row is written from the key's precomputed colors. The old key's chord pads are
+        # forgotten as highlighted without touching the LEDs, their row is overwritten anyway.
+        self.highlighted_rids -= self.key.degree_rid_set
+        self.leds.set_row_colors(CHORD_ROW, key.chord_row_colors)
+
+        for old_pad in self.key.chord_pads:
+            old_pad.is_highlighted = False
+            if old_pad not in self.active_pads:
+                continue
+            # Held chord pads keep their place in the stack and stay lit as pressed. Degrees the new
+            # scale doesn't have are no longer on the row, so they can't be released.
+            old_pad.is_pressed = False
+            new_pad = key.chord_row_pads[old_pad.pad_ij[1]]
+            if new_pad is None:
+                self.active_pads.remove(old_pad)
+            else:
+                self.active_pads.replace(old_pad, new_pad)
+                new_pad.on_press(self.leds)
 
-        self.init_colors()
+        self._use_key_table(key)
+        self.play_active_chord()
+        if len(self.active_pads) > 0:
+            # Without held pads nothing of the new key is highlighted, its row is already right.
+            self.handle_highlights()
+        self.flush_leds()
+        print("Key: {}".format(scale_name))
 
     def get_active_pad(self) -> FunPad:
-        # Find the last pad that has a chord.
-        for pad, _ in self._active_pad_stack[::-1]:
-            chord = pad.get_chord()
-            if chord is not None:
-                return pad
-        return None
+        # The last pad that has a chord.
+        return self.active_pads.get_active_pad()
 
     def get_active_chord(self) -> FunChord:
-        active_pad = self.get_active_pad()
-        if active_pad is not None:
-            return active_pad.get_chord()
+        return self.active_pads.get_active_chord()
 
     def get_active_modifier_pads(self) -> List[FunPad]:
-        mod_pads = []
-        for pad, _ in self._active_pad_stack:
-            if type(pad) is BankPad:
-                mod_pads += pad.modifier_pads
-            else:
-                mod = pad.get_modifier()
-                if mod is not None:
-                    mod_pads.append(pad)
-        return mod_pads
+        return self.active_pads.get_modifier_pads()
     
     def get_active_modifiers(self) -> List[FunMod]:
-        mods = []
-        for pad, _ in self._active_pad_stack:
-            if type(pad) is BankPad:
-                mods += pad.get_modifier()
-            else:
-                mod = pad.get_modifier()
-                if mod is not None:
-                    mods.append(mod)
-        return mods
+        return self.active_pads.get_modifiers()
 
     def get_active_chord_velocity(self) -> int:
-        # Find the last pad that has a chord, that's the velocity we care about.
-        for pad, velocity in self._active_pad_stack[::-1]:
-            chord = pad.get_chord()
-            if chord is not None:
-                return velocity
-        return None
+        return self.active_pads.get_active_chord_velocity()
 
     def get_latest_active_pad_by_type(self, pad_type) -> Union[FunPad, type(None)]:
         """
         Get the last pad by type. Returns None if not found.
         """
-        for pad, _ in self._active_pad_stack[::-1]:
-            if isinstance(pad, pad_type):
-                return pad
-        return None
+        return self.active_pads.get_latest_by_type(pad_type)
 
     def append_active_pad(self, pad: FunPad, velocity: int):
-        self._active_pad_stack.append((pad, velocity))
+        self.active_pads.append(pad, velocity)
 
     def remove_active_pad(self, target_pad):
         """
         Removes target_chord from the list of active chords.
         Returns True if that's the playing chord (top of the stack), false otherwise.
         """
-        if len(self._active_pad_stack) == 0:
-            print("Warning: tried to remove chord from empty stack. This is likely because the pad was pressed before push was ready.")
-            return False            
-
-        active_chord_seen = False  # active chord is the last chord-pad (ChordPad or BankPad)
-        idx = len(self._active_pad_stack) - 1  # traverse backwards to catch active chord
-        for pad, _ in self._active_pad_stack[::-1]:
-            assert idx >= 0, "Index math is wrong!"
-            chord = pad.get_chord()
-
-            if pad is target_pad:
-                self._active_pad_stack.pop(idx)
-                if chord is not None and not active_chord_seen:
-                    # this is a chord pad and we haven't seen another before
-                    return True
-                return False
-            
-            if chord is not None:
-                active_chord_seen = True
-
-            idx -= 1
-
-        # Removed nothing
-        return False
+        return self.active_pads.remove(target_pad)
 
     def has_active_chords(self) -> bool:
         """
-        Returns whether there are chord pads in the active_pad_stack
+        Returns whether there are chord pads in the active pads
         """
-        for pad, _ in self._active_pad_stack[::-1]:
-            if pad.get_chord() is not None:
-                return True
-        return False
+        return self.active_pads.has_chords()
 
     # TODO: toggle button behavior will eventually go into a button handling class
     def set_record_button_color(self):
@@ -174,7 +258,7 @@ class FunChordApp(object):
         Sets the appropriate color for the record button.
         """
         color = 'red' if self.is_recording else 'white'
-        self.push.buttons.set_button_color(push2_python.constants.BUTTON_RECORD, color=color)
+        self.push.buttons.set_button_color(push_constants.BUTTON_RECORD, color=color)
 
     def toggle_record(self):
         self.is_recording = not self.is_recording
@@ -186,6 +270,16 @@ class FunChordApp(object):
 
     def color_wipe(self):
         self.push.pads.set_all_pads_to_black()
+        self.leds.mark_sent('black')
+
+    def flush_leds(self):
+        self.leds.flush(self.push)
+        self.latency.mark('leds')
+
+    def print_latency_report(self, *_):
+        # NOTE: also used as a signal handler
+        print(self.latency.report())
+        print(self.dispatcher.report())
 
     def init_colors(self):
         # Set all pads to their default color
@@ -194,26 +288,74 @@ class FunChordApp(object):
             for j in range(8):
                 pad = self.pads[i][j]
                 if pad:
-                    self.push.pads.set_pad_color((i,j), color=pad.default_color())
+                    self.leds.set_pad_color((i,j), color=pad.default_color())
                 else:
-                    self.push.pads.set_pad_color((i,j), color='black')
+                    self.leds.set_pad_color((i,j), color='black')
+        self.flush_leds()
 
         # Set button colors to white
-        for button in (push2_python.constants.BUTTON_STOP,
-                        push2_python.constants.BUTTON_SETUP,
-                        push2_python.constants.BUTTON_RECORD,
-                        push2_python.constants.BUTTON_DELETE):
+        for button in (push_constants.BUTTON_STOP,
+                        push_constants.BUTTON_SETUP,
+                        push_constants.BUTTON_RECORD,
+                        push_constants.BUTTON_DELETE) + key_buttons() + voicing_buttons():
             self.push.buttons.set_button_color(button)
 
     def init_push(self):
         return push2_python.Push2(use_user_midi_port=True)
 
-    def play_midi_note(self, midi_note, velocity):
-        if velocity == 0:
-            print("Warning: 0 velocity note on is treated by note off according to MIDI")
-        msg = mido.Message('note_on', note=midi_note, velocity=velocity)
-        self.midi_out_port.send(msg)
-        self.note_ons.add(midi_note)
+    def init_midi_out(self):
+        return mido.open_output('Funchord Port', virtual=True)
+
+    def init_clock_in(self):
+        # Clock messages are handled on mido's thread, without going through the dispatcher.
+        return mido.open_input('Funchord Clock', virtual=True, callback=self.scheduler.on_clock_message)
+
+    def scale_names_active_first(self) -> List[str]:
+        return [self.active_scale_name] + [name for name in note_util.SCALE_NAMES
+                                           if name != self.active_scale_name]
+
+    def build_voicings_in_background(self):
+        """
+        Voice the chords of every key ahead of time for the voicing settings, active key first.
+        GUITAR chords depend on the previous chord so they aren't in the chord table, only their
+        fingerings are searched ahead of time (see fretboard.warm_in_background).
+        """
+        if self.voicing_type is VoicingType.GUITAR:
+            fretboard.warm_in_background(self.scale_names_active_first())
+        else:
+            self.chord_table.build_in_background(self.voicing_center, voicing_type=self.voicing_type,
+                                                 scale_names=self.scale_names_active_first())
+
+    def set_voicing_center(self, voicing_center: int):
+        """
+        Move the voicing center, within MIN_VOICING_CENTER and MAX_VOICING_CENTER. Chords voiced
+        around the old center are dropped, and the chord table is rebuilt for the new one in the
+        background (active key first).
+        """
+        voicing_center = min(max(voicing_center, MIN_VOICING_CENTER), MAX_VOICING_CENTER)
+        if voicing_center == self.voicing_center:
+            return
+
+        self.chord_table.invalidate(self.voicing_center)
+        self.voicing_center = voicing_center
+        self.build_voicings_in_background()
+        if self.voice_leader is not None:
+            self.voice_leader.reset(voicing_center)
+        self.previous_midi_notes = ()
+        self.play_active_chord()
+
+    def set_voicing_type(self, voicing_type: VoicingType):
+        """
+        Change the voicing algorithm. Its chords are voiced in the background (active key first, see
+        build_voicings_in_background), the tables of the other types are kept.
+        """
+        if voicing_type == self.voicing_type:
+            return
+
+        self.voicing_type = voicing_type
+        self.build_voicings_in_background()
+        self.previous_midi_notes = ()
+        self.play_active_chord()
 
     def compute_modded_chord(self):
         chord = self.get_active_chord()
@@ -227,59 +369,113 @@ class FunChordApp(object):
 
         return chord
     
-    def handle_highlights(self):
-        # Reset highlights
-        for rid in self.highlighted_rids:
-            app.registry[rid].release_highlight(self.push)
-        self.highlighted_rids = []
+    def get_held_note_mask(self) -> int:
+        """
+        Pitch class mask of the piano note pads being held.
+        """
+        mask = 0
+        for pad in self.active_pads.get_all_by_type(PianoNotePad):
+            mask |= 1 << pad.tone
+        return mask
 
-        # Highlight note pads
+    def discovery_rids(self, note_mask: int) -> List[int]:
+        """
+        Registry IDs of the chord and mod pads that can play a chord containing the notes in the mask.
+        """
+        degrees, mods = self.chord_index.matching_pads(note_mask)
+        # Scales can have more degrees than there are pads on the row, those have no pad to light.
+        return [self.degree_rids[degree - 1] for degree in degrees if degree <= len(self.degree_rids)] \
+            + [MOD_RIDS[mod] for mod in mods]
+
+    def handle_highlights(self):
+        # Highlight note pads, only touching the ones that changed
         modded_chord = self.compute_modded_chord()
-        if modded_chord is not None:
-            for rid in rids_from_chord(modded_chord):
-                app.registry[rid].highlight(self.push)
-                self.highlighted_rids.append(rid)
+        note_mask = 0 if modded_chord is None else modded_chord.pitch_class_mask
+        self.registry.release_highlight(self.leds, rids_from_mask(self.highlighted_note_mask & ~note_mask))
+        self.registry.highlight(self.leds, rids_from_mask(note_mask & ~self.highlighted_note_mask))
+        self.highlighted_note_mask = note_mask
 
-        # Highlight pads stored in bank
+        # Highlight pads stored in bank, and the pads that can play the held notes
+        rids = set()
         active_pad = self.get_active_pad()
         if type(active_pad) is BankPad:
             for pad in [active_pad.chord_pad] + active_pad.modifier_pads:
-                rid = pad.get_registry_id()
-                app.registry[rid].highlight(self.push)
-                self.highlighted_rids.append(rid)
+                rids.add(pad.get_registry_id())
+
+        held_note_mask = self.get_held_note_mask()
+        if held_note_mask:
+            rids.update(self.discovery_rids(held_note_mask))
+
+        self.registry.release_highlight(self.leds, self.highlighted_rids - rids)
+        self.registry.highlight(self.leds, rids - self.highlighted_rids)
+        self.highlighted_rids = rids
 
     def play_active_chord(self):
         """
         Sends the midi message for the active chord. Use this after changing the active chord.
         """
-        chord = self.compute_modded_chord()
+        chord = self.get_active_chord()
         velocity = self.get_active_chord_velocity()
+        modifiers = self.get_active_modifiers()
 
         if chord is None:
+            self.display.show(self.active_scale_name, modifiers=modifiers)
             return
 
-        self.send_note_offs()
-        for midi_note in chord.midi_notes(self.voicing_center):
-            self.play_midi_note(midi_note, velocity)
+        self.latency.mark('modifiers')
+        displayed_chord = chord
+
+        if self.voice_leader is not None:
+            for mod in modifiers:
+                chord = mod(chord)
+            midi_notes = self.voice_leader.voice(chord)
+        elif self.voicing_type is VoicingType.GUITAR:
+            # The fingerings were searched in the background, leading from the previous chord is an
+            # argmin over them.
+            for mod in modifiers:
+                chord = mod(chord)
+            midi_notes = guitar_voicing(chord, self.voicing_center, 1, True, previous=self.previous_midi_notes)
+        else:
+            midi_notes = self.chord_table.chord_midi_notes(chord, modifiers, self.voicing_center)
+        self.previous_midi_notes = tuple(midi_notes)
+        self.latency.mark('voicing')
+
+        # Notes shared with the previous chord keep sounding.
+        self.scheduler.play(midi_notes, velocity)
+        self.latency.mark('midi')
+
+        # Only stores what to draw, the display thread does the rest.
+        self.display.show(self.active_scale_name, displayed_chord, modifiers, midi_notes)
+
+    def get_sounding_notes(self) -> set:
+        return self.voices.sounding_notes()
 
     def send_note_offs(self):
-        for note in list(self.note_ons):
-            msg = mido.Message('note_off', note=note)
-            self.midi_out_port.send(msg)
-            self.note_ons.remove(note)
+        self.scheduler.release_all()
+        self.latency.mark('note_offs')
 
     def stop_loop(self):
         self.running = False
+        self.dispatcher.stop()
 
     def run_loop(self):
         print("\nPress [Setup] to refresh color (after switching User modes)")
         print("Starting FunChord...")
         self.running = True
 
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.print_latency_report)
+
+        self.display.show(self.active_scale_name)
+        self.display.start()
+
+        if self.scheduler.clock is not None and self.scheduler.clock.external:
+            self.clock_in_port = self.init_clock_in()
+        self.scheduler.start()
+
         try:
-            while self.running:
-                # TODO: retry connection to push if possible, and reset starting colors
-                time.sleep(0.1)
+            # TODO: retry connection to push if possible, and reset starting colors
+            self.dispatcher.run(lambda: self.running)
         except KeyboardInterrupt:
             pass
 
@@ -287,137 +483,224 @@ class FunChordApp(object):
 
     def end_app(self):
         print("\nStopping FunChord...")
+        self.scheduler.stop()  # queued notes are sent now, such that the note offs below are last
+        if self.clock_in_port is not None:
+            self.clock_in_port.close()
         self.send_note_offs()
+        self.display.stop()
         self.push.pads.set_all_pads_to_black()
         self.push.buttons.set_all_buttons_color('black')
         self.push.f_stop.set()
         print("Push2Python ended.")
         self.midi_out_port.close()
         print("MIDI port closed.")
+        print("Chord table: {} chords, {} misses".format(len(self.chord_table), self.chord_table.misses))
+        print("Voicing cache: {}".format(voicing_cache.stats()))
+        print("Display: {}".format(self.display.stats()))
+        if self.scheduler.quantize is not None:
+            print(self.scheduler.report())
+        if self.profiler is not None:
+            self.profiler.write()
+
+    # TODO: these two functions should really should refactor this into a button handler class
+    def on_button_pressed(self, button_name):
+        if button_name in (push_constants.BUTTON_STOP):
+            # Set pressed button color to red
+            self.push.buttons.set_button_color(button_name, 'red')
+
+        # TODO: should be part of the button handling magic
+        elif button_name == push_constants.BUTTON_RECORD:
+            if not self.is_recording:
+                self.push.buttons.set_button_color(button_name, 'light_gray')
+
+        elif button_name == push_constants.BUTTON_DELETE:
+            self.delete_held = True
+
+        else:
+            # Set pressed button color to white
+            self.push.buttons.set_button_color(button_name, 'white')
+
+    def on_button_released(self, button_name):
+        # Set released button color to black (off)
+        if button_name == push_constants.BUTTON_STOP:
+            self.stop_loop()
+
+        elif button_name == push_constants.BUTTON_USER:
+            self.color_wipe()
+            self.init_colors()
+
+        elif button_name == push_constants.BUTTON_SETUP:
+            self.color_wipe()
+            self.init_colors()
+            self.print_latency_report()
+
+        elif button_name == push_constants.BUTTON_RECORD:
+            self.toggle_record()
+
+        elif button_name == push_constants.BUTTON_DELETE:
+            self.delete_held = False
+
+        elif button_name in key_buttons():
+            self.push.buttons.set_button_color(button_name, 'white')
+            if button_name == push_constants.BUTTON_SCALE:
+                self.set_key(self.key.parallel_name())
+            elif button_name == push_constants.BUTTON_RIGHT:
+                self.set_key(self.key.transposed_name(1))
+            else:
+                self.set_key(self.key.transposed_name(-1))
+
+        elif button_name in voicing_buttons():
+            self.push.buttons.set_button_color(button_name, 'white')
+            octave = 12 if button_name == push_constants.BUTTON_OCTAVE_UP else -12
+            self.set_voicing_center(self.voicing_center + octave)
+            print("Voicing center: {}".format(note_util.midi_to_name(self.voicing_center, include_octave=True)))
 
-# TODO: these two functions should really should refactor this into a button handler class
-@push2_python.on_button_pressed()
-def on_button_pressed(_, button_name):
-    if button_name in (push2_python.constants.BUTTON_STOP):
-        # Set pressed button color to red
-        app.push.buttons.set_button_color(button_name, 'red')
-        
-    # TODO: should be part of the button handling magic
-    elif button_name == push2_python.constants.BUTTON_RECORD:
-        if not app.is_recording:
-            app.push.buttons.set_button_color(button_name, 'light_gray')
-
-    elif button_name == push2_python.constants.BUTTON_DELETE:
-        app.delete_held = True
-
-    else:
-        # Set pressed button color to white
-        app.push.buttons.set_button_color(button_name, 'white')
-
-@push2_python.on_button_released()
-def on_button_released(_, button_name):
-    # Set released button color to black (off)
-    if button_name == push2_python.constants.BUTTON_STOP:
-        app.stop_loop()
-
-    elif button_name == push2_python.constants.BUTTON_USER:
-        app.color_wipe()
-        app.init_colors()
-
-    elif button_name == push2_python.constants.BUTTON_SETUP:
-        app.color_wipe()
-        app.init_colors()
-
-    elif button_name == push2_python.constants.BUTTON_RECORD:
-        app.toggle_record()
-
-    elif button_name == push2_python.constants.BUTTON_DELETE:
-        app.delete_held = False
-
-    else:
-        app.push.buttons.set_button_color(button_name, 'black')
-
-# TODO: content of the pad callbacks should be in the app
-@push2_python.on_pad_pressed()
-def on_pad_pressed(_, pad_n, pad_ij, velocity):
-    should_play_chord = False
-    pad = app.pads[pad_ij[0]][pad_ij[1]]
-    if pad:
-        app.append_active_pad(pad, velocity)
-
-        # TODO: refactor app to have Model class, pass state into pad regardless instead of this cherry picked garbage.
-        # Handle chord bank pads
-        if type(pad) is BankPad:
-            pad.on_press(app.push, app.get_active_pad(), app.get_active_modifier_pads(), app.is_recording, app.delete_held)
         else:
-            pad.on_press(app.push)
-
-        # Handle chords pads
-        if pad.get_chord() is not None:
-            should_play_chord = True
-
-        # Handle modifier pads
-        get_mod = pad.get_modifier()
-        # mod may be list if it's from a bank, or just the modifier
-        mods = get_mod if type(get_mod) == list else [get_mod]
-        for mod in mods:
-            if mod is not None and mod not in app.modifiers:
-                app.modifiers.append(mod)
+            self.push.buttons.set_button_color(button_name, 'black')
+
+    def on_pad_pressed(self, pad_ij, velocity):
+        self.latency.start()
+        should_play_chord = False
+        should_highlight = False
+        pad = self.pads[pad_ij[0]][pad_ij[1]]
+        if pad:
+            self.append_active_pad(pad, velocity)
+
+            # TODO: refactor app to have Model class, pass state into pad regardless instead of this cherry picked garbage.
+            # Handle chord bank pads
+            if type(pad) is BankPad:
+                pad.on_press(self.leds, self.get_active_pad(), self.get_active_modifier_pads(), self.is_recording, self.delete_held)
+                self.active_pads.refresh(pad)  # the bank may have stored or dropped a chord
+            else:
+                pad.on_press(self.leds)
+
+            # Handle chords pads
+            if pad.get_chord() is not None:
                 should_play_chord = True
 
-    # Handle highlights and midi accordingly
-    if should_play_chord:
-        app.play_active_chord()
-        app.handle_highlights()
-
-# TODO: content of the pad callbacks should be in the app
-@push2_python.on_pad_released()
-def on_pad_released(_, pad_n, pad_ij, velocity):
-    should_release_notes = False
-    should_play_chord = False
-    modifier_changed = False
-    pad = app.pads[pad_ij[0]][pad_ij[1]]
-    if pad:        
-        # Handle chords pads
-        pad.on_release(app.push)
-        if app.remove_active_pad(pad):
-            # The playing chord was removed
-            should_play_chord = True
-
-        if pad.get_chord() is not None and not app.has_active_chords():
-            should_release_notes = True
-
-        if app.is_recording:
-            bankpad = app.get_latest_active_pad_by_type(BankPad)
-            if bankpad is not None and bankpad is not pad:
-                # if there's an active bank pad that's not the last pad
-                bankpad.update(pad)
-
-        # Handle modifier pads
-        get_mod = pad.get_modifier()
-        # mod may be list if it's from a bank, or just the modifier
-        mods = get_mod if type(get_mod) == list else [get_mod]
-        for mod in mods:
-            if mod is not None and mod in app.modifiers:
-                app.modifiers.remove(mod)
-                modifier_changed = True
-    
-    # Handle highlights and midi accordingly
-    # NOTE: We always release chord pads, but they may be played immediately after
-    if should_release_notes:
-        # should release all notes if the last active chord was released
-        app.send_note_offs()
+            # Handle modifier pads
+            get_mod = pad.get_modifier()
+            # mod may be list if it's from a bank, or just the modifier
+            mods = get_mod if type(get_mod) == list else [get_mod]
+            for mod in mods:
+                if mod is not None and mod not in self.modifiers:
+                    self.modifiers.append(mod)
+                    should_play_chord = True
+
+            # Handle note pads (chord discovery)
+            if isinstance(pad, PianoNotePad):
+                should_highlight = True
+        self.latency.mark('pad')
+
+        # Handle highlights and midi accordingly
+        if should_play_chord:
+            self.play_active_chord()
+        if should_play_chord or should_highlight:
+            self.handle_highlights()
+            self.latency.mark('highlights')
+
+        self.flush_leds()
+        self.latency.finish()
+
+    def on_pad_released(self, pad_ij, velocity):
+        self.latency.start()
+        should_release_notes = False
+        should_play_chord = False
+        modifier_changed = False
+        pad = self.pads[pad_ij[0]][pad_ij[1]]
+        if pad:        
+            # Handle chords pads
+            pad.on_release(self.leds)
+            if self.remove_active_pad(pad):
+                # The playing chord was removed
+                should_play_chord = True
+
+            if pad.get_chord() is not None and not self.has_active_chords():
+                should_release_notes = True
+
+            if self.is_recording:
+                bankpad = self.get_latest_active_pad_by_type(BankPad)
+                if bankpad is not None and bankpad is not pad:
+                    # if there's an active bank pad that's not the last pad
+                    bankpad.update(pad)
+                    self.active_pads.refresh(bankpad)
+
+            # Handle modifier pads
+            get_mod = pad.get_modifier()
+            # mod may be list if it's from a bank, or just the modifier
+            mods = get_mod if type(get_mod) == list else [get_mod]
+            for mod in mods:
+                if mod is not None and mod in self.modifiers:
+                    self.modifiers.remove(mod)
+                    modifier_changed = True
+        self.latency.mark('pad')
+
+        # Handle highlights and midi accordingly
+        # NOTE: We always release chord pads, but they may be played immediately after
+        if should_release_notes:
+            # should release all notes if the last active chord was released
+            self.send_note_offs()
+
+        if should_play_chord:
+            # Should only play a chord if the currently playing chord was released
+            self.play_active_chord()
+
+        elif modifier_changed:
+            # replay the chord if the modifier changed
+            self.play_active_chord()
+
+        self.handle_highlights()
+        self.latency.mark('highlights')
+        self.flush_leds()
+        self.latency.finish()
+
+
+def register_push2_callbacks(app: FunChordApp):
+    """
+    Route push2_python's callbacks to the app. push2_python only supports global callbacks, so this
+    should be called once, for the app running on the hardware.
+
+    The callbacks run on push2_python's threads, so they only queue events for the app's main loop.
+    """
+    @push2_python.on_button_pressed()
+    def on_button_pressed(_, button_name):
+        app.dispatcher.post(app.on_button_pressed, button_name)
 
-    if should_play_chord:
-        # Should only play a chord if the currently playing chord was released
-        app.play_active_chord()
+    @push2_python.on_button_released()
+    def on_button_released(_, button_name):
+        app.dispatcher.post(app.on_button_released, button_name)
 
-    elif modifier_changed:
-        # replay the chord if the modifier changed
-        app.play_active_chord()
+    @push2_python.on_pad_pressed()
+    def on_pad_pressed(_, pad_n, pad_ij, velocity):
+        app.dispatcher.post(app.on_pad_pressed, pad_ij, velocity)
 
-    app.handle_highlights()
+    @push2_python.on_pad_released()
+    def on_pad_released(_, pad_n, pad_ij, velocity):
+        app.dispatcher.post(app.on_pad_released, pad_ij, velocity)
 
 if __name__ == "__main__":
-    app = FunChordApp()
+    parser = argparse.ArgumentParser(description="Play chords from a Push 2.")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Print the time spent in each import and initialization stage.")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Profile the pad and button callbacks and write the report to FILE on exit "
+                             "(same as FUNCHORDS_PROFILE=FILE, which it overrides).")
+    parser.add_argument('--profile-sample', type=int, default=1, metavar='N',
+                        help="With --profile, run one callback out of N under cProfile.")
+    parser.add_argument('--voicing', choices=[voicing_type.name for voicing_type in VoicingType],
+                        help="Voicing algorithm, eg. GUITAR (same as FUNCHORDS_VOICING, which it overrides).")
+    parser.add_argument('--quantize', type=int, metavar='DIVISION',
+                        help="Play chords on a grid of 1/DIVISION notes, eg. 16 (same as FUNCHORDS_QUANTIZE).")
+    parser.add_argument('--bpm', type=float, default=DEFAULT_BPM, help="Tempo of the internal clock for --quantize.")
+    parser.add_argument('--midi-clock', action='store_true',
+                        help="With --quantize, follow the midi clock sent to the 'Funchord Clock' port.")
+    args = parser.parse_args()
+
+    app = FunChordApp(quantize=args.quantize, bpm=args.bpm, midi_clock=args.midi_clock,
+                      voicing_type=VoicingType[args.voicing] if args.voicing else None)
+    if args.profile:
+        app.enable_profiling(CallProfiler(args.profile, args.profile_sample))
+    register_push2_callbacks(app)
+    if args.profile_startup:
+        startup.report()
     app.run_loop()
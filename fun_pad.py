@@ -1,11 +1,10 @@
-from typing import Tuple, List, Type
+from typing import Iterable, List, Tuple
 import copy
 import threading
 
 import note_util
 from fun_chord import FunChord
-from chord_mod import FunMod, mod_color_map, Sus2, Sus4
-from push2_python import constants
+from chord_mod import FunMod, mod_color_map, all_mods
 
 class FunPad(object):
     """
@@ -22,44 +21,48 @@ class FunPad(object):
     def __repr__(self):
         return str(type(self)) + " at " + str(self.pad_ij)
     
-    def _change_color(self, push, color):
-        push.pads.set_pad_color(self.pad_ij, color)
+    def _change_color(self, leds, color):
+        leds.set_pad_color(self.pad_ij, color)
 
-    def _update_color(self, push):
+    def _update_color(self, leds):
+        """
+        Write the pad's color into the LED frame (see led_frame). It's sent to Push when the app
+        flushes the frame.
+        """
         if self.is_pressed:
-            self._change_color(push, self.press_color())
+            self._change_color(leds, self.press_color())
         elif self.is_highlighted:
-            self._change_color(push, self.highlight_color())
+            self._change_color(leds, self.highlight_color())
         else:
-            self._change_color(push, self.default_color())
+            self._change_color(leds, self.default_color())
 
-    def on_press(self, push):
+    def on_press(self, leds):
         """
         What to do when the pad is pressed. If a pad overwrites this function to do extra stuff,
         it should call the super anyway.
         """
         self.is_pressed = True
-        self._update_color(push)
+        self._update_color(leds)
     
-    def on_release(self, push):
+    def on_release(self, leds):
         """
         What to do when the pad is released. If a pad overwrites this function to do extra stuff,
         it should call the super anyway.
         """
         self.is_pressed = False
-        self._update_color(push)
+        self._update_color(leds)
 
-    def highlight(self, push):
+    def highlight(self, leds):
         """
         Allows pad to be lit up differently through the Registry.
         Eg. when Cmaj is played, notes C, E, and G are highlighted.
         """
         self.is_highlighted = True
-        self._update_color(push)
+        self._update_color(leds)
 
-    def release_highlight(self, push):
+    def release_highlight(self, leds):
         self.is_highlighted = False
-        self._update_color(push)
+        self._update_color(leds)
 
     def get_registry_id(self):
         return self._registry_id
@@ -99,6 +102,37 @@ class FunPad(object):
         """
         pass
 
+# Registry IDs are small integers, such that the registry can be a list. Note pads use their pitch
+# class (0 is C), the rest get the next free ID the first time they're used.
+NOTE_RIDS = tuple(range(12))
+_rids = dict()  # ('mod', FunMod) or ('chord', FunChord) -> registry ID
+_rids_lock = threading.Lock()
+
+def _registry_id(key) -> int:
+    rid = _rids.get(key)
+    if rid is None:
+        with _rids_lock:
+            rid = _rids.setdefault(key, len(NOTE_RIDS) + len(_rids))
+    return rid
+
+def chord_rid(chord: FunChord) -> int:
+    return _registry_id(('chord', chord))
+
+def mod_rid(mod: FunMod) -> int:
+    return _registry_id(('mod', mod))
+
+# Registry ID of each modifier.
+MOD_RIDS = {mod: mod_rid(mod) for mod in all_mods}
+
+def rids_from_mask(mask: int) -> Tuple[int, ...]:
+    """
+    Registry IDs of the piano note pads for a pitch class mask (see note_util).
+    """
+    return note_util.mask_to_tones(mask)
+
+def rids_from_chord(chord: FunChord) -> Tuple[int, ...]:
+    return rids_from_mask(chord.pitch_class_mask)
+
 class PianoNotePad(FunPad):
     def __init__(self, pad_ij, tone):
         self.tone = tone
@@ -107,10 +141,10 @@ class PianoNotePad(FunPad):
         super(PianoNotePad, self).__init__(pad_ij)
 
     def set_registry_id(self):
-        return 'Note: ' + note_util.number_to_name[self.tone]
+        return NOTE_RIDS[self.tone]
 
     def default_color(self):
-        if self.tone in note_util.RELATIVE_KEY_DICT['maj']:
+        if note_util.mask_contains(note_util.RELATIVE_KEY_MASK['maj'], self.tone):
             return 'white'
         else:
             return 'light_gray'
@@ -124,14 +158,21 @@ class ChordPad(FunPad):
     def __init__(self, pad_ij, scale, root_degree):
         # Model
         self.chord = FunChord(scale, root_degree)
+        self._default_color = self._function_color()
 
         # APIs (last such that the set_registry has everything it needs)
         super(ChordPad, self).__init__(pad_ij)
 
     def set_registry_id(self):
-        return 'Chord: ' + str(self.chord)
+        return chord_rid(self.chord)
 
     def default_color(self):
+        return self._default_color
+
+    def _function_color(self):
+        """
+        Color for the harmonic function of the chord in its scale.
+        """
         tonic_color = 'purple'
         subdominant_color = 'pink'
         dominant_color = 'red'
@@ -167,7 +208,7 @@ class ModPad(FunPad):
         super(ModPad, self).__init__(pad_ij)
 
     def set_registry_id(self):
-        return 'Mod: ' + str(self.mod)
+        return mod_rid(self.mod)
 
     def default_color(self):
         if self.mod in mod_color_map:
@@ -197,9 +238,9 @@ class BankPad(FunPad):
         # such that playing the chord+mods stored lights this up.
         return None
 
-    def on_press(self, push, chord_pad, modifier_pads, is_recording, is_delete_held):
+    def on_press(self, leds, chord_pad, modifier_pads, is_recording, is_delete_held):
         # Returns whether the value was successfully changed
-        super(BankPad, self).on_press(push)
+        super(BankPad, self).on_press(leds)
 
         if is_delete_held:
             self.chord_pad = None
@@ -207,11 +248,14 @@ class BankPad(FunPad):
 
         # TODO?: Could also store just modifiers in the bank? Need to think design, might need color
         elif self.is_empty() and chord_pad:
+            if type(chord_pad) is BankPad:
+                # Store the chord pad held by the other bank, since bank pads aren't in the registry.
+                chord_pad = chord_pad.chord_pad
             self.chord_pad = chord_pad
             self.modifier_pads = copy.deepcopy(modifier_pads)
 
-    def on_release(self, push):
-        super(BankPad, self).on_release(push)
+    def on_release(self, leds):
+        super(BankPad, self).on_release(leds)
 
     def press_color(self):
         if self.is_empty():
@@ -260,31 +304,48 @@ class PadRegistry(object):
     """
     Registry of pads to keep track of which pads are active.
 
-    It's effectively a dictionary mapping "Registry IDs" to the Pad objects. This allows pads
-    to act on other pads via a simple ID. For example, a chord can highlight note pads on the piano.
-    Registry IDs are strings unique to each pad and should be easy to compute based on the purpose
-    of the pad. For example, the ID for C on the pad piano is 'Note: C'.
+    It maps "Registry IDs" to the pads with that ID. This allows pads to act on other pads via a
+    simple ID. For example, a chord can highlight note pads on the piano. Registry IDs are small
+    integers computed from the purpose of the pad: the pitch class for note pads (see NOTE_RIDS),
+    and chord_rid/mod_rid for chord and modifier pads. Several pads can share an ID, eg. the same
+    note in two octaves.
     """
     def __init__(self, pad_grid):
-        self._registry = dict()
+        self._pads: List[List[FunPad]] = [[] for _ in NOTE_RIDS]  # registry ID -> pads
         for row in pad_grid:
             for pad in row:
-                if pad is None or pad.get_registry_id() is None:
-                    continue
-                
-                rid = pad.get_registry_id()
-                assert rid not in self._registry, "Pad RID ({}) already in registry.".format(rid)
+                if pad is not None:
+                    self.register(pad)
+
+    def register(self, pad: FunPad):
+        rid = pad.get_registry_id()
+        if rid is None:
+            return
+        while len(self._pads) <= rid:
+            self._pads.append([])
+        assert pad not in self._pads[rid], "Pad {} already in registry.".format(pad)
+        self._pads[rid].append(pad)
+
+    def __getitem__(self, rid: int) -> List[FunPad]:
+        """
+        Pads with the registry ID, empty if there are none.
+        """
+        if rid < len(self._pads):
+            return self._pads[rid]
+        return []
 
-                self._registry[rid] = pad
+    def highlight(self, leds, rids: Iterable[int]):
+        for rid in rids:
+            for pad in self[rid]:
+                pad.highlight(leds)
 
-    def __getitem__(self, key: str) -> FunPad:
-        try:
-            return self._registry[key]
-        except KeyError:
-            print("Warning: key ({}) not found in registry.".format(key))
+    def release_highlight(self, leds, rids: Iterable[int]):
+        for rid in rids:
+            for pad in self[rid]:
+                pad.release_highlight(leds)
 
-    def highlight_pad(self, pad_rid: str):
-        self._registry[pad_rid].highlight()
+    def highlight_pad(self, leds, pad_rid: int):
+        self.highlight(leds, (pad_rid,))
 
-    def release_pad_highlight(self, pad_rid: str):
-        self._registry[pad_rid].release_highlight()
+    def release_pad_highlight(self, leds, pad_rid: int):
+        self.release_highlight(leds, (pad_rid,))
@@ -0,0 +1,106 @@
+"""
+Everything on the pads that depends on the key, built once per key (by default the 24 major/minor
+keys, see note_util.SCALE_NAMES).
+
+Changing the key at runtime swaps the app over to another KeyTable: the row of chord pads (with
+their chords and colors), the registry (whose chord IDs are per key) and the chord discovery index.
+The LED colors of the row are precomputed too and written to the LED frame as a whole row. Voiced
+chords for every key are already in the ChordTable, so nothing is built during a switch, and the
+LED frame only sends the pads whose color changed.
+
+KeyTables builds the active key first and the others in the background, such that startup doesn't
+wait for every key. Switching to a key that isn't built yet builds it on the spot.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import note_util
+import scales
+from fun_pad import ChordPad, FunPad, PadRegistry, chord_rid
+from chord_index import ScaleChordIndex
+
+
+class KeyTable(object):
+    def __init__(self, scale_name: str, pad_grid: Sequence[Sequence[FunPad]], chord_row: int):
+        """
+        scale_name: Key, eg. 'Cmaj' or 'F#min' (see scales).
+        pad_grid: The app's pads. The chord pads of chord_row are replaced with this key's.
+        chord_row: Row of the chord pads, one per degree starting at column 0.
+        """
+        _, self.scale_root_tone, scale = scales.parse_scale_name(scale_name)
+        self.scale_name = scale_name
+        self.scale_quality = scale.name
+
+        # One pad per degree, as many as fit on the row.
+        self.chord_row = chord_row
+        degrees = scale.degrees()[:len(pad_grid[chord_row])]
+        self.chord_pads: List[ChordPad] = [
+            ChordPad((chord_row, degree - 1), scale_name, degree) for degree in degrees]
+        self.degree_rids: List[int] = [chord_rid(pad.get_chord()) for pad in self.chord_pads]
+        self.degree_rid_set = frozenset(self.degree_rids)
+
+        # The whole row, such that a scale with fewer degrees doesn't leave the other key's pads on
+        # it, and its LED colors when no pad of the row is pressed or highlighted. A chord pad of
+        # another key maps to the pad in its column.
+        row_length = len(pad_grid[chord_row])
+        self.chord_row_pads: List[Optional[ChordPad]] = \
+            self.chord_pads + [None] * (row_length - len(self.chord_pads))
+        self.chord_row_colors: List[str] = [
+            'black' if pad is None else pad.default_color() for pad in self.chord_row_pads]
+
+        grid = [list(row) for row in pad_grid]
+        grid[chord_row] = self.chord_row_pads
+        self.registry = PadRegistry(grid)
+
+        self.chord_index = ScaleChordIndex(scale_name)
+
+    def __repr__(self):
+        return "KeyTable({})".format(self.scale_name)
+
+    def transposed_name(self, semitones: int) -> str:
+        return note_util.number_to_name[(self.scale_root_tone + semitones) % 12] + self.scale_quality
+
+    def parallel_name(self) -> str:
+        """
+        Same root, other quality, eg. Cmin for Cmaj. Other scales go to major.
+        """
+        root = note_util.number_to_name[self.scale_root_tone]
+        return root + ('min' if self.scale_quality == 'maj' else 'maj')
+
+
+class KeyTables(object):
+    """
+    KeyTable of each key, built on first use.
+    """
+    def __init__(self, pad_grid: Sequence[Sequence[FunPad]], chord_row: int):
+        self.pad_grid = pad_grid
+        self.chord_row = chord_row
+        self._tables: Dict[str, KeyTable] = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, scale_name: str):
+        return scale_name in self._tables
+
+    def __getitem__(self, scale_name: str) -> KeyTable:
+        table = self._tables.get(scale_name)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(scale_name)
+                if table is None:
+                    table = self._tables[scale_name] = KeyTable(scale_name, self.pad_grid, self.chord_row)
+        return table
+
+    def build_in_background(self, scale_names: Sequence[str] = note_util.SCALE_NAMES) -> threading.Thread:
+        def build_tables():
+            for scale_name in scale_names:
+                self[scale_name].chord_index.index  # also builds the chord index of the scale quality
+                time.sleep(0)  # let the app's threads run between keys
+
+        thread = threading.Thread(target=build_tables, name='KeyTables.build', daemon=True)
+        thread.start()
+        return thread
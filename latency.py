@@ -0,0 +1,184 @@
+"""
+Latency instrumentation for the pad press -> midi out path.
+
+The app stamps each stage of handling a pad (modifiers, voicing, midi, highlights, leds) with a
+monotonic clock and records the time spent in each stage into an HDR style histogram: buckets are
+powers of two split into linear sub-buckets, so recording is a couple of integer operations and the
+precision is the same (~3%) from microseconds to seconds.
+
+Tracking is off by default, in which case every call returns after a single branch. Set the
+FUNCHORDS_LATENCY environment variable to turn it on. The report is printed with the Setup button
+or by sending SIGUSR1 to the app.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List
+
+# NOTE: stages are recorded in the order they're first seen, which is the order of the report.
+TOTAL_STAGE = 'total'
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations in nanoseconds, with 2**SUB_BUCKET_BITS linear sub-buckets per power of
+    two.
+    """
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+    MAX_VALUE_BITS = 40  # ~18 minutes in nanoseconds, longer values are clamped
+
+    def __init__(self):
+        bucket_count = (self.MAX_VALUE_BITS - self.SUB_BUCKET_BITS + 1) * self.SUB_BUCKET_COUNT
+        self._counts = [0] * bucket_count
+        self.count = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def bucket_index(cls, value: int) -> int:
+        if value < cls.SUB_BUCKET_COUNT:
+            return value  # exact for small values
+
+        magnitude = min(value.bit_length(), cls.MAX_VALUE_BITS)
+        shift = magnitude - cls.SUB_BUCKET_BITS - 1
+        top_bits = min(value >> shift, 2 * cls.SUB_BUCKET_COUNT - 1)  # in [S, 2S)
+        return (shift + 1) * cls.SUB_BUCKET_COUNT + top_bits - cls.SUB_BUCKET_COUNT
+
+    @classmethod
+    def bucket_lowest_value(cls, index: int) -> int:
+        power, sub_bucket = divmod(index, cls.SUB_BUCKET_COUNT)
+        if power == 0:
+            return sub_bucket
+        return (cls.SUB_BUCKET_COUNT + sub_bucket) << (power - 1)
+
+    def record(self, value: int):
+        self._counts[self.bucket_index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, percent: float) -> int:
+        """
+        Lowest value of the bucket containing the percentile, or exactly the max for 100.
+        """
+        if self.count == 0:
+            return 0
+        if percent >= 100:
+            return self.max
+
+        target = max(1, int(round(self.count * percent / 100.)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_lowest_value(index), self.max)
+        return self.max
+
+    def reset(self):
+        self._counts = [0] * len(self._counts)
+        self.count = 0
+        self.min = None
+        self.max = 0
+
+
+class LatencyTracker(object):
+    """
+    Records per-stage latency histograms for events (eg. a pad press).
+
+    Call start when the event comes in, mark after each stage and finish at the end. Marks outside
+    of start/finish (eg. replaying a chord outside of a pad event) are ignored.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._local = threading.local()  # timestamps of the event on the current thread
+
+    def start(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        self._local.start = now
+        self._local.last = now
+
+    def mark(self, stage: str):
+        """
+        Record the time since the last mark (or start) as the duration of stage.
+        """
+        if not self.enabled:
+            return
+        last = getattr(self._local, 'last', None)
+        if last is None:
+            return
+        now = time.perf_counter_ns()
+        self._histogram(stage).record(now - last)
+        self._local.last = now
+
+    def finish(self):
+        if not self.enabled:
+            return
+        start = getattr(self._local, 'start', None)
+        if start is None:
+            return
+        self._histogram(TOTAL_STAGE).record(time.perf_counter_ns() - start)
+        self._local.start = None
+        self._local.last = None
+
+    def _histogram(self, stage: str) -> LatencyHistogram:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def report(self) -> str:
+        """
+        Table of p50, p99 and max per stage, in microseconds.
+        """
+        if not self.enabled:
+            return "Latency tracking is off, set FUNCHORDS_LATENCY=1 to turn it on."
+
+        lines = ["{:<12}{:>8}{:>10}{:>10}{:>10}".format('stage', 'count', 'p50 us', 'p99 us', 'max us')]
+        stages: List[str] = [stage for stage in self.histograms if stage != TOTAL_STAGE]
+        if TOTAL_STAGE in self.histograms:
+            stages.append(TOTAL_STAGE)
+
+        for stage in stages:
+            histogram = self.histograms[stage]
+            lines.append("{:<12}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                stage,
+                histogram.count,
+                histogram.percentile(50) / 1e3,
+                histogram.percentile(99) / 1e3,
+                histogram.max / 1e3))
+        return '\n'.join(lines)
+
+
+def tracker_from_env() -> LatencyTracker:
+    return LatencyTracker(enabled=bool(os.environ.get('FUNCHORDS_LATENCY')))
+
+
+if __name__ == "__main__":
+    import random
+
+    tracker = LatencyTracker(enabled=True)
+    for _ in range(10000):
+        tracker.start()
+        time.sleep(0)
+        tracker.mark('sleep')
+        sum(range(random.randint(10, 1000)))
+        tracker.mark('sum')
+        tracker.finish()
+    print(tracker.report())
+
+    disabled = LatencyTracker()
+    start = time.perf_counter_ns()
+    for _ in range(100000):
+        disabled.mark('sum')
+    print("Disabled mark: {:.0f} ns".format((time.perf_counter_ns() - start) / 100000))
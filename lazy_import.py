@@ -0,0 +1,36 @@
+"""
+Deferred imports, to keep startup fast.
+
+numpy, mido and push2_python take most of the time to start the app, and a lot of the code only
+needs them on some paths (batch voicing, voice leading, opening ports). lazy_module returns a
+placeholder module that imports the real one the first time one of its attributes is used:
+
+    np = lazy_module('numpy')  # nothing imported yet
+    np.zeros(3)                # numpy is imported here
+
+After the first use the module's attributes are copied on the placeholder, so later lookups are as
+fast as on the real module. Annotations are evaluated when a function is defined, so annotations
+using a lazy module should be strings (eg. 'np.ndarray').
+"""
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # Only called for attributes that aren't on the placeholder yet.
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # Submodule the package doesn't import itself, eg. push2_python.constants.
+            return importlib.import_module(self.__name__ + '.' + attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self.__name__)
+
+
+def lazy_module(name: str) -> types.ModuleType:
+    return LazyModule(name)
@@ -0,0 +1,91 @@
+"""
+Frame buffer for the pad LEDs.
+
+Pads write the color they want into the frame, and the app flushes it to Push once per event. Only
+pads whose color differs from what was last sent are written, so transitions that end where they
+started (eg. releasing a highlight and highlighting the same note again) cost nothing on the USB
+link, which is shared with the notes going out.
+"""
+
+import threading
+from typing import Sequence, Tuple
+
+PUSH_PAD_ROWS = 8
+PUSH_PAD_COLS = 8
+
+
+class LedFrame(object):
+    """
+    Desired color of each pad, diffed against the last colors sent to Push.
+    """
+    def __init__(self, rows: int = PUSH_PAD_ROWS, cols: int = PUSH_PAD_COLS):
+        self.rows = rows
+        self.cols = cols
+        self._colors = [[None] * cols for _ in range(rows)]  # desired color
+        self._sent = [[None] * cols for _ in range(rows)]  # last color sent, None if unknown
+        self._dirty = set()  # pads where the desired color differs from the sent color
+        self._lock = threading.Lock()
+
+        self.flushes = 0
+        self.pads_sent = 0
+
+    def set_pad_color(self, pad_ij: Tuple[int, int], color: str):
+        i, j = pad_ij
+        with self._lock:
+            self._colors[i][j] = color
+            if self._sent[i][j] == color:
+                self._dirty.discard((i, j))
+            else:
+                self._dirty.add((i, j))
+
+    def set_row_colors(self, i: int, colors: Sequence[str]):
+        """
+        Set the colors of every pad of row i at once (eg. a precomputed row, see key_tables).
+        """
+        with self._lock:
+            self._colors[i][:] = colors
+            sent = self._sent[i]
+            for j, color in enumerate(colors):
+                if sent[j] == color:
+                    self._dirty.discard((i, j))
+                else:
+                    self._dirty.add((i, j))
+
+    def get_pad_color(self, pad_ij: Tuple[int, int]) -> str:
+        return self._colors[pad_ij[0]][pad_ij[1]]
+
+    def is_dirty(self) -> bool:
+        return len(self._dirty) > 0
+
+    def mark_sent(self, color: str = None):
+        """
+        Record that every pad was set to color without going through the frame (eg. Push was wiped
+        to black). Use None if the pads' colors are unknown, which resends everything next flush.
+        """
+        with self._lock:
+            for i in range(self.rows):
+                for j in range(self.cols):
+                    self._sent[i][j] = color
+                    if self._colors[i][j] == color:
+                        self._dirty.discard((i, j))
+                    else:
+                        self._dirty.add((i, j))
+
+    def flush(self, push) -> int:
+        """
+        Send the pads that changed since the last flush in one batch. Returns the number of pads sent.
+        """
+        with self._lock:
+            if not self._dirty:
+                return 0
+
+            changed = sorted(self._dirty)
+            self._dirty.clear()
+            for i, j in changed:
+                color = self._colors[i][j]
+                push.pads.set_pad_color((i, j), color=color)
+                self._sent[i][j] = color
+
+            self.flushes += 1
+            self.pads_sent += len(changed)
+            return len(changed)
@@ -0,0 +1,195 @@
+"""
+Load generator for FunChordApp on the simulated backends (see backends).
+
+Fires random pad press/release sequences from one or more threads like push2_python's callbacks
+would, then reports throughput and checks that the app ends up in a clean state (nothing held, no
+notes left on). Threads press disjoint sets of pads, so a pad is never pressed twice without being
+released.
+
+By default events are posted to the app's dispatcher and handled by a single consumer like in the
+app. Use --direct to call on_pad_pressed/on_pad_released from the sending threads instead.
+
+Usage:
+    python load_test.py --events 100000 --threads 4
+    python load_test.py --events 20000 --rate 2000 --latency
+    python load_test.py --events 2000 --rate 100 --quantize 16
+"""
+
+import argparse
+import random
+import threading
+import time
+import traceback
+from typing import List, Tuple
+
+from backends import FakePush2, FakeMidiOut
+from fun_chords_app import FunChordApp
+from latency import LatencyTracker
+from scheduler import DEFAULT_BPM
+from voicing import voicing_cache
+
+
+def playable_pads(app: FunChordApp) -> List[Tuple[int, int]]:
+    return [(i, j) for i in range(len(app.pads)) for j in range(len(app.pads[i]))
+            if app.pads[i][j] is not None]
+
+
+def press_release_sequence(app, pads, events, max_held, rate, seed, errors, direct):
+    """
+    Press and release random pads from pads, events times. rate is in events per second for this
+    thread, 0 for as fast as possible.
+    """
+    if direct:
+        on_pad_pressed, on_pad_released = app.on_pad_pressed, app.on_pad_released
+    else:
+        on_pad_pressed = lambda *args: app.dispatcher.post(app.on_pad_pressed, *args)
+        on_pad_released = lambda *args: app.dispatcher.post(app.on_pad_released, *args)
+
+    rng = random.Random(seed)
+    held = []
+    interval = 1. / rate if rate else 0.
+    next_event = time.perf_counter()
+
+    try:
+        for _ in range(events):
+            if interval:
+                next_event += interval
+                delay = next_event - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if held and (len(held) >= max_held or len(held) == len(pads) or rng.random() < 0.5):
+                pad_ij = held.pop(rng.randrange(len(held)))
+                on_pad_released(pad_ij, 0)
+            else:
+                pad_ij = rng.choice([pad for pad in pads if pad not in held])
+                held.append(pad_ij)
+                on_pad_pressed(pad_ij, rng.randint(1, 127))
+
+        for pad_ij in held:
+            on_pad_released(pad_ij, 0)
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def check_clean_state(app: FunChordApp) -> List[str]:
+    problems = []
+    if app.active_pads:
+        problems.append("Active pad stack not empty: {}".format(app.active_pads))
+    if app.modifiers:
+        problems.append("Modifiers still active: {}".format(app.modifiers))
+    sounding = app.get_sounding_notes()
+    if sounding:
+        problems.append("App thinks notes are still on: {}".format(sorted(sounding)))
+    sounding = app.midi_out_port.sounding_notes()
+    if sounding:
+        problems.append("Notes left sounding on the midi port: {}".format(sorted(sounding)))
+    return problems
+
+
+def check_modifier_lookups(app: FunChordApp) -> List[str]:
+    """
+    Press Sus4 then Add7 then a chord pad, and the other way around: both are chord table hits since
+    the modifiers give the same chord in either order.
+    """
+    app.chord_table.build(app.voicing_center, scale_names=[app.active_scale_name])
+    sus4, add7, chord = (6, 0), (7, 1), (4, 1)
+    problems = []
+    for pads in ([sus4, add7, chord], [add7, sus4, chord]):
+        misses = app.chord_table.misses
+        for pad_ij in pads:
+            app.on_pad_pressed(pad_ij, 100)
+        for pad_ij in reversed(pads):
+            app.on_pad_released(pad_ij, 0)
+        if app.chord_table.misses != misses:
+            problems.append("Chord table miss for modifiers pressed in the order {}".format(pads))
+    return problems
+
+
+def run_load_test(events=10000, threads=1, rate=0, max_held=3, seed=0, latency=False, direct=False,
+                  quantize=None, bpm=DEFAULT_BPM):
+    app = FunChordApp(push=FakePush2(), midi_out_port=FakeMidiOut(), quantize=quantize or None, bpm=bpm)
+    if latency:
+        app.latency = LatencyTracker(enabled=True)
+
+    pads = playable_pads(app)
+    rng = random.Random(seed)
+    rng.shuffle(pads)
+    pad_groups = [pads[idx::threads] for idx in range(threads)]
+
+    errors = []
+    workers = [
+        threading.Thread(
+            target=press_release_sequence,
+            args=(app, group, events // threads, max_held, rate / threads, seed + idx, errors, direct))
+        for idx, group in enumerate(pad_groups)
+    ]
+
+    app.running = True
+    consumer = threading.Thread(target=app.dispatcher.run, args=(lambda: app.running,))
+
+    led_writes_before = app.push.pads.writes
+    start = time.perf_counter()
+    app.display.start()
+    app.scheduler.start()
+    consumer.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    app.dispatcher.join()
+    elapsed = time.perf_counter() - start
+    app.stop_loop()
+    consumer.join()
+    app.display.stop()
+    app.scheduler.stop()  # sends the queued notes
+
+    sent_events = (events // threads) * threads
+    messages = len(app.midi_out_port.messages)
+    led_writes = app.push.pads.writes - led_writes_before
+    print("{} pad events from {} thread(s) in {:.2f}s".format(sent_events, threads, elapsed))
+    print("  {:.0f} pad events/s".format(sent_events / elapsed))
+    print("  {} midi messages, {:.0f}/s".format(messages, messages / elapsed))
+    print("  {} pad LED writes, {:.2f} per event".format(led_writes, led_writes / max(sent_events, 1)))
+    print("  display: {}".format(app.display.stats()))
+    print("  chord table: {} misses, voicing cache: {}".format(app.chord_table.misses, voicing_cache.stats()))
+    if latency:
+        print()
+        print(app.latency.report())
+    if not direct:
+        print()
+        print(app.dispatcher.report())
+    if quantize:
+        print()
+        print(app.scheduler.report())
+    if app.profiler is not None:
+        app.profiler.write()
+
+    problems = ["Exception in load thread:\n" + error for error in errors] + check_clean_state(app)
+    problems += check_modifier_lookups(app)
+    if app.dispatcher.errors:
+        problems.append("{} events failed in the dispatcher".format(app.dispatcher.errors))
+    if problems:
+        print()
+        for problem in problems:
+            print(problem)
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000, help="Total number of pad presses and releases.")
+    parser.add_argument('--threads', type=int, default=1, help="Number of threads sending events.")
+    parser.add_argument('--rate', type=float, default=0, help="Target events per second, 0 for as fast as possible.")
+    parser.add_argument('--max-held', type=int, default=3, help="Maximum pads held at once per thread.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', action='store_true', help="Record and print per-stage latency.")
+    parser.add_argument('--direct', action='store_true',
+                        help="Call the pad handlers from the sending threads instead of the dispatcher.")
+    parser.add_argument('--quantize', type=int, metavar='DIVISION', help="Quantize chords to 1/DIVISION notes.")
+    parser.add_argument('--bpm', type=float, default=DEFAULT_BPM, help="Tempo for --quantize.")
+    args = parser.parse_args()
+
+    problems = run_load_test(args.events, args.threads, args.rate, args.max_held, args.seed,
+                             args.latency, args.direct, args.quantize, args.bpm)
+    raise SystemExit(1 if problems else 0)
@@ -2,8 +2,6 @@
 Utlities to convert between note names, scale degrees, midi values.
 """
 
-import numpy as np
-
 name_to_number = {
     "C": 0,
     "C#": 1,
@@ -31,6 +29,14 @@ sharp_to_flat = {
 
 flat_to_sharp = {value: key for key, value in sharp_to_flat.items()}
 
+def note_name_to_number(note):
+    """
+    Convert a note name without octave to its number, accepting flats. eg. Db -> 1
+    """
+    if 'b' in note:
+        note = flat_to_sharp[note]
+    return name_to_number[note]
+
 def tone_to_midi(tone, midi_octave):
     return tone + midi_octave * 12
 
@@ -79,18 +85,49 @@ def interval_note(note_name: str, interval: int) -> str:
     new_midi = midi + interval
     NotImplemented
 
+# Pitch class masks: sets of tones stored as 12-bit integers, where bit n is set if tone n (0 is C
+# or the scale root, depending on context) is in the set. Transposing is a rotation.
+FULL_MASK = (1 << 12) - 1
+
+def tones_to_mask(tones) -> int:
+    mask = 0
+    for tone in tones:
+        mask |= 1 << (tone % 12)
+    return mask
+
+# mask -> tuple of tones in the mask, in ascending order
+MASK_TONES = [tuple([tone for tone in range(12) if mask >> tone & 1]) for mask in range(FULL_MASK + 1)]
+
+def mask_to_tones(mask: int):
+    return MASK_TONES[mask]
+
+def mask_contains(mask: int, tone: int) -> bool:
+    return bool(mask >> (tone % 12) & 1)
+
+def rotate_mask(mask: int, semitones: int) -> int:
+    """
+    Transpose every tone in the mask up by semitones (down if negative).
+    """
+    semitones %= 12
+    return ((mask << semitones) | (mask >> (12 - semitones))) & FULL_MASK
+
 RELATIVE_KEY_DICT = {
     'maj': [0, 2, 4, 5, 7, 9, 11],
     'min': [0, 2, 3, 5, 7, 8, 10],
 }
 
+RELATIVE_KEY_MASK = {quality: tones_to_mask(scale) for quality, scale in RELATIVE_KEY_DICT.items()}
+
+# Every key the app can play in eg. 'Cmaj', 'C#min'. Roots use sharps like FunChord expects.
+SCALE_NAMES = [name + quality for name in name_to_number for quality in RELATIVE_KEY_DICT]
+
 def scalenumber_to_note(number, scale):
     # assert 0 <= number < 12, "note number out of range"
     raise NotImplementedError
 
 # row index is the interval
 interval_consonance = [1, 10, 8, 6, 4, 3, 7, 2, 5, 4, 9, 8]
-sorted_interval_by_consonance = list(np.argsort(interval_consonance))
+sorted_interval_by_consonance = sorted(range(12), key=interval_consonance.__getitem__)
 sorted_interval_by_dissonance = sorted_interval_by_consonance[::-1]
 
 
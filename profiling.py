@@ -0,0 +1,137 @@
+"""
+Opt-in profiling of the app's pad and button callbacks.
+
+When a press feels sluggish, this tells where the time goes: every call of a profiled callback is
+timed into a histogram (see latency), and sampled calls are run under cProfile such that the time
+is split per function (compute_modded_chord, handle_highlights, deepcopy, LED writes...). Both are
+aggregated over the whole session and written to a file when the app stops.
+
+Profiling is off by default, in which case nothing is wrapped and the callbacks run as usual. Turn it
+on with the FUNCHORDS_PROFILE environment variable (or fun_chords_app.py --profile), set to the path
+of the report. FUNCHORDS_PROFILE_SAMPLE=N profiles one call out of N with cProfile, to keep the
+overhead down on long sessions (every call is still timed).
+
+    FUNCHORDS_PROFILE=profile.txt python fun_chords_app.py
+
+The cProfile stats are also saved next to the report (eg. profile.txt.pstats) for pstats or snakeviz.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from latency import LatencyHistogram
+
+# FunChordApp methods called by push2_python's callbacks.
+PROFILED_CALLBACKS = ('on_pad_pressed', 'on_pad_released', 'on_button_pressed', 'on_button_released')
+
+
+class CallProfiler(object):
+    def __init__(self, output_path: str, sample_every: int = 1):
+        """
+        output_path: File to write the report to, see write.
+        sample_every: Profile one call out of sample_every with cProfile.
+        """
+        assert sample_every > 0, "Profiler sample_every {} <= 0".format(sample_every)
+        self.output_path = output_path
+        self.sample_every = sample_every
+
+        self.histograms: Dict[str, LatencyHistogram] = {}  # callback -> ns per call
+        self.calls = 0
+        self.sampled = 0
+        self._profile = cProfile.Profile()
+        self._lock = threading.Lock()  # cProfile can only profile one call at a time
+
+    def wrap(self, func: Callable, name: str = None) -> Callable:
+        """
+        Wrap func such that each call is timed, and sampled calls are profiled.
+        """
+        name = name or func.__name__
+        histogram = self.histograms.setdefault(name, LatencyHistogram())
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            self.calls += 1
+            # Nested or concurrent calls are only timed.
+            sample = self.calls % self.sample_every == 0 and self._lock.acquire(blocking=False)
+            start = time.perf_counter_ns()
+            try:
+                if sample:
+                    self.sampled += 1
+                    return self._profile.runcall(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter_ns() - start)
+                if sample:
+                    self._lock.release()
+        return profiled
+
+    def wrap_methods(self, obj, names: Iterable[str] = PROFILED_CALLBACKS):
+        """
+        Replace obj's methods with profiled ones, on the instance only. The class's methods are
+        wrapped, such that wrapping again (eg. with another profiler) replaces the previous wrapper
+        instead of timing every call twice.
+        """
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(type(obj), name).__get__(obj), name))
+
+    def report(self, top: int = 40) -> str:
+        lines = ["Callbacks, every call:",
+                 "{:<24}{:>8}{:>10}{:>10}{:>10}".format('callback', 'count', 'p50 us', 'p99 us', 'max us')]
+        for name, histogram in self.histograms.items():
+            if histogram.count == 0:
+                continue
+            lines.append("{:<24}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                name,
+                histogram.count,
+                histogram.percentile(50) / 1e3,
+                histogram.percentile(99) / 1e3,
+                histogram.max / 1e3))
+
+        lines += ["", "Functions, over {} profiled calls (1 in {}):".format(self.sampled, self.sample_every)]
+        if self.sampled:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(top)
+            lines.append(stream.getvalue())
+        return '\n'.join(lines)
+
+    def write(self):
+        """
+        Write the report to output_path, and the cProfile stats to output_path + '.pstats'.
+        """
+        with open(self.output_path, 'w') as report_file:
+            report_file.write(self.report())
+        if self.sampled:
+            self._profile.dump_stats(self.output_path + '.pstats')
+        print("Profile written to {}".format(self.output_path))
+
+
+def profiler_from_env() -> Optional[CallProfiler]:
+    """
+    CallProfiler if FUNCHORDS_PROFILE is set, None otherwise.
+    """
+    output_path = os.environ.get('FUNCHORDS_PROFILE')
+    if not output_path:
+        return None
+    return CallProfiler(output_path, sample_every=int(os.environ.get('FUNCHORDS_PROFILE_SAMPLE', 1)))
+
+
+if __name__ == "__main__":
+    import copy
+    import tempfile
+
+    def on_pad_pressed(depth):
+        copy.deepcopy([list(range(depth))] * depth)
+
+    profiler = CallProfiler(os.path.join(tempfile.gettempdir(), 'funchords_profile.txt'), sample_every=2)
+    profiled = profiler.wrap(on_pad_pressed)
+    for depth in range(1, 200):
+        profiled(depth)
+    print(profiler.report(top=5))
+    profiler.write()
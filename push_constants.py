@@ -0,0 +1,23 @@
+"""
+Push 2 button names and display constants used by the app.
+
+The values are the same as push2_python.constants, such that they work with the real Push and with
+the simulated one (see backends) without importing push2_python, which needs the Push's USB and midi
+libraries.
+"""
+
+BUTTON_STOP = 'Stop'
+BUTTON_SETUP = 'Setup'
+BUTTON_RECORD = 'Record'
+BUTTON_DELETE = 'Delete'
+BUTTON_USER = 'User'
+BUTTON_LEFT = 'Left'
+BUTTON_RIGHT = 'Right'
+BUTTON_SCALE = 'Scale'
+BUTTON_OCTAVE_UP = 'Octave Up'
+BUTTON_OCTAVE_DOWN = 'Octave Down'
+
+# Display size in pixels, push2_python.constants.DISPLAY_LINE_PIXELS and DISPLAY_N_LINES.
+DISPLAY_LINE_PIXELS = 960
+DISPLAY_N_LINES = 160
+FRAME_FORMAT_BGR565 = 'bgr565'
@@ -0,0 +1,309 @@
+"""
+Render chord progressions to Standard MIDI Files, without Push or a midi port.
+
+Progressions go through the same path as the app: FunChord, then the chord_mod modifiers, then
+voicing.voice (or voice_leading), and notes are emitted by a VoiceAllocator such that common tones
+are held across chords like when playing live.
+
+The input file has one progression per line: a scale name (see scales) followed by chords, where a chord is a
+scale degree with optional modifiers joined by '+'. Empty lines and lines starting with # are
+skipped.
+
+    Cmaj 1 6 2+Sus4 5+Add7
+    Amin 1+Add9 4 5+Parallel 1
+
+Each progression is written to its own file in the output directory, named after its line number.
+Lines are read lazily and handed to a process pool in chunks, with a bounded number of chunks in
+flight, so memory stays the same however large the input is. Workers write their files directly.
+
+Usage:
+    python render.py progressions.txt out/
+    python render.py progressions.txt out/ --workers 8 --beats 2 --voice-leading
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import itertools
+import os
+import struct
+import sys
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import mido
+
+import note_util
+import scales
+from fun_chord import FunChord
+from chord_mod import all_mods
+from voicing import voice, VoicingType
+from voice_allocator import VoiceAllocator
+from voice_leading import lead_progression
+
+MODS_BY_NAME = {str(mod).lower(): mod for mod in all_mods}
+
+TICKS_PER_BEAT = 480
+MAX_ERRORS_KEPT = 20  # errors returned by render, the others are only counted
+
+Progression = List[Tuple[int, List]]  # (degree, modifier functions) per chord
+
+
+class RenderSettings(object):
+    def __init__(self,
+                 voicing_center: int = note_util.name_to_midi('C3'),
+                 voicing_range: int = 1,
+                 bass_note: bool = True,
+                 voicing_type: VoicingType = VoicingType.WRAP,
+                 voice_leading: bool = False,
+                 beats: float = 4,
+                 velocity: int = 100,
+                 tempo: int = 120):
+        """
+        Defaults match the app's voicing (see ChordTable).
+        """
+        self.voicing_center = voicing_center
+        self.voicing_range = voicing_range
+        self.bass_note = bass_note
+        self.voicing_type = voicing_type
+        self.voice_leading = voice_leading
+        self.beats = beats
+        self.velocity = velocity
+        self.tempo = tempo
+
+
+def parse_progression(line: str) -> Tuple[str, Progression]:
+    """
+    Parse a line of the input file into its scale name and chords.
+    """
+    words = line.split()
+    assert len(words) > 1, "Expected a scale name and chords, got: {}".format(line)
+    scale_name, chords = scales.canonical_scale_name(words[0]), []
+
+    for word in words[1:]:
+        degree, *mod_names = word.split('+')
+        mods = []
+        for mod_name in mod_names:
+            assert mod_name.lower() in MODS_BY_NAME, "Unknown modifier: {}".format(mod_name)
+            mods.append(MODS_BY_NAME[mod_name.lower()].get_func())
+        chords.append((int(degree), mods))
+    return scale_name, chords
+
+
+def progression_chords(scale_name: str, progression: Progression) -> List[FunChord]:
+    chords = []
+    for degree, mods in progression:
+        chord = FunChord(scale_name, degree)
+        for mod in mods:
+            chord = mod(chord)
+        chords.append(chord)
+    return chords
+
+
+def _var_len(value: int) -> bytes:
+    """
+    Variable length quantity, used for delta times in midi files.
+    """
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+class _TrackWriter(object):
+    """
+    Output port for VoiceAllocator that encodes the messages it's sent as a midi track, with the
+    delta times since the previous message. Going through mido.MidiFile validates and copies every
+    message, which was most of the time spent rendering.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.delta = 0  # ticks since the last message
+        self._encoded = dict()  # (type, channel, note, velocity) -> message bytes
+
+    def reset(self):
+        self.data = bytearray()
+        self.delta = 0
+
+    def send(self, msg):
+        key = (msg.type, msg.channel, msg.note, msg.velocity)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = self._encoded[key] = bytes(msg.bytes())
+        self.data += _var_len(self.delta)
+        self.data += encoded
+        self.delta = 0
+
+    def meta(self, meta_type: int, data: bytes):
+        self.data += _var_len(self.delta)
+        self.data += bytes([0xFF, meta_type]) + _var_len(len(data)) + data
+        self.delta = 0
+
+
+# Reused for every progression rendered by this process, such that messages are built once.
+_writer = _TrackWriter()
+_voices = VoiceAllocator(_writer)
+
+
+def render_smf(chords: List[FunChord], settings: RenderSettings) -> bytes:
+    """
+    Render chords to a single track Standard MIDI File. Returns the contents of the file, use
+    mido.MidiFile(file=io.BytesIO(data)) to inspect it.
+    """
+    if settings.voice_leading:
+        voicings = lead_progression(chords, settings.voicing_center)
+    else:
+        voicings = [voice(chord, settings.voicing_center, settings.voicing_range, settings.bass_note,
+                          settings.voicing_type) for chord in chords]
+
+    # A progression that failed partway may have left notes held.
+    _voices.reset()
+    _writer.reset()
+    _writer.meta(0x51, mido.bpm2tempo(settings.tempo).to_bytes(3, 'big'))  # set tempo
+
+    chord_ticks = int(settings.beats * TICKS_PER_BEAT)
+    for midi_notes in voicings:
+        _voices.play(midi_notes, settings.velocity)
+        _writer.delta += chord_ticks
+    _voices.release_all()
+    _writer.meta(0x2F, b'')  # end of track
+
+    header = b'MThd' + struct.pack('>IHHH', 6, 0, 1, TICKS_PER_BEAT)
+    return header + b'MTrk' + struct.pack('>I', len(_writer.data)) + bytes(_writer.data)
+
+
+def render_chunk(chunk: List[Tuple[int, str]], out_dir: str, settings: RenderSettings) -> Tuple[int, List[str]]:
+    """
+    Render (line number, line) pairs to out_dir. Runs in the worker processes.
+    Returns the number of files written and the errors for the lines that couldn't be rendered.
+    """
+    written = 0
+    errors = []
+    for line_number, line in chunk:
+        try:
+            scale_name, progression = parse_progression(line)
+            data = render_smf(progression_chords(scale_name, progression), settings)
+            with open(os.path.join(out_dir, '{:08d}.mid'.format(line_number)), 'wb') as midi_file:
+                midi_file.write(data)
+            written += 1
+        except Exception as e:
+            errors.append("line {}: {}: {}".format(line_number, type(e).__name__, e))
+    return written, errors
+
+
+def read_progressions(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line_number, line
+
+
+def chunked(items: Iterator, size: int) -> Iterator[List]:
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def render(lines: Iterable[str],
+           out_dir: str,
+           settings: RenderSettings = None,
+           workers: int = None,
+           chunk_size: int = 64,
+           report_every: float = 1.) -> Tuple[int, int, List[str]]:
+    """
+    Render every progression in lines to out_dir.
+
+    Args:
+        lines: Lines of the input file, read lazily.
+        out_dir: Directory for the midi files, created if needed.
+        settings: Voicing and timing of the rendered files.
+        workers: Number of processes, defaults to the number of cores. 1 renders in this process.
+        chunk_size: Progressions per task sent to a worker.
+        report_every: Seconds between progress reports, 0 to stay quiet.
+
+    Returns:
+        The number of files written, the number of lines that couldn't be rendered and the first
+        MAX_ERRORS_KEPT errors.
+    """
+    settings = settings or RenderSettings()
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+
+    chunks = chunked(read_progressions(lines), chunk_size)
+    written = 0
+    error_count = 0
+    errors = []
+    start = last_report = time.perf_counter()
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        print("{} progressions in {:.1f}s, {:.0f} progressions/s{}".format(
+            written, elapsed, written / elapsed if elapsed else 0., '' if final else '...'),
+            file=sys.stderr)
+
+    def collect(chunk_written, chunk_errors):
+        nonlocal written, error_count, last_report
+        written += chunk_written
+        error_count += len(chunk_errors)
+        errors.extend(chunk_errors[:MAX_ERRORS_KEPT - len(errors)])
+        if report_every and time.perf_counter() - last_report > report_every:
+            last_report = time.perf_counter()
+            report()
+
+    if workers == 1:
+        for chunk in chunks:
+            collect(*render_chunk(chunk, out_dir, settings))
+    else:
+        # Bounded number of chunks in flight, such that the input is never read far ahead.
+        max_in_flight = 2 * workers
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            for chunk in chunks:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(*future.result())
+                in_flight.add(pool.submit(render_chunk, chunk, out_dir, settings))
+
+            for future in wait(in_flight).done:
+                collect(*future.result())
+
+    if report_every:
+        report(final=True)
+    return written, error_count, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('progressions', help="Input file, one progression per line ('-' for stdin).")
+    parser.add_argument('out_dir', help="Directory to write the midi files to.")
+    parser.add_argument('--workers', type=int, default=None, help="Processes to use, defaults to the number of cores.")
+    parser.add_argument('--chunk-size', type=int, default=64, help="Progressions per task.")
+    parser.add_argument('--center', default='C3', help="Voicing center as a note name.")
+    parser.add_argument('--voicing', default='WRAP', choices=[voicing_type.name for voicing_type in VoicingType])
+    parser.add_argument('--voice-leading', action='store_true', help="Voice the progression with the least movement.")
+    parser.add_argument('--beats', type=float, default=4, help="Length of each chord in beats.")
+    parser.add_argument('--velocity', type=int, default=100)
+    parser.add_argument('--tempo', type=int, default=120, help="Beats per minute.")
+    args = parser.parse_args()
+
+    settings = RenderSettings(
+        voicing_center=note_util.name_to_midi(args.center),
+        voicing_type=VoicingType[args.voicing],
+        voice_leading=args.voice_leading,
+        beats=args.beats,
+        velocity=args.velocity,
+        tempo=args.tempo)
+
+    input_file = sys.stdin if args.progressions == '-' else open(args.progressions)
+    with input_file:
+        written, error_count, errors = render(input_file, args.out_dir, settings, args.workers, args.chunk_size)
+
+    for error in errors:
+        print("Warning: " + error, file=sys.stderr)
+    if error_count > len(errors):
+        print("Warning: ... and {} more errors".format(error_count - len(errors)), file=sys.stderr)
+    raise SystemExit(1 if error_count else 0)
@@ -0,0 +1,142 @@
+"""
+Scales, compiled to lookup tables.
+
+A scale is a list of semitones from its root (eg. major is [0, 2, 4, 5, 7, 9, 11]), of any length.
+Each scale is compiled once into a flat table from scale step to semitones over several octaves,
+such that converting a scale degree to a tone is a single index (see FunChord.tonify_note).
+
+Scale names are a root note followed by a scale, eg. 'Cmaj', 'F#dor', 'Bbhmin'. They're parsed once
+and cached. Roots can use flats, but the parsed name always uses sharps like the rest of the code.
+
+Besides major and minor, the modes of the major scale and harmonic/melodic minor are built in, and
+more scales can be added with register_scale:
+
+    register_scale('blues', [0, 3, 5, 6, 7, 10])
+    FunChord('Ablues', 1)
+"""
+
+from functools import lru_cache
+import threading
+from typing import Dict, Sequence, Tuple
+
+import note_util
+
+# Number of scale steps in each compiled table. Chords built on the top degree with extensions
+# stay well within it, longer steps fall back to computing the tone.
+TABLE_SIZE = 64
+
+
+class Scale(object):
+    def __init__(self, name: str, intervals: Sequence[int]):
+        """
+        name: Name used after the root in scale names, eg. 'maj'.
+        intervals: Semitones of each scale step from the root, starting at 0 and increasing
+            within the octave.
+        """
+        intervals = tuple(intervals)
+        assert len(intervals) > 0 and intervals[0] == 0, "Scale {} should start at 0: {}".format(name, intervals)
+        assert all(low < high for low, high in zip(intervals, intervals[1:])) and intervals[-1] < 12, \
+            "Scale {} should increase within an octave: {}".format(name, intervals)
+
+        self.name = name
+        self.intervals = intervals
+        self.mask = note_util.tones_to_mask(intervals)
+
+        # scale step (0 is the root) -> semitones from the root
+        self.tones = tuple([self._compute_tone(step) for step in range(TABLE_SIZE)])
+
+    def __repr__(self):
+        return "Scale({}, {})".format(self.name, list(self.intervals))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _compute_tone(self, step: int) -> int:
+        octave, index = divmod(step, len(self.intervals))
+        return self.intervals[index] + 12 * octave
+
+    def tone(self, step: int) -> int:
+        """
+        Semitones from the root of a scale step, 0 being the root.
+        """
+        if 0 <= step < TABLE_SIZE:
+            return self.tones[step]
+        return self._compute_tone(step)
+
+    def degrees(self) -> range:
+        """
+        Scale degrees, starting at 1.
+        """
+        return range(1, len(self.intervals) + 1)
+
+
+SCALES: Dict[str, Scale] = dict()  # name -> Scale
+_scales_lock = threading.Lock()
+
+
+def register_scale(name: str, intervals: Sequence[int]) -> Scale:
+    """
+    Add a scale that can be used in scale names. Registering the same scale twice is fine,
+    but a name can't be reused for other intervals.
+    """
+    scale = Scale(name, intervals)
+    with _scales_lock:
+        existing = SCALES.get(name)
+        if existing is not None:
+            assert existing.intervals == scale.intervals, \
+                "Scale {} already registered as {}".format(name, existing)
+            return existing
+        SCALES[name] = scale
+    return scale
+
+
+def mode(intervals: Sequence[int], degree: int) -> Tuple[int, ...]:
+    """
+    Intervals of the mode starting on a degree (1 is the scale itself).
+    """
+    rotated = list(intervals[degree - 1:]) + list(intervals[:degree - 1])
+    return tuple([(tone - rotated[0]) % 12 for tone in rotated])
+
+
+MAJOR = note_util.RELATIVE_KEY_DICT['maj']
+register_scale('maj', MAJOR)
+register_scale('min', note_util.RELATIVE_KEY_DICT['min'])
+for _degree, _name in enumerate(['dor', 'phr', 'lyd', 'mix'], start=2):
+    register_scale(_name, mode(MAJOR, _degree))
+register_scale('loc', mode(MAJOR, 7))
+register_scale('hmin', [0, 2, 3, 5, 7, 8, 11])
+register_scale('mmin', [0, 2, 3, 5, 7, 9, 11])
+
+
+@lru_cache(maxsize=None)
+def parse_scale_name(scale_name: str) -> Tuple[str, int, Scale]:
+    """
+    Split a scale name into its root and scale, eg. 'Bbmin' -> ('A#', 10, Scale(min, ...)).
+
+    Returns:
+        The root's name (with sharps), the root's tone (0 is C) and the Scale.
+    """
+    # Try the root with an accidental first, eg. 'Bbmin' is Bb min, but 'Cblues' is C blues.
+    for root_length in (2, 1):
+        root, name = scale_name[:root_length], scale_name[root_length:]
+        if name in SCALES and (root in note_util.name_to_number or root in note_util.flat_to_sharp):
+            root_tone = note_util.note_name_to_number(root)
+            return note_util.number_to_name[root_tone], root_tone, SCALES[name]
+
+    raise ValueError("Scale name '{}' should be formatted as (note letter)(accidental)({})".format(
+        scale_name, '|'.join(SCALES)))
+
+
+def canonical_scale_name(scale_name: str) -> str:
+    root, _, scale = parse_scale_name(scale_name)
+    return root + scale.name
+
+
+if __name__ == "__main__":
+    for name in ('Cmaj', 'Bbmin', 'F#dor', 'Ehmin', 'Gmix'):
+        root, root_tone, scale = parse_scale_name(name)
+        notes = [note_util.number_to_name[(root_tone + tone) % 12] for tone in scale.intervals]
+        print("{:<6} {} {:<5} {}".format(name, root, scale.name, ' '.join(notes)))
+
+    register_scale('blues', [0, 3, 5, 6, 7, 10])
+    print(parse_scale_name('Cblues'), parse_scale_name('Ebblues'))
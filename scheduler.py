@@ -0,0 +1,506 @@
+"""
+Quantized chord triggering: notes are sent on a tempo grid instead of the instant a pad is pressed.
+
+Every note the app plays goes through Scheduler.play/release_all, whether quantization is on or
+not, and ends up in the VoiceAllocator the same way. Without quantization they're sent right away.
+With quantization they're queued for the next grid tick, eg. the next 16th note, and sent when the
+clock reaches it. The clock is either:
+    - InternalClock: ticks computed from time.perf_counter at a set tempo. A scheduler thread sleeps
+      until shortly before each tick with queued events, then spins until its deadline, since sleep
+      can wake up a millisecond or more late.
+    - MidiClock: ticks are the midi clock messages (24 per quarter note) sent by a DAW, see
+      Scheduler.on_clock_message. Events are sent when the tick's message is received. When the DAW
+      stops, notes are sent right away again.
+
+Queued events are kept in a timing wheel, where queueing and advancing a tick are O(1) for events
+less than WHEEL_SLOTS ticks ahead. For a given source (eg. the chord), the latest event queued
+wins: it cancels the source's queued events at the same or a later tick. A chord pressed and
+released between two grid ticks still sounds for one grid step.
+
+The scheduling error, from each tick's deadline to its notes starting to be sent, is recorded into a
+histogram (see latency) and printed by report along with the midi clock's jitter.
+
+Quantization is off by default. Turn it on with FUNCHORDS_QUANTIZE set to a note division (eg. 16
+for 16th notes), at FUNCHORDS_BPM (120 by default) or following the midi clock if
+FUNCHORDS_MIDI_CLOCK is set. Also see fun_chords_app.py --quantize.
+"""
+
+import itertools
+import os
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from latency import LatencyHistogram
+from voice_allocator import VoiceAllocator, CHORD_SOURCE
+
+PPQN = 24  # ticks per quarter note, same as midi clock
+DEFAULT_BPM = 120.
+WHEEL_SLOTS = 256  # ~2.7 bars of 4/4 at 24 ppqn
+SPIN = 0.002  # seconds spent spinning before a deadline instead of sleeping
+CLOCK_SMOOTHING = 0.1  # weight of each new interval in the midi clock's period estimate
+
+ALL_SOURCES = object()  # source of release_all events
+
+
+def quantize_ticks(division: int, ppqn: int = PPQN) -> int:
+    """
+    Grid step in ticks of a note division, eg. 16 for 16th notes is 6 ticks at 24 ppqn.
+    """
+    ticks, remainder = divmod(4 * ppqn, division)
+    assert ticks > 0 and remainder == 0, "Can't quantize to 1/{} at {} ppqn".format(division, ppqn)
+    return ticks
+
+
+def wait_until(deadline: float, spin: float = SPIN):
+    """
+    Sleep until spin seconds before the time.perf_counter deadline, then busy wait until it.
+    """
+    remaining = deadline - time.perf_counter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while time.perf_counter() < deadline:
+        pass
+
+
+class InternalClock(object):
+    external = False
+    running = True
+
+    def __init__(self, bpm: float = DEFAULT_BPM, ppqn: int = PPQN):
+        self.ppqn = ppqn
+        self.start = time.perf_counter()  # time of tick 0
+        self.period = 0.
+        self.set_bpm(bpm)
+
+    @property
+    def bpm(self) -> float:
+        return 60. / (self.period * self.ppqn)
+
+    def set_bpm(self, bpm: float):
+        """
+        Change tempo from now on, the current position doesn't jump.
+        """
+        assert bpm > 0, "Clock bpm {} <= 0".format(bpm)
+        now = time.perf_counter()
+        position = (now - self.start) / self.period if self.period else 0.
+        self.period = 60. / (bpm * self.ppqn)
+        self.start = now - position * self.period
+
+    def tick_time(self, tick: int) -> float:
+        return self.start + tick * self.period
+
+    def now_tick(self) -> int:
+        """
+        Last tick whose time has passed.
+        """
+        return int((time.perf_counter() - self.start) // self.period)
+
+
+class MidiClock(object):
+    """
+    Tick count and tempo from midi clock, start, continue, stop and song position messages.
+    """
+    external = True
+
+    def __init__(self, ppqn: int = PPQN):
+        self.ppqn = ppqn
+        self.running = False
+        self.tick = -1  # last tick received, the first clock after start is tick 0
+        self.last_time: Optional[float] = None  # time.perf_counter of the last clock
+        self.period: Optional[float] = None  # smoothed seconds between clocks
+        self.jitter = LatencyHistogram()  # ns between each clock interval and the smoothed period
+
+    @property
+    def bpm(self) -> float:
+        return 60. / (self.period * self.ppqn) if self.period else 0.
+
+    def on_message(self, msg, received: float):
+        """
+        Update from a midi message received at the time.perf_counter time received.
+        """
+        if msg.type == 'clock':
+            if not self.running:
+                return
+            if self.last_time is not None:
+                interval = received - self.last_time
+                if self.period is None:
+                    self.period = interval
+                else:
+                    self.jitter.record(int(abs(interval - self.period) * 1e9))
+                    self.period += CLOCK_SMOOTHING * (interval - self.period)
+            self.last_time = received
+            self.tick += 1
+        elif msg.type == 'start':
+            self.running = True
+            self.tick = -1
+            self.last_time = None
+        elif msg.type == 'continue':
+            self.running = True
+            self.last_time = None
+        elif msg.type == 'stop':
+            self.running = False
+        elif msg.type == 'songpos':
+            # Song position is in 16th notes, the next clock is at that position.
+            self.tick = msg.pos * self.ppqn // 4 - 1
+
+    def now_tick(self) -> int:
+        return self.tick
+
+
+class ScheduledEvent(object):
+    """
+    Notes for a source to hold from a tick on, see VoiceAllocator.play. notes is None to release
+    every note.
+    """
+    __slots__ = ('tick', 'source', 'notes', 'velocity', 'channel', 'cancelled')
+
+    def __init__(self, tick: int, source: Hashable, notes, velocity: int, channel: int):
+        self.tick = tick
+        self.source = source
+        self.notes = notes
+        self.velocity = velocity
+        self.channel = channel
+        self.cancelled = False
+
+
+class TimingWheel(object):
+    """
+    Events bucketed by tick modulo the number of slots. Events more than a revolution ahead share a
+    slot with nearer ones and are skipped until their tick comes.
+    """
+    def __init__(self, slots: int = WHEEL_SLOTS):
+        self._slots: List[List[ScheduledEvent]] = [[] for _ in range(slots)]
+        self.tick = 0  # last tick advanced to, events are added after it
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, event: ScheduledEvent):
+        assert event.tick > self.tick, "Event at tick {} is not after tick {}".format(event.tick, self.tick)
+        self._slots[event.tick % len(self._slots)].append(event)
+        self.size += 1
+
+    def has_events(self, tick: int) -> bool:
+        return any(event.tick == tick for event in self._slots[tick % len(self._slots)])
+
+    def advance(self, tick: int) -> List[ScheduledEvent]:
+        """
+        Move to tick. Returns the events up to it, in tick order then in the order they were added.
+        """
+        due = []
+        if self.size:
+            slot_count = len(self._slots)
+            if tick - self.tick >= slot_count:
+                # Every slot is due, events of a tick keep their order since they're in the same slot.
+                for slot in self._slots:
+                    ready = [event for event in slot if event.tick <= tick]
+                    if ready:
+                        slot[:] = [event for event in slot if event.tick > tick]
+                        due += ready
+                due.sort(key=lambda event: event.tick)
+            else:
+                for current in range(self.tick + 1, tick + 1):
+                    slot = self._slots[current % slot_count]
+                    if not slot:
+                        continue
+                    ready = [event for event in slot if event.tick == current]
+                    if ready:
+                        slot[:] = [event for event in slot if event.tick != current]
+                        due += ready
+            self.size -= len(due)
+        self.tick = tick
+        return due
+
+    def reset(self, tick: int) -> List[ScheduledEvent]:
+        """
+        Remove every event and move to tick, forwards or backwards. Returns the removed events in
+        tick order.
+        """
+        # Events of a tick are all in the same slot, in the order they were added.
+        events = sorted(itertools.chain.from_iterable(self._slots), key=lambda event: event.tick)
+        for slot in self._slots:
+            slot.clear()
+        self.size = 0
+        self.tick = tick
+        return events
+
+
+class Scheduler(object):
+    def __init__(self, voices: VoiceAllocator, clock=None, quantize: Optional[int] = None):
+        """
+        voices: Every note is sent through it.
+        clock: InternalClock or MidiClock, None to send everything right away.
+        quantize: Grid step in clock ticks (see quantize_ticks), None to send everything right away.
+        """
+        assert quantize is None or quantize > 0, "Scheduler quantize {} <= 0".format(quantize)
+        self.voices = voices
+        self.clock = clock
+        self.quantize = quantize
+
+        self.wheel = TimingWheel()
+        self._queued: Dict[Hashable, List[ScheduledEvent]] = {}  # source -> its events in the wheel
+        self._note_ids = itertools.count()
+        self._lock = threading.RLock()  # events are queued and sent from different threads
+        self._running = False
+        self._thread: threading.Thread = None
+
+        self.errors = LatencyHistogram()  # ns from each tick's deadline to sending its events
+        self.events_sent = 0
+        self.late_ticks = 0  # ticks sent more than a tick after their deadline
+
+    def is_quantized(self) -> bool:
+        """
+        Whether notes are queued for the grid: quantization is on and the clock is ticking.
+        """
+        if self.quantize is None or self.clock is None:
+            return False
+        if self.clock.external:
+            return self.clock.running
+        return self._thread is not None
+
+    def next_grid_tick(self) -> int:
+        return (self.clock.now_tick() // self.quantize + 1) * self.quantize
+
+    def play(self, notes: Iterable[int], velocity: int, channel: int = 0, source: Hashable = CHORD_SOURCE):
+        """
+        Make source hold exactly notes, now or on the next grid tick. See VoiceAllocator.play.
+        """
+        if not self.is_quantized():
+            self.voices.play(notes, velocity, channel, source)
+            return
+
+        notes = tuple(notes)
+        with self._lock:
+            tick = self.next_grid_tick()
+            if not notes and self._starts_at(tick, [source]):
+                tick += self.quantize  # pressed and released between two ticks: sound for a step
+            self._queue(ScheduledEvent(tick, source, notes, velocity, channel))
+
+    def release(self, source: Hashable = CHORD_SOURCE):
+        self.play((), 1, source=source)
+
+    def release_all(self):
+        """
+        Release every note, now or on the next grid tick.
+        """
+        if not self.is_quantized():
+            self.voices.release_all()
+            return
+
+        with self._lock:
+            tick = self.next_grid_tick()
+            if self._starts_at(tick, list(self._queued)):
+                tick += self.quantize
+            self._queue(ScheduledEvent(tick, ALL_SOURCES, None, 0, 0))
+
+    def schedule(self, tick: int, notes: Iterable[int], velocity: int, channel: int = 0,
+                 source: Hashable = CHORD_SOURCE):
+        """
+        Make source hold exactly notes from tick on. Sent right away if the clock is past tick.
+        """
+        assert self.clock is not None, "Can't schedule at a tick without a clock"
+        with self._lock:
+            self._queue(ScheduledEvent(tick, source, tuple(notes), velocity, channel))
+
+    def schedule_note(self, note: int, velocity: int, tick: int, length: int, channel: int = 0):
+        """
+        Play a single note from tick for length ticks, on top of the chord.
+        """
+        source = ('note', next(self._note_ids))
+        with self._lock:
+            self.schedule(tick, (note,), velocity, channel, source)
+            self.schedule(tick + length, (), 1, channel, source)
+
+    def _pending(self, source: Hashable) -> List[ScheduledEvent]:
+        """
+        Events of source that are still to be sent.
+        """
+        events = self._queued.get(source)
+        if events is None:
+            return []
+        events[:] = [event for event in events if not event.cancelled and event.tick > self.wheel.tick]
+        if not events:
+            del self._queued[source]
+        return events
+
+    def _starts_at(self, tick: int, sources: List[Hashable]) -> bool:
+        """
+        Whether one of the sources starts notes at tick.
+        """
+        return any(event.tick == tick and event.notes for source in sources for event in self._pending(source))
+
+    def _queue(self, event: ScheduledEvent):
+        if event.tick <= self.wheel.tick:
+            self._send([event])
+            return
+
+        # The latest event of a source replaces the ones at the same or a later tick.
+        sources = list(self._queued) if event.source is ALL_SOURCES else [event.source]
+        for source in sources:
+            for queued in self._pending(source):
+                if queued.tick >= event.tick:
+                    queued.cancelled = True
+        self._queued.setdefault(event.source, []).append(event)
+        self.wheel.add(event)
+
+    def _send(self, events: List[ScheduledEvent]) -> int:
+        """
+        Send the events that weren't cancelled, in order. Returns the number sent.
+        """
+        sent = 0
+        for event in events:
+            if event.cancelled:
+                continue
+            if event.notes is None:
+                self.voices.release_all()
+            else:
+                self.voices.play(event.notes, event.velocity, event.channel, event.source)
+            sent += 1
+        self.events_sent += sent
+        return sent
+
+    def _advance(self, tick: int, deadline: float, period: Optional[float]):
+        with self._lock:
+            due = self.wheel.advance(tick)
+            sent_at = time.perf_counter()
+            sent = self._send(due)
+        if sent:
+            error = sent_at - deadline
+            self.errors.record(max(0, int(error * 1e9)))
+            if period and error > period:
+                self.late_ticks += 1
+
+    def flush(self, tick: Optional[int] = None):
+        """
+        Send every queued event right away, and move the wheel to tick (defaults to where it is).
+        """
+        with self._lock:
+            self._send(self.wheel.reset(self.wheel.tick if tick is None else tick))
+            self._queued.clear()
+
+    def on_clock_message(self, msg):
+        """
+        Handle a midi message from the clock input (eg. as the input port's callback). Other
+        messages are ignored.
+        """
+        received = time.perf_counter()
+        clock = self.clock
+        if clock is None or not clock.external:
+            return
+        clock.on_message(msg, received)
+        if msg.type == 'clock':
+            if clock.running:
+                self._advance(clock.tick, received, clock.period)
+        elif msg.type in ('start', 'stop', 'songpos'):
+            # Queued notes don't wait for the DAW to play again.
+            self.flush(clock.tick)
+
+    def start(self):
+        """
+        Start the internal clock's thread. Nothing to do without quantization or with a midi clock.
+        """
+        if self._thread is not None or self.quantize is None or self.clock is None or self.clock.external:
+            return
+        self.flush(self.clock.now_tick())
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='Scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the internal clock's thread, and send the queued notes right away.
+        """
+        if self._thread is not None:
+            self._running = False
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        clock = self.clock
+        tick = self.wheel.tick
+        while self._running:
+            tick += 1
+            deadline = clock.tick_time(tick)
+            # Only spin for ticks with something to send, events queued while sleeping included.
+            wait_until(deadline - SPIN, spin=0.)
+            wait_until(deadline, spin=SPIN if self.wheel.has_events(tick) else 0.)
+            self._advance(tick, deadline, clock.period)
+
+    def report(self) -> str:
+        if self.quantize is None or self.clock is None:
+            return "Scheduler: not quantized, {} events".format(self.events_sent)
+        source = 'midi clock' if self.clock.external else 'internal clock'
+        lines = [
+            "Scheduler: 1/{} notes on the {} at {:.1f} bpm, {} events sent, {} late ticks".format(
+                4 * self.clock.ppqn // self.quantize, source, self.clock.bpm, self.events_sent,
+                self.late_ticks),
+            "{:<14}{:>8}{:>10}{:>10}{:>10}".format('', 'count', 'p50 us', 'p99 us', 'max us'),
+        ]
+        histograms = [('send error', self.errors)]
+        if self.clock.external:
+            histograms.append(('clock jitter', self.clock.jitter))
+        for name, histogram in histograms:
+            lines.append("{:<14}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                name, histogram.count, histogram.percentile(50) / 1e3, histogram.percentile(99) / 1e3,
+                histogram.max / 1e3))
+        return '\n'.join(lines)
+
+
+def make_scheduler(voices: VoiceAllocator,
+                   division: Optional[int] = None,
+                   bpm: float = DEFAULT_BPM,
+                   midi_clock: bool = False) -> Scheduler:
+    """
+    Scheduler quantizing to 1/division notes on the internal clock at bpm, or on the midi clock.
+    Not quantized if division is None.
+    """
+    if division is None:
+        return Scheduler(voices)
+    clock = MidiClock() if midi_clock else InternalClock(bpm)
+    return Scheduler(voices, clock, quantize_ticks(division, clock.ppqn))
+
+
+def scheduler_from_env(voices: VoiceAllocator) -> Scheduler:
+    """
+    Scheduler quantizing if FUNCHORDS_QUANTIZE is set, see the module docstring.
+    """
+    division = os.environ.get('FUNCHORDS_QUANTIZE')
+    return make_scheduler(voices,
+                          int(division) if division else None,
+                          float(os.environ.get('FUNCHORDS_BPM', DEFAULT_BPM)),
+                          bool(os.environ.get('FUNCHORDS_MIDI_CLOCK')))
+
+
+if __name__ == "__main__":
+    import random
+
+    from backends import FakeMidiOut
+
+    # Press chords at random times for two seconds, quantized to 16th notes at 120 bpm.
+    port = FakeMidiOut()
+    scheduler = make_scheduler(VoiceAllocator(port), division=16, bpm=120.)
+    scheduler.start()
+    rng = random.Random(0)
+    chords = [(48, 52, 55), (45, 48, 52), (41, 45, 48), (43, 47, 50)]
+    end = time.perf_counter() + 2.
+    while time.perf_counter() < end:
+        scheduler.play(rng.choice(chords), 100)
+        if rng.random() < 0.3:
+            scheduler.schedule_note(72, 80, scheduler.next_grid_tick() + 3, 3)
+        time.sleep(rng.uniform(0.01, 0.2))
+    scheduler.release_all()
+    scheduler.stop()
+
+    # Chord note ons should land on the grid: multiples of 125 ms, plus the scheduling error.
+    grid = 60. / 120. / 4
+    clock = scheduler.clock
+    offsets = [((timestamp - clock.start) % grid) * 1e3 for timestamp, msg in port.messages
+               if msg.type == 'note_on' and msg.note < 72]
+    offsets = [offset if offset < grid * 500 else offset - grid * 1e3 for offset in offsets]
+    print("{} chord note ons, offset from the grid: {:.3f} to {:.3f} ms".format(
+        len(offsets), min(offsets), max(offsets)))
+    print(scheduler.report())
+    print("Notes left on: {}".format(sorted(port.sounding_notes())))
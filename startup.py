@@ -0,0 +1,131 @@
+"""
+Startup profiling, for python fun_chords_app.py --profile-startup.
+
+When enabled, every module imported afterwards is timed (including the time spent importing its own
+imports), and the app times its initialization stages. report prints both, along with the total
+time from enabling to the first playable pad.
+
+Disabled, stage is a no-op such that the app can always call it.
+"""
+
+import contextlib
+import importlib.abc
+import sys
+import time
+from typing import Dict, List, Tuple
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """
+    Wraps a module's loader to time its execution, then puts the original loader back.
+    """
+    def __init__(self, loader, profile: 'StartupProfile'):
+        self.loader = loader
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        spec = module.__spec__
+        spec.loader = module.__loader__ = self.loader
+        self.profile._import_started()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profile._import_finished(module.__name__)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self, profile: 'StartupProfile'):
+        self.profile = profile
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self.profile)
+                return spec
+        return None
+
+
+class StartupProfile(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports: Dict[str, Tuple[float, float]] = dict()  # module -> (seconds, own seconds)
+        self.stages: List[Tuple[str, float]] = []  # (stage, seconds) in order
+        self._import_stack: List[List[float]] = []  # [start, seconds in nested imports]
+
+    def _import_started(self):
+        self._import_stack.append([time.perf_counter(), 0.])
+
+    def _import_finished(self, name: str):
+        start, nested = self._import_stack.pop()
+        elapsed = time.perf_counter() - start
+        self.imports[name] = (elapsed, elapsed - nested)
+        if self._import_stack:
+            self._import_stack[-1][1] += elapsed
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def report(self, file=sys.stderr, top: int = 20):
+        total = time.perf_counter() - self.start
+        import_total = sum(own for _, own in self.imports.values())
+        print("Startup: {:.1f} ms to first playable pad".format(total * 1e3), file=file)
+
+        print("Imports: {:.1f} ms in {} modules, slowest first (own time excludes nested imports):".format(
+            import_total * 1e3, len(self.imports)), file=file)
+        print("  {:<40}{:>10}{:>10}".format('module', 'own ms', 'total ms'), file=file)
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (seconds, own) in slowest[:top]:
+            print("  {:<40}{:>10.1f}{:>10.1f}".format(name, own * 1e3, seconds * 1e3), file=file)
+        if len(slowest) > top:
+            rest = sum(own for _, (_, own) in slowest[top:])
+            print("  {:<40}{:>10.1f}".format('{} more modules'.format(len(slowest) - top), rest * 1e3),
+                  file=file)
+
+        print("Initialization:", file=file)
+        for name, seconds in self.stages:
+            print("  {:<40}{:>10.1f}".format(name, seconds * 1e3), file=file)
+
+
+_profile = None  # StartupProfile once enabled
+
+
+def enable() -> StartupProfile:
+    """
+    Start timing imports and stages. Call before the imports to time.
+    """
+    global _profile
+    if _profile is None:
+        _profile = StartupProfile()
+        sys.meta_path.insert(0, _ImportTimer(_profile))
+    return _profile
+
+
+def stage(name: str):
+    """
+    Context manager timing an initialization stage, when profiling is enabled.
+    """
+    if _profile is None:
+        return _NO_STAGE
+    return _profile.stage(name)
+
+
+def report(**kwargs):
+    if _profile is not None:
+        _profile.report(**kwargs)
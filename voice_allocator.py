@@ -0,0 +1,135 @@
+"""
+Sends midi note ons and offs for chords, only for the notes that change.
+
+Going from one chord to the next only releases the notes that aren't in the new chord, and only
+starts the ones that weren't already sounding, so common tones keep ringing instead of being cut off
+and retriggered. Each (channel, note) is reference counted since several sources (eg. the chord and
+a scheduled note) or a voicing with doubled notes can hold the same note.
+
+All the messages for a transition are computed first and written back to back, note offs first.
+Messages are built once per (channel, note, velocity) and reused.
+"""
+
+import threading
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+import mido
+
+CHORD_SOURCE = 'chord'
+
+
+class VoiceAllocator(object):
+    def __init__(self, port):
+        """
+        port: mido output port (or anything with send). If it has send_many, transitions are
+            written with a single send_many call.
+        """
+        self.port = port
+        self._counts: Dict[Tuple[int, int], int] = {}  # (channel, note) -> number of times it's held
+        self._held: Dict[Hashable, Dict[Tuple[int, int], int]] = {}  # source -> its counts
+        self._lock = threading.Lock()
+
+        self._note_ons: Dict[Tuple[int, int, int], mido.Message] = {}
+        self._note_offs: Dict[Tuple[int, int], mido.Message] = {}
+
+        self.messages_sent = 0
+        self.transitions = 0
+
+    def _note_on(self, channel: int, note: int, velocity: int) -> mido.Message:
+        key = (channel, note, velocity)
+        msg = self._note_ons.get(key)
+        if msg is None:
+            msg = self._note_ons[key] = mido.Message('note_on', channel=channel, note=note, velocity=velocity)
+        return msg
+
+    def _note_off(self, channel: int, note: int) -> mido.Message:
+        key = (channel, note)
+        msg = self._note_offs.get(key)
+        if msg is None:
+            msg = self._note_offs[key] = mido.Message('note_off', channel=channel, note=note)
+        return msg
+
+    def play(self, notes: Iterable[int], velocity: int, channel: int = 0,
+             source: Hashable = CHORD_SOURCE) -> List[mido.Message]:
+        """
+        Make source hold exactly notes (replacing what it held before). Returns the messages sent.
+        """
+        if velocity == 0:
+            print("Warning: 0 velocity note on is treated by note off according to MIDI")
+
+        new_held: Dict[Tuple[int, int], int] = {}
+        for note in notes:
+            key = (channel, note)
+            new_held[key] = new_held.get(key, 0) + 1
+
+        counts = self._counts
+        with self._lock:
+            old_held = self._held.get(source, {})
+            note_offs = []
+            note_ons = []
+
+            for key, count in old_held.items():
+                removed = count - new_held.get(key, 0)
+                if removed > 0:
+                    remaining = counts[key] - removed
+                    if remaining > 0:
+                        counts[key] = remaining
+                    else:
+                        del counts[key]
+                        note_offs.append(self._note_off(*key))
+
+            for key, count in new_held.items():
+                added = count - old_held.get(key, 0)
+                if added > 0:
+                    held = counts.get(key, 0)
+                    if not held:
+                        note_ons.append(self._note_on(key[0], key[1], velocity))
+                    counts[key] = held + added
+
+            if new_held:
+                self._held[source] = new_held
+            else:
+                self._held.pop(source, None)
+
+            messages = note_offs + note_ons
+            self._send(messages)
+        return messages
+
+    def release(self, source: Hashable = CHORD_SOURCE) -> List[mido.Message]:
+        """
+        Release every note held by source.
+        """
+        return self.play((), 1, source=source)
+
+    def release_all(self) -> List[mido.Message]:
+        with self._lock:
+            messages = [self._note_off(*key) for key in self._counts]
+            self._counts.clear()
+            self._held.clear()
+            self._send(messages)
+        return messages
+
+    def reset(self):
+        """
+        Forget every held note without sending note offs, eg. when starting a new file.
+        """
+        with self._lock:
+            self._counts.clear()
+            self._held.clear()
+
+    def sounding_notes(self) -> set:
+        return {note for _, note in self._counts}
+
+    def _send(self, messages: List[mido.Message]):
+        if not messages:
+            return
+        self.transitions += 1
+        self.messages_sent += len(messages)
+
+        send_many = getattr(self.port, 'send_many', None)
+        if send_many is not None:
+            send_many(messages)
+            return
+        send = self.port.send
+        for msg in messages:
+            send(msg)
@@ -0,0 +1,167 @@
+"""
+Voice leading: voice each chord close to the one before it instead of on its own.
+
+Every chord has a small set of candidate voicings: each inversion of its close position voicing,
+placed around the voicing center. Candidates are computed once per (chord, voicing center).
+
+Live, VoiceLeader picks the candidate with the least movement from the previous voicing, which is
+a lookup plus an argmin over a handful of candidates. Offline, lead_progression picks the
+candidates for a whole progression at once with dynamic programming, minimizing the total
+movement instead of the movement of each step.
+
+Movement between two voicings is the distance from each note to the nearest note of the other
+voicing, summed both ways, so it also works between chords with different numbers of notes.
+"""
+
+from functools import lru_cache
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import note_util
+from lazy_import import lazy_module
+from fun_chord import FunChord
+
+np = lazy_module('numpy')
+
+
+@lru_cache(maxsize=4096)
+def candidate_voicings(chord: FunChord, voicing_center: int) -> 'np.ndarray':
+    """
+    Candidate voicings for the chord, as a read only (candidate, note) matrix of midi notes sorted
+    by how far they are from the voicing center (most centered first).
+
+    Args:
+        chord: instance of funchord to be voiced.
+        voicing_center: Midi note center of mass for voicing.
+
+    Returns:
+        Every inversion of the chord's pitch classes in close position, with the lowest note
+        between an octave below and a tritone above the voicing center.
+    """
+    scale_root_tone = chord.get_scale_root_tone()
+    root_pitch_class = (scale_root_tone + chord.get_root_tone()) % 12
+
+    # Pitch classes in close position, starting from the chord's root.
+    pitch_classes = sorted({(scale_root_tone + tone) % 12 for tone in chord.tones()},
+                           key=lambda pitch_class: (pitch_class - root_pitch_class) % 12)
+
+    candidates = []
+    for inversion in range(len(pitch_classes)):
+        rotated = pitch_classes[inversion:] + pitch_classes[:inversion]
+        intervals = [(upper - lower) % 12 for lower, upper in zip(rotated, rotated[1:])]
+        offsets = np.cumsum([0] + intervals)
+
+        # Lowest notes within [center - 12, center + 6).
+        lowest = voicing_center - 12 + (rotated[0] - (voicing_center - 12)) % 12
+        while lowest < voicing_center + 6:
+            candidates.append(lowest + offsets)
+            lowest += 12
+
+    candidates = np.array(candidates, dtype=np.int64)
+    distance_from_center = np.abs(candidates.mean(axis=1) - voicing_center)
+    candidates = candidates[np.argsort(distance_from_center, kind='stable')]
+    candidates.flags.writeable = False
+    return candidates
+
+
+def movement(voicings_a: 'np.ndarray', voicings_b: 'np.ndarray') -> 'np.ndarray':
+    """
+    Voice leading distance between voicings (last axis is notes). Other axes broadcast together.
+    """
+    diffs = np.abs(voicings_a[..., :, None] - voicings_b[..., None, :])
+    return diffs.min(axis=-1).sum(axis=-1) + diffs.min(axis=-2).sum(axis=-1)
+
+
+class VoiceLeader(object):
+    """
+    Voices chords one at a time, each as close as possible to the previous one.
+    """
+    def __init__(self, voicing_center: int):
+        self.voicing_center = voicing_center
+        self.previous: Optional['np.ndarray'] = None
+
+    def reset(self, voicing_center: int = None):
+        """
+        Forget the previous voicing, such that the next chord is voiced around the center.
+        """
+        if voicing_center is not None:
+            self.voicing_center = voicing_center
+        self.previous = None
+
+    def voice(self, chord: FunChord) -> Tuple[int, ...]:
+        candidates = candidate_voicings(chord, self.voicing_center)
+        if self.previous is None:
+            best = 0
+        else:
+            best = int(np.argmin(movement(candidates, self.previous)))
+
+        self.previous = candidates[best]
+        return tuple(self.previous.tolist())
+
+
+def lead_progression(chords: Sequence[FunChord],
+                     voicing_center: int,
+                     previous: Sequence[int] = None) -> List[Tuple[int, ...]]:
+    """
+    Voice a whole progression with the least total movement.
+
+    Args:
+        chords: Chords in the order they're played.
+        voicing_center: Midi note center of mass for voicing.
+        previous: Midi notes sounding before the first chord, if any.
+
+    Returns:
+        A tuple of midi notes per chord.
+    """
+    if len(chords) == 0:
+        return []
+
+    candidates = [candidate_voicings(chord, voicing_center) for chord in chords]
+
+    # cost[k] is the least movement to reach candidate k of the current chord.
+    if previous is None:
+        cost = np.zeros(len(candidates[0]))
+    else:
+        cost = movement(candidates[0], np.asarray(previous)).astype(float)
+
+    back_pointers = []
+    for prev_candidates, next_candidates in zip(candidates, candidates[1:]):
+        # (previous candidate, next candidate) distance matrix.
+        distances = movement(prev_candidates[:, None, :], next_candidates[None, :, :])
+        total = cost[:, None] + distances
+        best_prev = total.argmin(axis=0)
+        back_pointers.append(best_prev)
+        cost = total[best_prev, np.arange(len(next_candidates))]
+
+    # Walk back from the cheapest last voicing. Ties go to the most centered candidate.
+    best = int(np.argmin(cost))
+    chosen = [best]
+    for best_prev in reversed(back_pointers):
+        best = int(best_prev[best])
+        chosen.append(best)
+    chosen.reverse()
+
+    return [tuple(candidates[idx][choice].tolist()) for idx, choice in enumerate(chosen)]
+
+
+def voice_leader_from_env(voicing_center: int) -> Optional[VoiceLeader]:
+    """
+    VoiceLeader if FUNCHORDS_VOICE_LEADING is set, None otherwise.
+    """
+    if os.environ.get('FUNCHORDS_VOICE_LEADING'):
+        return VoiceLeader(voicing_center)
+    return None
+
+
+if __name__ == "__main__":
+    center = note_util.name_to_midi('C3')
+    progression = [FunChord('Cmaj', degree) for degree in (1, 6, 2, 5, 1, 4, 7, 3)]
+
+    leader = VoiceLeader(center)
+    results = {
+        'live': [leader.voice(chord) for chord in progression],
+        'offline': lead_progression(progression, center),
+    }
+    for name, voicings in results.items():
+        total = sum(int(movement(np.array(a), np.array(b))) for a, b in zip(voicings, voicings[1:]))
+        print("{:<8} total movement {:>3}: {}".format(name, total, voicings))
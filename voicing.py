@@ -3,20 +3,29 @@
 This file contains a few voicing algorithms to make experimentation easier. All functions take a
 "voicing center", which represents the center of mass for notes, and an octave range. These
 functions convert "tones" (12 notes in scale) to voiced midi notes.
+
+VoicingCache is a bounded LRU cache in front of voice, for the live path where the same few chords
+are played over and over.
+
+voice_many voices a batch of chords at once with numpy, for offline rendering and precomputing
+tables. It returns exactly what calling voice on each chord would.
 """
 
+from collections import OrderedDict
 from enum import Enum, auto
-from typing import List
-from math import ceil
+from functools import lru_cache
+from itertools import chain
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple, Union
 from copy import deepcopy
 
 import note_util
-# from fun_chord import FunChord
+import fretboard
+from lazy_import import lazy_module
 
-DEBUG = False
-def dbprint(string=''):
-    if DEBUG:
-        print(string)
+np = lazy_module('numpy')  # only needed by voice_many and spread_offsets
+# from fun_chord import FunChord
 
 class VoicingType(Enum):
     #TODO: All functions can play an additional note in the bass an octave below?
@@ -33,10 +42,10 @@ class VoicingType(Enum):
     # Wrap notes into an octave range
     WRAP = auto()
 
-    # TODO
+    # Spread notes over two octaves, simple intervals in the bass and tension up top.
     SPREAD = auto()
 
-    # Algorithmically voices chord as they would (might?) be on a guitar.
+    # Voices chords as a playable guitar fingering, see fretboard.
     GUITAR = auto()
 
 voicing_function = {}
@@ -61,31 +70,22 @@ def wrap_tone_around_midi(tone, voicing_center, scale_root_name, wrap_range=12):
     Returns:
         Tone as midi note close to the voicing center.
     """
-    center_octave = note_util.midi_note_octave(voicing_center)
-    midi_note = midify_tone(tone, scale_root_name, center_octave)
+    # Same as midify_tone at the voicing center's octave, without going through note names.
+    midi_note = note_util.note_name_to_number(scale_root_name) + 12 * (voicing_center // 12) + tone
 
     # Since 12 is even, we need bias the wrap to leave more notes above (less muddy) 
     # with 11 // 2 -> 0 1 2 3 4 Center 6 7 8 9 10 11
     bottom_thresh = -1 * ((wrap_range - 1) // 2)
-    top_thresh = (wrap_range // 2)
+    # top_thresh = wrap_range // 2
 
     # Searching for n = number of octave shifts s.t. n is a signed integer and:
-    # voicing_center + bottom_thresh < midi_note + 12*n < voicing_center + top_thresh
+    # voicing_center + bottom_thresh <= midi_note + 12*n <= voicing_center + top_thresh
     # so where diff = voicing_center - midi_note
-    # (diff + bottom_thresh) / 12 < n < (diff + top_thresh) / 12
-    # so the first valid is the first integer above the lower bound, which should be below the upper
-    # bound.
+    # (diff + bottom_thresh) / 12 <= n <= (diff + top_thresh) / 12
+    # so the first valid is the first integer above the lower bound, which is always below the
+    # upper bound since the range spans at least 12 semitones.
     diff = voicing_center - midi_note
-    lower_bound = (diff + bottom_thresh) / 12.
-    upper_bound = (diff + top_thresh) / 12.
-    
-    # dodge floating point weirdness near integers
-    if float(lower_bound).is_integer():
-        lower_bound = int(round(lower_bound))
-
-    octave_shifts = int(ceil(lower_bound))
-    assert octave_shifts < upper_bound, "Wrap algorithm broke: lower_bound ({}) < ceil_lower_bound ({}) is not < upper bound ({})".format(
-        lower_bound, int(ceil(lower_bound)), upper_bound)
+    octave_shifts = -(-(diff + bottom_thresh) // 12)  # integer ceil
 
     return midi_note + 12 * octave_shifts
 
@@ -198,6 +198,57 @@ def wrap_voicing(
 voicing_function[VoicingType.WRAP] = wrap_voicing
 
 
+# Spread voicing scoring.
+# Intervals ranked above this in note_util.interval_consonance (1 is unison, 10 is a minor second)
+# aren't allowed within the bottom octave of a spread voicing. Raise it for spicier voicings.
+SPREAD_SPICE = 7
+INTERVAL_DISSONANCE = [rank - 1 for rank in note_util.interval_consonance]  # interval % 12 -> 0 for unison
+
+@lru_cache(maxsize=4096)
+def spread_offsets(relative_mask: int, spice: int = SPREAD_SPICE) -> Tuple[int, ...]:
+    """
+    Best spread of a set of pitch classes over two octaves above its root.
+
+    Every candidate keeps the root in the bass and places each other pitch class in the first or
+    second octave above it. All candidates are scored at once from the matrix of intervals between
+    their notes: each pair costs its dissonance, less when the notes are octaves apart and more in
+    the low register. Candidates with a harsh interval (ranked above spice) in the bottom octave are
+    dropped, unless that leaves none.
+
+    Args:
+        relative_mask: Pitch classes relative to the root (bit 0, always set), see
+            note_util.tones_to_mask.
+        spice: Harshest interval ranking allowed in the bottom octave.
+
+    Returns:
+        Semitones above the root of each note, sorted.
+    """
+    tones = np.array(note_util.mask_to_tones(relative_mask | 1), dtype=np.int64)
+    interval_dissonance = np.array(INTERVAL_DISSONANCE)
+
+    # (candidate, note) offsets, with every combination of octaves for the notes above the root.
+    octave_choices = (np.arange(1 << (len(tones) - 1))[:, None] >> np.arange(len(tones) - 1)) & 1
+    candidates = np.concatenate([np.zeros((len(octave_choices), 1), dtype=np.int64),
+                                 tones[1:] + 12 * octave_choices], axis=1)
+    candidates.sort(axis=1)
+
+    # (candidate, lower note, upper note) intervals, only the pairs with lower < upper count.
+    lower = candidates[:, :, None]
+    intervals = candidates[:, None, :] - lower
+    pairs = np.triu(np.ones((len(tones), len(tones)), dtype=bool), k=1)
+    dissonance = interval_dissonance[intervals % 12] / (1 + np.abs(intervals) // 12)
+    register_weight = 2 - lower / 24
+    scores = np.where(pairs, dissonance * register_weight, 0.).sum(axis=(1, 2))
+
+    harsh = pairs & (intervals < 12) & (lower < 12) & (interval_dissonance[intervals % 12] + 1 > spice)
+    allowed = ~harsh.any(axis=(1, 2))
+    if allowed.any():
+        scores = np.where(allowed, scores, np.inf)
+
+    # Ties go to the narrowest spread.
+    best = np.lexsort((candidates[:, -1], scores))[0]
+    return tuple(candidates[best].tolist())
+
 def spread_voicing(
         chord: 'FunChord',
         voicing_center: int,
@@ -206,7 +257,8 @@ def spread_voicing(
     ):
     """
     Try to intelligently spread number of voices over two octaves. Fewer, simple notes in the
-    bass, and more dense tension up top.
+    bass, and more dense tension up top. The spread of each set of pitch classes is searched once
+    (see spread_offsets), with the root in the bass an octave below the voicing center.
 
     Inspiration from:
     https://www.thejazzpianosite.com/jazz-piano-lessons/jazz-chord-voicings/chord-voicing-rules/
@@ -215,110 +267,50 @@ def spread_voicing(
     Args:
         chord: instance of funchord to be voiced.
         voicing_center: Midi note center of mass for voicing.
-        voicing_range: Number of octaves spanned by the result, centered on voicing_center.
+        voicing_range: Unused, spreads always span two octaves.
         bass_note: Whether to add a bass note.
 
     Returns:
         A list of midi notes.
     """
-    # TODO: use note_util.sorted_intervals_by_dissonance < 6 to select.
-    # TODO: parametrize acceptable dissonance
-    # bad_intervals = [1, 2]
-    # bad_intervals += [-i for i in bad_intervals]
-    raise NotImplementedError
+    root_tone = chord.get_root_tone()
+    relative_mask = note_util.tones_to_mask([(tone - root_tone) % 12 for tone in chord.tones()])
+    root_midi = wrap_tone_around_midi(root_tone, voicing_center - 12, chord.get_scale_note_name())
 
-voicing_function[VoicingType.SPREAD] = spread_voicing
+    midi_notes = [root_midi + offset for offset in spread_offsets(relative_mask)]
+    if bass_note:
+        return [root_midi - 12] + midi_notes
+    return midi_notes
 
+voicing_function[VoicingType.SPREAD] = spread_voicing
 
-def is_in_lane(tone, lower_bound, upper_bound):
-    """
-    Determine if a tone is within a tone "lane", accounting for octave wraparound.
-    """
-    # Chord tones may be above 12 to represent above octave notes
-    # To check if it's in a lane, we must mod 12 for the comparison to work.
-    tone = tone % 12
-
-    if lower_bound <= upper_bound:
-        # String tones are within one octave eg. 4 and 9 for E and A
-        dbprint("{} <= {} <= {} is {}".format(lower_bound, tone, upper_bound, lower_bound <= tone <= upper_bound))
-        return lower_bound <= tone <= upper_bound
-    else:
-        # String tones wrap around the octave eg. 9 and 2 for A and D
-        dbprint("{} <= {} or {} <= {} is {}".format(tone, lower_bound, upper_bound, tone, tone <= lower_bound or upper_bound <= tone))
-        return tone <= lower_bound or upper_bound <= tone
 
 def guitar_voicing(
         chord: 'FunChord',
         voicing_center: int,
         voicing_range: int,
         bass_note: bool,
+        previous: Optional[Sequence[int]] = None,
     ):
     """
-    Algorithmically voice chords like a guitar. It allocates one note per "string", starting with
-    the lowest notes.
-
-    TODO: The bass notes inversions are pretty bad. Either hardcode that or figure out a better way
-    to allocate notes.
-    TODO: This doesn't guarantee making "usable chords" since it doesn't take hand range into
-    account.
+    Voice chords like a guitar in standard tuning, with a fingering a hand can play (see
+    fretboard). The fretboard is only searched once per set of pitch classes, then this picks the
+    best candidate closest to the voicing center and, with previous, to the previous voicing.
 
     Args:
         chord: instance of funchord to be voiced.
         voicing_center: Midi note center of mass for voicing.
-        voicing_range: Number of octaves spanned by the result, centered on voicing_center.
-        bass_note: Whether to add a bass note.
+        voicing_range: Unused, the guitar's range is fixed.
+        bass_note: Unused, the lowest string is already the bass.
+        previous: Midi notes of the previous chord, for voice leading.
 
     Returns:
         A list of midi notes.
     """
-    # Prep info about each open string
-    octave_center = note_util.midi_note_nearest_name_octave(voicing_center)
-    guitar_note_names = list('EADGBE')
-    # relative_octave_list = [-1, -1, 0, 0, 0, 1]  # TODO: automagically compute?
-    relative_octave_list = [0, 0, 1, 1, 1, 2]  # TODO: automagically compute?
-
-    guitar_midi = []
-    for idx, note in enumerate(guitar_note_names):
-        note_octave = relative_octave_list[idx] + octave_center
-        guitar_midi.append(note_util.name_to_midi(note + str(note_octave)))
-
-    guitar_tones = [note_util.name_to_number[name] for name in guitar_note_names]
-    guitar_tones.append((guitar_tones[-1] + 5) % 12)  # add hypothetical string to make lanes work
-    # TODO: replace "5" with the most common or minimum lane gap.
-
-    # Assign chord tones to each string.
-    midi_notes = []
-
-    chord_tones = chord.tones()
-    tone_idx = 0
-    full_loop_idx = 0
-    for idx, string_tone in enumerate(guitar_tones[:-1]):  # For each lane...
-        next_string_tone = guitar_tones[idx + 1]
-        octave = octave_center + relative_octave_list[idx]
-
-        # do-while loop to try every note once at most per string, then give up
-        full_loop_idx = tone_idx
-        dbprint('full loop idx: {}'.format(full_loop_idx))
-        while True:
-            dbprint('tone_idx: {}'.format(tone_idx))
-            tone = chord_tones[tone_idx]
-            dbprint('trying tone: {}'.format(tone))
-            if is_in_lane(tone, string_tone, next_string_tone):
-                dbprint('Success! with tone: {}'.format(tone))
-                midi_notes.append(note_util.tone_to_midi(tone, octave))
-                tone_idx = (tone_idx + 1) % len(chord_tones)
-                dbprint('\n')
-                break
-                # TODO: for the initial triad, if the first note doesn't fit we're likely to get
-                # 3-1-5, which is a bad voicing (huge leap at the bottom).
-            dbprint('...')
-            tone_idx = (tone_idx + 1) % len(chord_tones)
-            if tone_idx == full_loop_idx:
-                dbprint("Could not place any note in lane.")
-                break
-    dbprint('-'*8+'\n')
-
-    return midi_notes
+    voicing = fretboard.choose(fretboard.chord_voicings(chord), voicing_center, previous)
+    if voicing is None:
+        return []
+    return list(voicing.midi_notes)
 
 voicing_function[VoicingType.GUITAR] = guitar_voicing
 
@@ -347,3 +339,235 @@ def voice(chord: 'FunChord',
 
     voicing = voicing_function[voicing_type]    
     return voicing(chord, voicing_center, voicing_range, bass_note)
+
+
+def voicing_type_from_env(default: VoicingType = VoicingType.WRAP) -> VoicingType:
+    """
+    Voicing type named by FUNCHORDS_VOICING (eg. GUITAR), default if it's not set or unknown.
+    """
+    name = os.environ.get('FUNCHORDS_VOICING')
+    if not name:
+        return default
+    if name.upper() not in VoicingType.__members__:
+        print("Warning: unknown FUNCHORDS_VOICING '{}', using {}.".format(name, default.name))
+        return default
+    return VoicingType[name.upper()]
+
+
+# Cached voicing
+class VoicingCache(object):
+    """
+    Bounded LRU cache of voiced chords.
+
+    Entries are keyed on the chord's canonical key (which includes its scale) and the voicing
+    settings, so changing the scale or voicing center can never return stale notes. Use invalidate
+    after such a change to free the entries that can't be hit anymore.
+    """
+    def __init__(self, capacity: int = 512):
+        assert capacity > 0, "Voicing cache capacity {} <= 0".format(capacity)
+        self.capacity = capacity
+        self._cache = OrderedDict()  # key -> tuple of midi notes, least recently used first
+        self._lock = threading.Lock()  # pads are handled on push2_python's threads
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def voice(self,
+              chord: 'FunChord',
+              voicing_center: int,
+              voicing_range: int,
+              bass_note: bool,
+              voicing_type: VoicingType = VoicingType.ROOT) -> Tuple[int, ...]:
+        """
+        Same as voice, but cached. Returns a tuple since the result is shared.
+        """
+        key = (chord.get_key(), voicing_center, voicing_range, bass_note, voicing_type)
+        with self._lock:
+            midi_notes = self._cache.get(key)
+            if midi_notes is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return midi_notes
+            self.misses += 1
+
+        midi_notes = tuple(voice(chord, voicing_center, voicing_range, bass_note, voicing_type))
+
+        with self._lock:
+            self._cache[key] = midi_notes
+            self._evict()
+        return midi_notes
+
+    def _evict(self):
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+
+    def set_capacity(self, capacity: int):
+        assert capacity > 0, "Voicing cache capacity {} <= 0".format(capacity)
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
+
+    def invalidate(self, scale_name: str = None, voicing_center: int = None):
+        """
+        Drop the entries for a scale and/or voicing center. Drops everything if neither is given.
+        """
+        with self._lock:
+            if scale_name is None and voicing_center is None:
+                self._cache.clear()
+                return
+
+            for key in list(self._cache):
+                chord_key, center = key[0], key[1]
+                if (scale_name is None or chord_key[0] == scale_name) \
+                        and (voicing_center is None or center == voicing_center):
+                    del self._cache[key]
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+        }
+
+# Shared by every chord, see FunChord.midi_notes.
+voicing_cache = VoicingCache()
+
+# Batch voicing
+def wrap_tones_around_midi(tones, voicing_centers, scale_root_tones, wrap_range=12):
+    """
+    Vectorized wrap_tone_around_midi over integer arrays. All arguments must broadcast together,
+    and the scale root is given as a tone (0 is C) rather than a name.
+    """
+    midi_notes = scale_root_tones + 12 * (voicing_centers // 12) + tones
+    bottom_thresh = -1 * ((wrap_range - 1) // 2)
+    octave_shifts = -(-(voicing_centers - midi_notes + bottom_thresh) // 12)
+    return midi_notes + 12 * octave_shifts
+
+def _tone_matrix(chords: Sequence['FunChord']):
+    """
+    Pack the chords' tones into a (chord, tone) matrix padded with zeros. Also returns the number
+    of tones in each chord.
+    """
+    chord_tones = [chord.tones() for chord in chords]
+    lengths = np.fromiter(map(len, chord_tones), dtype=np.int64, count=len(chords))
+    width = int(lengths.max()) if len(chords) else 0
+
+    rows = np.repeat(np.arange(len(chords)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    columns = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+
+    tones = np.zeros((len(chords), width), dtype=np.int64)
+    tones[rows, columns] = np.fromiter(chain.from_iterable(chord_tones), dtype=np.int64,
+                                       count=len(rows))
+    return tones, lengths
+
+def _split_rows(notes: 'np.ndarray', valid: 'np.ndarray') -> List[List[int]]:
+    """
+    Flatten each row of notes where valid, as a list of lists of midi notes.
+    """
+    counts = valid.reshape(len(valid), -1).sum(axis=1)
+    flat_notes = notes[valid].tolist()
+    ends = np.cumsum(counts).tolist()
+    starts = [0] + ends[:-1]
+    return [flat_notes[start:end] for start, end in zip(starts, ends)]
+
+def _root_voice_many(tones, lengths, root_tones, scale_root_tones, centers, ranges, bass_note):
+    # Same as root_voicing
+    root_midis = wrap_tones_around_midi(root_tones, centers, scale_root_tones)
+    notes = root_midis[:, None] + tones - root_tones[:, None]
+    notes[:, 0] = root_midis
+
+    octaves = np.arange(ranges.max())
+    stacked = notes[:, None, :] + 12 * octaves[None, :, None]
+    valid = (octaves[None, :, None] < ranges[:, None, None]) \
+        & (np.arange(tones.shape[1])[None, None, :] < lengths[:, None, None])
+
+    bass = (root_midis - 12)[:, None]
+    bass_valid = np.full(bass.shape, bass_note)
+    return _split_rows(
+        np.concatenate([bass, stacked.reshape(len(tones), -1)], axis=1),
+        np.concatenate([bass_valid, valid.reshape(len(tones), -1)], axis=1))
+
+def _bass_voice_many(tones, lengths, root_tones, scale_root_tones, centers, ranges, bass_note):
+    # Same as bass_voicing
+    root_midis = wrap_tones_around_midi(root_tones, centers, scale_root_tones)
+    return [[note] for note in root_midis.tolist()]
+
+def _wrap_voice_many(tones, lengths, root_tones, scale_root_tones, centers, ranges, bass_note):
+    # Same as wrap_voicing, which adds octaves 1 to voicing_range - 2 and never adds a bass note.
+    notes = wrap_tones_around_midi(tones, centers[:, None], scale_root_tones[:, None])
+
+    octave_counts = np.maximum(ranges - 1, 1)
+    octaves = np.arange(octave_counts.max())
+    stacked = notes[:, None, :] + 12 * octaves[None, :, None]
+    valid = (octaves[None, :, None] < octave_counts[:, None, None]) \
+        & (np.arange(tones.shape[1])[None, None, :] < lengths[:, None, None])
+    return _split_rows(stacked, valid)
+
+batch_voicing_function = {
+    VoicingType.ROOT: _root_voice_many,
+    VoicingType.BASS: _bass_voice_many,
+    VoicingType.WRAP: _wrap_voice_many,
+}
+
+def voice_many(chords: Sequence['FunChord'],
+               voicing_centers: Union[int, Sequence[int]],
+               voicing_ranges: Union[int, Sequence[int]],
+               voicing_type: VoicingType = VoicingType.ROOT,
+               bass_note: bool = True) -> List[List[int]]:
+    """
+    Voice many chords at once. Gives the same result as calling voice on each chord, but computes
+    all of the notes in a few numpy operations instead of one tone at a time.
+
+    Args:
+        chords: instances of funchord to be voiced.
+        voicing_centers: Midi note center of mass for voicing, for all chords or per chord.
+        voicing_ranges: Number of octaves spanned by the result, for all chords or per chord.
+        voicing_type: Algorithm to voice the chords. Types without a batch implementation are voiced
+            one chord at a time.
+        bass_note: Whether to add a bass note.
+
+    Returns:
+        A list of midi notes for each chord.
+    """
+    count = len(chords)
+    centers = np.broadcast_to(np.asarray(voicing_centers, dtype=np.int64), (count,))
+    ranges = np.broadcast_to(np.asarray(voicing_ranges, dtype=np.int64), (count,))
+    assert (ranges > 0).all(), "Voicing range <= 0"
+
+    if count == 0:
+        return []
+
+    if voicing_type not in batch_voicing_function:
+        return [voice(chord, int(center), int(voicing_range), bass_note, voicing_type)
+                for chord, center, voicing_range in zip(chords, centers, ranges)]
+
+    # Chords are interned and batches repeat a lot of them, so only unpack each chord once.
+    chord_rows = {}
+    rows = np.fromiter((chord_rows.setdefault(chord, len(chord_rows)) for chord in chords),
+                       dtype=np.int64, count=count)
+    unique_chords = list(chord_rows)
+
+    tones, lengths = _tone_matrix(unique_chords)
+    root_tones = np.array([chord.get_root_tone() for chord in unique_chords], dtype=np.int64)
+    scale_root_tones = np.array([chord.get_scale_root_tone() for chord in unique_chords],
+                                dtype=np.int64)
+    tones, lengths = tones[rows], lengths[rows]
+    root_tones, scale_root_tones = root_tones[rows], scale_root_tones[rows]
+
+    voicing = batch_voicing_function[voicing_type]
+    return voicing(tones, lengths, root_tones, scale_root_tones, centers, ranges, bass_note)